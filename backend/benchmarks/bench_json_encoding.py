@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: encoding sample rows to a JSON response body
+
+Compares the default FastAPI path (jsonable_encoder + json.dumps on rows that
+hold Decimal/date/datetime values) with FastJSONResponse (orjson on rows whose
+NUMERIC columns were decoded to float by the pool's type codec), and the
+body size of the default row layout with ?format=columnar.
+
+No database is needed; rows are synthetic but shaped like mostres.
+
+Usage (from backend/):
+    python benchmarks/bench_json_encoding.py [--rows 10000 100000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from database import MOSTRES_COLUMNS, MOSTRES_NUMERIC_COLUMNS
+from responses import FastJSONResponse, columnar
+
+LOCATIONS = ["Font de la Plaça", "Dipòsit", "Escola", "Can Torras", "Pavelló"]
+
+
+def make_rows(count: int, as_float: bool):
+    """Synthetic mostres rows; NUMERIC columns as Decimal (asyncpg default) or float (with codec)"""
+    rng = random.Random(42)
+    start = date(2020, 1, 1)
+    rows = []
+    for i in range(count):
+        row = {}
+        for column in MOSTRES_COLUMNS:
+            if column == 'id':
+                row[column] = i + 1
+            elif column == 'data':
+                row[column] = start + timedelta(days=i % 2000)
+            elif column == 'punt_mostreig':
+                row[column] = LOCATIONS[i % len(LOCATIONS)]
+            elif column == 'created_at':
+                row[column] = datetime(2024, 1, 1) + timedelta(minutes=i)
+            elif column == 'validated':
+                row[column] = True
+            elif column in MOSTRES_NUMERIC_COLUMNS:
+                value = round(rng.uniform(0, 500), 2)
+                row[column] = value if as_float else Decimal(f"{value:.2f}")
+        rows.append(row)
+    return rows
+
+
+def time_it(fn, repeat: int) -> float:
+    """Best wall time of `repeat` runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}  {'jsonable_encoder+json':>22}  {'orjson (float rows)':>20}  {'speedup':>8}  {'body MB':>8}"
+          f"  {'columnar MB':>11}  {'orjson (columnar)':>18}")
+    for count in args.rows:
+        decimal_rows = make_rows(count, as_float=False)
+        float_rows = make_rows(count, as_float=True)
+
+        baseline = time_it(lambda: JSONResponse(jsonable_encoder(decimal_rows)), args.repeat)
+        fast = time_it(lambda: FastJSONResponse(float_rows), args.repeat)
+        size = len(FastJSONResponse(float_rows).body) / 1e6
+        columnar_fast = time_it(lambda: FastJSONResponse(columnar(float_rows, MOSTRES_COLUMNS)), args.repeat)
+        columnar_size = len(FastJSONResponse(columnar(float_rows, MOSTRES_COLUMNS)).body) / 1e6
+
+        print(f"{count:>8}  {baseline:>19.1f} ms  {fast:>17.1f} ms  {baseline / fast:>7.1f}x  {size:>8.1f}"
+              f"  {columnar_size:>11.1f}  {columnar_fast:>15.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+In-process response cache for public read endpoints
+
+Entries are keyed by endpoint namespace, query parameters and the current
+dataset generation. Every write path in database.py bumps the generation,
+which drops all cached answers at once, so readers never see data older
+than the last write handled by this process. A TTL bounds staleness for
+writes made outside the API (e.g. manual SQL).
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+
+class ResponseCache:
+    """Bounded LRU cache whose entries are invalidated by a dataset generation number"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: "OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key: Tuple[Hashable, ...], ttl: Optional[float] = None) -> Tuple[bool, Any]:
+        """Return (found, value) for a key in the current generation; ttl overrides the cache-wide TTL"""
+        entry = self._entries.get((self.generation, *key))
+        if entry is None:
+            self._stats["misses"] += 1
+            return False, None
+        stored_at, value = entry
+        ttl = self.ttl if ttl is None else ttl
+        if ttl and time.monotonic() - stored_at > ttl:
+            del self._entries[(self.generation, *key)]
+            self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return False, None
+        self._entries.move_to_end((self.generation, *key))
+        self._stats["hits"] += 1
+        return True, value
+
+    def set(self, key: Tuple[Hashable, ...], value: Any, generation: int):
+        """Store a value computed while `generation` was current; stale results are discarded"""
+        if generation != self.generation or self.max_entries <= 0:
+            return
+        self._entries[(generation, *key)] = (time.monotonic(), value)
+        self._entries.move_to_end((generation, *key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    async def get_or_load(self, key: Tuple[Hashable, ...], loader: Callable[[], Awaitable[Any]],
+                          ttl: Optional[float] = None) -> Any:
+        """Return the cached value for key, calling loader() on a miss"""
+        found, value = self.get(key, ttl)
+        if found:
+            return value
+        generation = self.generation
+        value = await loader()
+        self.set(key, value, generation)
+        return value
+
+    def bump_generation(self):
+        """Invalidate every cached answer (called after each write to the dataset)"""
+        self.generation += 1
+        self._entries.clear()
+        self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "generation": self.generation,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hit_ratio": round(self._stats["hits"] / lookups, 3) if lookups else None,
+        }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL)
+
+
+def query_key(request) -> Tuple[Tuple[str, str], ...]:
+    """Order-independent cache key for a request's query parameters"""
+    return tuple(sorted(request.query_params.multi_items()))
@@ -2,158 +2,1434 @@
 Database operations for the Aigualba backend
 """
 
+import asyncio
+import base64
+import hashlib
+import json
 import os
-import psycopg2
-from typing import List, Dict, Any, Optional
+import time
+import weakref
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from datetime import date, datetime
+from decimal import Decimal
+import asyncpg
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Awaitable, Callable
+
+from cache import response_cache
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-def get_db_connection():
-    """Get a database connection"""
-    conn = psycopg2.connect(DATABASE_URL)
-    return conn
+# Connection pool settings (shared by every router in this worker process)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Idle connections older than this are pinged with SELECT 1 before being handed out
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))
 
-def fetch_parameters() -> List[Dict[str, Any]]:
-    """Fetch water quality parameters from the database"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+# Streaming replicas for read-only queries (comma-separated DSNs); without any, every query goes to DATABASE_URL
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+# Replicas replaying more than this many seconds behind the primary get no reads
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "10"))
+# After a write, the writing client's reads stay on the primary this long so they see it
+# (keep it above DB_REPLICA_MAX_LAG); carried between requests by the DB_REPLICA_PIN_COOKIE cookie
+DB_REPLICA_PIN_SECONDS = float(os.getenv("DB_REPLICA_PIN_SECONDS", "15"))
+DB_REPLICA_PIN_COOKIE = "aigualba_read_primary_until"
+
+# Columns of the mostres table exposed by the sample endpoints, in API order
+MOSTRES_COLUMNS = [
+    'id', 'data', 'punt_mostreig', 'temperatura', 'clor_lliure', 'clor_total',
+    'recompte_escherichia_coli', 'recompte_enterococ', 'recompte_microorganismes_aerobis_22c',
+    'recompte_coliformes_totals', 'conductivitat_20c', 'ph', 'terbolesa', 'color', 'olor', 'sabor',
+    'acid_monocloroacetic', 'acid_dicloroacetic', 'acid_tricloroacetic',
+    'acid_monobromoacetic', 'acid_dibromoacetic', 'created_at', 'validated'
+]
+
+# Measured water quality parameters (numeric columns that accept range filters)
+MOSTRES_NUMERIC_COLUMNS = MOSTRES_COLUMNS[MOSTRES_COLUMNS.index('temperatura'):MOSTRES_COLUMNS.index('created_at')]
+
+# Columns written by bulk ingest (id, timestamps and validated come from the table defaults)
+MOSTRES_INSERT_COLUMNS = ['data', 'punt_mostreig'] + MOSTRES_NUMERIC_COLUMNS
+
+# Parameters derived from measured columns, computed in SQL like the frontend helpers
+# calculate_suma_haloacetics / calculate_clor_combinat_residual do per sample
+_HALOACETIC_COLUMNS = ['acid_monocloroacetic', 'acid_dicloroacetic', 'acid_tricloroacetic',
+                       'acid_monobromoacetic', 'acid_dibromoacetic']
+DERIVED_PARAMETERS = {
+    'suma_haloacetics': (
+        f"CASE WHEN num_nonnulls({', '.join(_HALOACETIC_COLUMNS)}) > 0 "
+        f"THEN {' + '.join(f'COALESCE({c}, 0)' for c in _HALOACETIC_COLUMNS)} END"
+    ),
+    'clor_combinat_residual': "clor_total - clor_lliure",
+}
+
+# Allowed ?bucket= and ?agg= values of the time-series endpoint; 'sample' returns every sample unaggregated
+SERIES_BUCKETS = ('sample', 'day', 'week', 'month')
+SERIES_AGGREGATES = {'mean': 'AVG', 'min': 'MIN', 'max': 'MAX'}
+
+# Fields an admin may edit on an existing sample
+MOSTRES_EDITABLE_FIELDS = {
+    'data', 'punt_mostreig', 'temperatura', 'ph', 'conductivitat_20c',
+    'terbolesa', 'color', 'olor', 'sabor', 'clor_lliure', 'clor_total',
+    'acid_monocloroacetic', 'acid_dicloroacetic', 'acid_tricloroacetic',
+    'acid_monobromoacetic', 'acid_dibromoacetic',
+    'recompte_escherichia_coli', 'recompte_enterococ',
+    'recompte_microorganismes_aerobis_22c', 'recompte_coliformes_totals',
+    'validated'
+}
+
+
+# Upper bound for the ?limit= parameter of paginated sample listings
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within DB_POOL_TIMEOUT"""
+
+
+def _new_pool_counters() -> Dict[str, int]:
+    return {
+        "checkouts": 0,
+        "waits": 0,
+        "timeouts": 0,
+        "discarded": 0,
+        "in_use": 0,
+        "max_in_use": 0,
+    }
+
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_init_lock = asyncio.Lock()
+# Release time per underlying connection. The pool wraps it in a new proxy on every acquire, so
+# the proxy cannot be the key; weak keys let connections the pool closes drop out on their own
+_last_released: "weakref.WeakKeyDictionary[asyncpg.Connection, float]" = weakref.WeakKeyDictionary()
+_pool_counters = _new_pool_counters()
+
+
+class _Replica:
+    """A read replica: its pool (opened by the health checks), health and replay lag"""
+
+    def __init__(self, index: int, url: str):
+        self.name = f"replica-{index}"
+        self.url = url
+        self.pool: Optional[asyncpg.Pool] = None
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.counters = {**_new_pool_counters(), "reads": 0, "failures": 0}
+
+    def mark_down(self, error: Exception):
+        self.healthy = False
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.counters["failures"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "last_error": self.last_error,
+            **self.counters,
+            "open_connections": self.pool.get_size() if self.pool else 0,
+        }
+
+
+_replicas: List[_Replica] = [_Replica(index, url) for index, url in enumerate(DATABASE_REPLICA_URLS)]
+_replica_turn = 0
+# Reads sent to the primary because their client had just written
+_pin_counters = {"pinned_reads": 0}
+_replica_monitor: Optional[asyncio.Task] = None
+# Server of the connection checked out by the current task, so prepared statements are looked up per server
+_current_server: ContextVar[str] = ContextVar("db_server", default="primary")
+# Connection of the read_snapshot() the current task is in, reused by its read-only checkouts
+_snapshot: ContextVar[Optional[asyncpg.Connection]] = ContextVar("db_snapshot", default=None)
+
+# Lag is 0 while a streaming replica has replayed everything it received (an idle primary
+# does not make a replica stale); a server not in recovery is treated as current. A replica
+# that is not streaming receives no WAL, so received = replayed proves nothing: NULL (down)
+_REPLICA_STATUS_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+_PUBLIC_LISTING = (f"SELECT {', '.join(MOSTRES_COLUMNS)} FROM mostres WHERE validated = TRUE{{}} "
+                   f"ORDER BY data DESC, created_at DESC, id DESC")
+
+# Hot statements, prepared on every pooled connection when it is opened and then run by name
+# (run_prepared). Their text matches what the generic builders produce for the same request.
+PREPARED_STATEMENTS: Dict[str, str] = {
+    # Unfiltered public listing with every column (fetch_mostres without filters or fields)
+    'mostres_all': _PUBLIC_LISTING.format(''),
+    'mostres_first_page': _PUBLIC_LISTING.format('') + " LIMIT $1",
+    'mostres_next_page': _PUBLIC_LISTING.format(" AND (data, created_at, id) < ($1, $2, $3)") + " LIMIT $4",
+    'mostre_by_id': f"SELECT {', '.join(MOSTRES_COLUMNS)} FROM mostres WHERE id = $1 AND validated = TRUE",
+    'pending_count': "SELECT COUNT(*) FROM mostres WHERE validated = false",
+    # Same predicate as idx_visits_pending_session
+    'visit_ip_update': """
+        WITH updated AS (
+            UPDATE visits
+            SET ip_address = $2
+            WHERE session_id = $1
+              AND (ip_address IS NULL OR ip_address IN ('', 'pending'))
+              AND timestamp >= NOW() - make_interval(secs => $3)
+            RETURNING 1
+        )
+        SELECT COUNT(*) FROM updated
+    """,
+    # Visit batches: times are given as seconds since queueing and resolved on the database clock,
+    # in the session time zone like the CURRENT_TIMESTAMP default of visits.timestamp
+    'visit_insert': """
+        WITH inserted AS (
+            INSERT INTO visits (page, user_agent, ip_address, session_id, timestamp)
+            SELECT page, user_agent, ip_address, session_id, LOCALTIMESTAMP - make_interval(secs => age)
+            FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::float8[])
+                AS v(page, user_agent, ip_address, session_id, age)
+            RETURNING 1
+        )
+        SELECT COUNT(*) FROM inserted
+    """,
+}
+
+# Prepared statements per live connection, keyed by server name and backend pid
+_prepared: Dict[Tuple[str, int], Dict[str, asyncpg.prepared_stmt.PreparedStatement]] = {}
+# Statements whose planning time was already sampled on each live connection
+_plan_sampled: Dict[Tuple[str, int], set] = {}
+_statement_counters: Dict[str, Dict[str, float]] = {
+    name: {"prepares": 0, "prepare_ms": 0.0, "plans": 0, "plan_ms": 0.0,
+           "executions": 0, "exec_ms": 0.0, "max_exec_ms": 0.0}
+    for name in PREPARED_STATEMENTS
+}
+
+
+async def _set_type_codecs(conn: asyncpg.Connection):
+    """NUMERIC is decoded straight to float instead of Decimal"""
+    await conn.set_type_codec('numeric', schema='pg_catalog', encoder=str, decoder=float, format='text')
+
+
+async def _prepare(conn, name: str) -> asyncpg.prepared_stmt.PreparedStatement:
+    """Parse and describe a registry statement; Postgres plans it later, on execution"""
+    started = time.monotonic()
+    statement = await conn.prepare(PREPARED_STATEMENTS[name])
+    counters = _statement_counters[name]
+    counters["prepares"] += 1
+    counters["prepare_ms"] += (time.monotonic() - started) * 1000
+    return statement
+
+
+async def _sample_plan_time(conn, name: str, args: Tuple[Any, ...]):
+    """Record a registry statement's planning time with these arguments, from EXPLAIN (SUMMARY)"""
     try:
-        cur.execute("SELECT name, value, updated_at FROM parameters;")
-        rows = cur.fetchall()
-        return [{"name": r[0], "value": r[1], "updated_at": r[2]} for r in rows]
-    finally:
-        cur.close()
-        conn.close()
+        plan = await conn.fetchval(f"EXPLAIN (SUMMARY, FORMAT JSON) {PREPARED_STATEMENTS[name]}", *args)
+    except asyncpg.PostgresError:
+        return
+    counters = _statement_counters[name]
+    counters["plans"] += 1
+    counters["plan_ms"] += json.loads(plan)[0]["Planning Time"]
+
+
+def _forget_connection(key: Tuple[str, int]):
+    _prepared.pop(key, None)
+    _plan_sampled.pop(key, None)
+
+
+async def _init_connection(conn: asyncpg.Connection, server: str = "primary"):
+    """Per-connection setup: type codecs, then the PREPARED_STATEMENTS registry"""
+    await _set_type_codecs(conn)
+    key = (server, conn.get_server_pid())
+    statements = _prepared[key] = {}
+    conn.add_termination_listener(lambda _: _forget_connection(key))
+    for name in PREPARED_STATEMENTS:
+        try:
+            statements[name] = await _prepare(conn, name)
+        except asyncpg.PostgresError:
+            # e.g. a migration not applied yet: run_prepared retries on first use and reports the error
+            pass
+
+
+async def run_prepared(conn, name: str, method: str, *args) -> Any:
+    """Run a PREPARED_STATEMENTS entry by name with fetch/fetchrow/fetchval
+
+    Statements missing on this connection are prepared on the spot. A
+    statement invalidated by the server (e.g. after a schema change) is
+    prepared again and retried once. The first run of each statement on a
+    connection is followed by an EXPLAIN (SUMMARY) to sample its planning time.
+    """
+    key = (_current_server.get(), conn.get_server_pid())
+    statements = _prepared.setdefault(key, {})
+    counters = _statement_counters[name]
+    for attempt in range(2):
+        statement = statements.get(name)
+        if statement is None:
+            statement = statements[name] = await _prepare(conn, name)
+        started = time.monotonic()
+        try:
+            result = await getattr(statement, method)(*args)
+        except (asyncpg.InvalidSQLStatementNameError, asyncpg.InvalidCachedStatementError):
+            statements.pop(name, None)
+            if attempt:
+                raise
+            continue
+        elapsed = (time.monotonic() - started) * 1000
+        counters["executions"] += 1
+        counters["exec_ms"] += elapsed
+        counters["max_exec_ms"] = max(counters["max_exec_ms"], elapsed)
+        sampled = _plan_sampled.setdefault(key, set())
+        if name not in sampled:
+            sampled.add(name)
+            await _sample_plan_time(conn, name, args)
+        return result
+
+
+def statement_stats() -> Dict[str, Any]:
+    """Prepare (parse), planning and execution timings (ms) of each registry statement in this worker
 
-def fetch_mostres() -> List[Dict[str, Any]]:
-    """Fetch all sample data from mostres table"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+    Execution times include planning: a prepared statement is planned when it
+    runs, not when it is prepared. avg_plan_ms comes from EXPLAIN (SUMMARY)
+    samples, one per statement and connection.
+    """
+    return {
+        name: {
+            "prepares": counters["prepares"],
+            "prepare_ms": round(counters["prepare_ms"], 2),
+            "plan_samples": counters["plans"],
+            "avg_plan_ms": round(counters["plan_ms"] / counters["plans"], 3) if counters["plans"] else None,
+            "executions": counters["executions"],
+            "avg_exec_ms": round(counters["exec_ms"] / counters["executions"], 3) if counters["executions"] else None,
+            "max_exec_ms": round(counters["max_exec_ms"], 2),
+        }
+        for name, counters in _statement_counters.items()
+    }
+
+
+async def init_pool() -> asyncpg.Pool:
+    """Create the process-wide connection pool (called on application startup)
+
+    Replica pools are opened by the background health checks, so a replica
+    that is down never delays startup.
+    """
+    global _pool, _replica_monitor
+    async with _pool_init_lock:
+        if _pool is None:
+            if not DATABASE_URL:
+                raise RuntimeError("DATABASE_URL environment variable not set")
+            _pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                init=_init_connection,
+            )
+            if _replicas and _replica_monitor is None:
+                _replica_monitor = asyncio.create_task(_monitor_replicas())
+    return _pool
+
+
+async def close_pool():
+    """Close every pooled connection (called on application shutdown)"""
+    global _pool, _replica_monitor
+    async with _pool_init_lock:
+        if _replica_monitor is not None:
+            _replica_monitor.cancel()
+            try:
+                await _replica_monitor
+            except asyncio.CancelledError:
+                pass
+            _replica_monitor = None
+        for replica in _replicas:
+            if replica.pool is not None:
+                await replica.pool.close()
+                replica.pool = None
+                replica.healthy = False
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+async def _check_replica(replica: _Replica):
+    """Open the replica's pool if needed and measure its replay lag"""
     try:
-        cur.execute("""
-            SELECT id, data, punt_mostreig, temperatura, clor_lliure, clor_total,
-                   recompte_escherichia_coli, recompte_enterococ, recompte_microorganismes_aerobis_22c,
-                   recompte_coliformes_totals, conductivitat_20c, ph, terbolesa, color, olor, sabor,
-                   acid_monocloroacetic, acid_dicloroacetic, acid_tricloroacetic,
-                   acid_monobromoacetic, acid_dibromoacetic, created_at, validated
-            FROM mostres 
-            WHERE validated = TRUE
-            ORDER BY data DESC, created_at DESC
-        """)
-        rows = cur.fetchall()
-        
-        columns = [
-            'id', 'data', 'punt_mostreig', 'temperatura', 'clor_lliure', 'clor_total',
-            'recompte_escherichia_coli', 'recompte_enterococ', 'recompte_microorganismes_aerobis_22c',
-            'recompte_coliformes_totals', 'conductivitat_20c', 'ph', 'terbolesa', 'color', 'olor', 'sabor',
-            'acid_monocloroacetic', 'acid_dicloroacetic', 'acid_tricloroacetic',
-            'acid_monobromoacetic', 'acid_dibromoacetic', 'created_at', 'validated'
-        ]
-        
-        return [dict(zip(columns, row)) for row in rows]
+        if replica.pool is None:
+            replica.pool = await asyncpg.create_pool(
+                replica.url,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                init=partial(_init_connection, server=replica.name),
+                timeout=DB_POOL_TIMEOUT,
+            )
+        async with replica.pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            replica.lag = await conn.fetchval(_REPLICA_STATUS_QUERY)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        replica.mark_down(e)
+        return
+    if replica.lag is None:
+        replica.healthy = False
+        replica.last_error = "Not streaming from the primary"
+        return
+    replica.healthy = replica.lag <= DB_REPLICA_MAX_LAG
+    replica.last_error = None if replica.healthy else f"Replay lag {replica.lag:.1f}s above {DB_REPLICA_MAX_LAG}s"
+
+
+async def _monitor_replicas():
+    while True:
+        await asyncio.gather(*(_check_replica(replica) for replica in _replicas))
+        await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+
+class ClientPin:
+    """Read-your-writes state of the client behind the current request
+
+    pinned_until is a wall-clock timestamp shared by every worker through the
+    DB_REPLICA_PIN_COOKIE cookie; wrote tells the middleware to send it back.
+    """
+
+    def __init__(self, pinned_until: float = 0.0):
+        self.pinned_until = pinned_until
+        self.wrote = False
+
+    @classmethod
+    def from_cookie(cls, value: Optional[str]) -> "ClientPin":
+        """Pin carried by the request cookie; malformed or far-future values are ignored"""
+        try:
+            pinned_until = float(value) if value else 0.0
+        except ValueError:
+            pinned_until = 0.0
+        if not 0.0 <= pinned_until <= time.time() + DB_REPLICA_PIN_SECONDS:
+            pinned_until = 0.0
+        return cls(pinned_until)
+
+    def active(self) -> bool:
+        return time.time() < self.pinned_until
+
+
+_client_pin: ContextVar[Optional[ClientPin]] = ContextVar("db_client_pin", default=None)
+
+
+def bind_client_pin(pin: ClientPin):
+    """Make pin the read-your-writes state of the current request; returns the token to reset it with"""
+    return _client_pin.set(pin)
+
+
+def reset_client_pin(token):
+    _client_pin.reset(token)
+
+
+def pin_primary(seconds: float = DB_REPLICA_PIN_SECONDS):
+    """Serve the current client's reads from the primary for the next `seconds`, so it sees its own write"""
+    pin = _client_pin.get()
+    if pin is not None:
+        pin.pinned_until = max(pin.pinned_until, time.time() + seconds)
+        pin.wrote = True
+
+
+def _after_write():
+    """Called after every write to the dataset: drop cached answers and read your own writes"""
+    response_cache.bump_generation()
+    pin_primary()
+
+
+def _next_replica() -> Optional[_Replica]:
+    """Round-robin over the healthy replicas; None when there are none or the client's reads are pinned"""
+    global _replica_turn
+    if not _replicas:
+        return None
+    pin = _client_pin.get()
+    if pin is not None and pin.active():
+        _pin_counters["pinned_reads"] += 1
+        return None
+    for _ in range(len(_replicas)):
+        replica = _replicas[_replica_turn % len(_replicas)]
+        _replica_turn += 1
+        if replica.healthy and replica.pool is not None:
+            return replica
+    return None
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Pool size and saturation counters for monitoring"""
+    if _pool is None:
+        return {"initialized": False, "min_size": DB_POOL_MIN_SIZE, "max_size": DB_POOL_MAX_SIZE}
+    return {
+        "initialized": True,
+        **_pool_counters,
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "open_connections": _pool.get_size(),
+        "idle": _pool.get_idle_size(),
+        "saturation": round(_pool_counters["in_use"] / _pool.get_max_size(), 3),
+        "replicas": [replica.stats() for replica in _replicas],
+        **_pin_counters,
+    }
+
+
+def _raw_connection(conn) -> asyncpg.Connection:
+    """The connection behind a pool proxy"""
+    return getattr(conn, '_con', None) or conn
+
+
+async def _is_healthy(conn) -> bool:
+    if conn.is_closed():
+        return False
+    last_released = _last_released.get(_raw_connection(conn))
+    if last_released is not None and time.monotonic() - last_released < DB_POOL_PING_AFTER:
+        return True
+    try:
+        await conn.execute("SELECT 1")
+        return True
+    except (asyncpg.PostgresError, OSError):
+        return False
+
+
+async def _acquire(pool: asyncpg.Pool, counters: Dict[str, int]):
+    if counters["in_use"] >= pool.get_max_size():
+        counters["waits"] += 1
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        counters["timeouts"] += 1
+        raise PoolTimeoutError(
+            f"No database connection available after {DB_POOL_TIMEOUT}s "
+            f"(pool max size {pool.get_max_size()})"
+        )
+    return conn
+
+
+@asynccontextmanager
+async def _checkout(pool: asyncpg.Pool, counters: Dict[str, int]):
+    # Retry once per pool slot so a burst of stale connections
+    # (e.g. after a database restart) is flushed in one checkout
+    for _ in range(pool.get_max_size() + 1):
+        conn = await _acquire(pool, counters)
+        if await _is_healthy(conn):
+            break
+        _last_released.pop(_raw_connection(conn), None)
+        conn.terminate()
+        await pool.release(conn)
+        counters["discarded"] += 1
+    else:
+        raise asyncpg.InterfaceError("Could not obtain a healthy database connection")
+
+    counters["checkouts"] += 1
+    counters["in_use"] += 1
+    counters["max_in_use"] = max(counters["max_in_use"], counters["in_use"])
+    try:
+        yield conn
     finally:
-        cur.close()
-        conn.close()
+        counters["in_use"] -= 1
+        _last_released[_raw_connection(conn)] = time.monotonic()
+        await pool.release(conn)
 
-def create_mostre(mostre_data: Dict[str, Any]) -> int:
-    """Create a new sample entry with validated=FALSE by default and return the new ID"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+
+@asynccontextmanager
+async def get_db_connection(read_only: bool = False):
+    """Check out a pooled database connection and return it to the pool afterwards
+
+    With read_only=True the connection comes from the next healthy replica
+    (DATABASE_REPLICA_URLS), unless reads are pinned to the primary after a
+    recent write. A replica that cannot hand out a connection is marked down
+    and the primary is used instead. Inside read_snapshot() read-only
+    checkouts get the snapshot's connection.
+    """
+    snapshot = _snapshot.get() if read_only else None
+    if snapshot is not None:
+        yield snapshot
+        return
+    pool = _pool or await init_pool()
+    replica = _next_replica() if read_only else None
+    async with AsyncExitStack() as stack:
+        conn = None
+        if replica is not None:
+            try:
+                conn = await stack.enter_async_context(_checkout(replica.pool, replica.counters))
+                replica.counters["reads"] += 1
+            except (OSError, PoolTimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                replica.mark_down(e)
+                replica = None
+        if conn is None:
+            conn = await stack.enter_async_context(_checkout(pool, _pool_counters))
+        server = _current_server.set(replica.name if replica is not None else "primary")
+        try:
+            yield conn
+        finally:
+            _current_server.reset(server)
+
+
+@asynccontextmanager
+async def read_snapshot():
+    """Serve every read of the block from one read-only REPEATABLE READ transaction
+
+    The reads share one connection (a replica when available) and one
+    snapshot, so values read together, e.g. a response body and the
+    fingerprint that versions it, always describe the same state.
+    """
+    conn = _snapshot.get()
+    if conn is not None:
+        yield conn
+        return
+    async with get_db_connection(read_only=True) as conn:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            token = _snapshot.set(conn)
+            try:
+                yield conn
+            finally:
+                _snapshot.reset(token)
+
+
+def _mostres_select(columns: List[str]) -> str:
+    return ", ".join(columns)
+
+
+def validate_fields(fields: List[str]) -> List[str]:
+    """Check a sparse fieldset against the mostres columns, dropping duplicates
+
+    Raises ValueError naming the unknown fields.
+    """
+    unknown = [field for field in fields if field not in MOSTRES_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(fields))
+
+
+def _project(rows: List[Dict[str, Any]], selected: List[str], wanted: List[str]) -> List[Dict[str, Any]]:
+    """Drop helper columns that were only selected for sorting or paging"""
+    if len(selected) == len(wanted):
+        return rows
+    return [{column: row[column] for column in wanted} for row in rows]
+
+
+# Editable mostres columns that cannot be cleared
+MOSTRES_REQUIRED_FIELDS = ('data', 'punt_mostreig', 'validated')
+
+
+def parse_bool(value: Any) -> bool:
+    """Strict boolean from JSON or a form: true/false, 1/0 (or their strings); ValueError otherwise"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ('true', '1', 'false', '0'):
+        return value.strip().lower() in ('true', '1')
+    raise ValueError(f"Not a boolean: {value!r}")
+
+
+def _coerce_mostre_value(field: str, value: Any) -> Any:
+    """Convert loosely-typed JSON values into the Python types asyncpg expects
+
+    An empty value clears a measurement (NULL) but is rejected for the required
+    fields. Raises ValueError for values of the wrong type.
+    """
+    if value is None or value == '':
+        if field in MOSTRES_REQUIRED_FIELDS:
+            raise ValueError(f"{field} cannot be empty")
+        return None
+    if field == 'data' and isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if field == 'validated':
+        try:
+            return parse_bool(value)
+        except ValueError:
+            raise ValueError(f"validated must be true or false, got {value!r}")
+    if field == 'punt_mostreig':
+        return str(value)
+    if isinstance(value, str):
+        return float(value)
+    return value
+
+
+async def fetch_parameters() -> List[Dict[str, Any]]:
+    """Fetch water quality parameters from the database"""
+    async with get_db_connection(read_only=True) as conn:
+        rows = await conn.fetch("SELECT name, value, updated_at FROM parameters;")
+        return [dict(r) for r in rows]
+
+
+def encode_cursor(kind: str, sample: Dict[str, Any]) -> str:
+    """Build an opaque pagination cursor pointing just after the given sample"""
+    key = [kind, sample['data'].isoformat(), sample['created_at'].isoformat(), sample['id']]
+    if kind == 'admin':
+        key.append(sample['validated'])
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(kind: str, cursor: str) -> Tuple[Any, ...]:
+    """Parse a cursor built by encode_cursor, raising ValueError if it is malformed"""
     try:
-        # Build dynamic query based on provided fields
-        fields = []
-        values = []
-        placeholders = []
-        
-        for field, value in mostre_data.items():
-            if value is not None:
-                fields.append(field)
-                values.append(value)
-                placeholders.append("%s")
-        
-        if not fields:
-            raise ValueError("At least one field must be provided")
-        
-        # Explicitly set validated to FALSE for new submissions
-        fields.append('validated')
-        values.append(False)
-        placeholders.append("%s")
-        
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw)
+        if key[0] != kind:
+            raise ValueError
+        values = (date.fromisoformat(key[1]), datetime.fromisoformat(key[2]), int(key[3]))
+        if kind == 'admin':
+            if not isinstance(key[4], bool):
+                raise ValueError
+            values += (key[4],)
+        return values
+    except (ValueError, TypeError, IndexError, json.JSONDecodeError):
+        raise ValueError("Invalid pagination cursor")
+
+
+def _mostres_filter_conditions(filters: Optional[Dict[str, Any]], values: List[Any]) -> List[str]:
+    """Translate sample filters into SQL conditions, appending their parameters to values
+
+    Supported keys: date_from / date_to (inclusive dates), locations (list of
+    sampling points) and ranges ({column: (min, max)}, either bound may be None).
+    """
+    conditions: List[str] = []
+    if not filters:
+        return conditions
+
+    if filters.get('date_from') is not None:
+        values.append(filters['date_from'])
+        conditions.append(f"data >= ${len(values)}")
+    if filters.get('date_to') is not None:
+        values.append(filters['date_to'])
+        conditions.append(f"data <= ${len(values)}")
+    if filters.get('locations'):
+        values.append(list(filters['locations']))
+        conditions.append(f"punt_mostreig = ANY(${len(values)}::text[])")
+
+    for column, (low, high) in sorted((filters.get('ranges') or {}).items()):
+        if column not in MOSTRES_NUMERIC_COLUMNS:
+            raise ValueError(f"Unknown parameter for range filter: {column}")
+        if low is not None:
+            values.append(low)
+            conditions.append(f"{column} >= ${len(values)}")
+        if high is not None:
+            values.append(high)
+            conditions.append(f"{column} <= ${len(values)}")
+
+    return conditions
+
+
+async def _fetch_mostres_page(
+    kind: str,
+    limit: Optional[int],
+    cursor: Optional[str],
+    filters: Optional[Dict[str, Any]] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Shared keyset pagination for the public and admin sample listings
+
+    Rows are ordered by (data, created_at, id) descending; the admin listing
+    additionally puts unvalidated samples first. The id tiebreaker makes the
+    order total, so a cursor always resumes exactly after the last row seen.
+    Every sort key is NOT NULL (migration 0006), which the row comparisons
+    and the cursor rely on.
+    """
+    output_columns = fields or MOSTRES_COLUMNS
+    select_columns = list(output_columns)
+    if limit is not None:
+        # The cursor is built from the sort key, even if the caller did not ask for it
+        cursor_keys = ['data', 'created_at', 'id'] + (['validated'] if kind == 'admin' else [])
+        select_columns += [column for column in cursor_keys if column not in select_columns]
+
+    values: List[Any] = []
+    conditions = _mostres_filter_conditions(filters, values)
+
+    # The plain public listing is common enough to run as a prepared statement (same text as built below)
+    statement = None
+    if kind == 'public' and not conditions and fields is None:
+        statement = 'mostres_all' if limit is None else ('mostres_next_page' if cursor else 'mostres_first_page')
+
+    if kind == 'public':
+        conditions.append("validated = TRUE")
+        order_by = "data DESC, created_at DESC, id DESC"
+    else:
+        order_by = "validated ASC, data DESC, created_at DESC, id DESC"
+
+    if cursor:
+        after = decode_cursor(kind, cursor)
+        values.extend(after[:3])
+        n = len(values)
+        keyset = f"(data, created_at, id) < (${n - 2}, ${n - 1}, ${n})"
+        if kind == 'admin':
+            values.append(after[3])
+            n = len(values)
+            keyset = f"(validated > ${n} OR (validated = ${n} AND {keyset}))"
+        conditions.append(keyset)
+
+    query = f"SELECT {_mostres_select(select_columns)} FROM mostres"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {order_by}"
+    if limit is not None:
+        # Fetch one extra row to know whether there is a next page
+        values.append(limit + 1)
+        query += f" LIMIT ${len(values)}"
+
+    async with get_db_connection(read_only=(kind == 'public')) as conn:
+        if statement:
+            rows = [dict(row) for row in await run_prepared(conn, statement, 'fetch', *values)]
+        else:
+            rows = [dict(row) for row in await conn.fetch(query, *values)]
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(kind, rows[-1])
+    return _project(rows, select_columns, output_columns), next_cursor
+
+
+def _mostres_export_query(columns: List[str], filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """Unpaginated public listing query used by the exports (same filters and order as fetch_mostres)"""
+    values: List[Any] = []
+    conditions = _mostres_filter_conditions(filters, values) + ["validated = TRUE"]
+    query = (f"SELECT {_mostres_select(columns)} FROM mostres WHERE {' AND '.join(conditions)} "
+             f"ORDER BY data DESC, created_at DESC, id DESC")
+    return query, values
+
+
+async def copy_mostres_csv(
+    columns: List[str],
+    filters: Optional[Dict[str, Any]],
+    output: Callable[[bytes], Awaitable[None]],
+):
+    """Stream validated samples as CSV (no header) through COPY, calling output for each chunk
+
+    COPY pauses while output is awaiting, so a slow consumer applies
+    backpressure all the way to Postgres instead of buffering rows here.
+    """
+    query, values = _mostres_export_query(columns, filters)
+    async with get_db_connection(read_only=True) as conn:
+        await conn.copy_from_query(query, *values, output=output, format='csv')
+
+
+async def iter_mostres_chunks(
+    columns: List[str],
+    filters: Optional[Dict[str, Any]],
+    chunk_size: int,
+) -> AsyncIterator[List[asyncpg.Record]]:
+    """Yield validated samples in chunks from a server-side cursor"""
+    query, values = _mostres_export_query(columns, filters)
+    async with get_db_connection(read_only=True) as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(query, *values)
+            while True:
+                rows = await cursor.fetch(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+
+async def fetch_mostres(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Fetch validated samples from mostres table, newest first
+
+    Without a limit every matching sample is returned; fields narrows the
+    selected columns (all of MOSTRES_COLUMNS by default). Returns the rows and
+    the cursor of the next page (None on the last page).
+    """
+    return await _fetch_mostres_page('public', limit, cursor, filters, fields)
+
+
+async def fetch_mostre(sample_id: int, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Fetch one validated sample by primary key, or None if it is not visible"""
+    async with get_db_connection(read_only=True) as conn:
+        if fields is None:
+            row = await run_prepared(conn, 'mostre_by_id', 'fetchrow', sample_id)
+            return dict(row) if row else None
+        row = await conn.fetchrow(f"""
+            SELECT {_mostres_select(fields or MOSTRES_COLUMNS)}
+            FROM mostres
+            WHERE id = $1 AND validated = TRUE
+        """, sample_id)
+        return dict(row) if row else None
+
+
+async def fetch_mostres_by_ids(sample_ids: List[int], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Fetch several validated samples in one round trip, in the order requested
+
+    Ids that do not exist or are not validated are silently skipped.
+    """
+    output_columns = fields or MOSTRES_COLUMNS
+    select_columns = list(output_columns) + ([] if 'id' in output_columns else ['id'])
+    async with get_db_connection(read_only=True) as conn:
+        rows = await conn.fetch(f"""
+            SELECT {_mostres_select(select_columns)}
+            FROM mostres
+            WHERE id = ANY($1::int[]) AND validated = TRUE
+        """, sample_ids)
+    by_id = {row['id']: dict(row) for row in rows}
+    ordered = [by_id[sample_id] for sample_id in dict.fromkeys(sample_ids) if sample_id in by_id]
+    return _project(ordered, select_columns, output_columns)
+
+
+async def fetch_latest_mostre(location: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Latest validated sample of a sampling point (or of any point) from the mostres_latest snapshot
+
+    Ties on date are broken by completeness (number of reported parameters).
+    """
+    columns = ", ".join(f"m.{column}" for column in MOSTRES_COLUMNS)
+    query = f"""
+        SELECT {columns}, l.completeness
+        FROM mostres_latest l
+        JOIN mostres m ON m.id = l.sample_id
+    """
+    values: List[Any] = []
+    if location:
+        values.append(location)
+        query += " WHERE l.punt_mostreig = $1"
+    query += " ORDER BY l.data DESC, l.completeness DESC LIMIT 1"
+
+    async with get_db_connection(read_only=True) as conn:
+        row = await conn.fetchrow(query, *values)
+        return dict(row) if row else None
+
+
+async def count_mostres(validated_only: bool = True, filters: Optional[Dict[str, Any]] = None) -> int:
+    """Count samples matching the filters, by default only the publicly visible (validated) ones"""
+    values: List[Any] = []
+    conditions = _mostres_filter_conditions(filters, values)
+    if validated_only:
+        conditions.append("validated = TRUE")
+    query = "SELECT COUNT(*) FROM mostres"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    async with get_db_connection(read_only=True) as conn:
+        return await conn.fetchval(query, *values)
+
+
+def parameter_expression(parameter: str) -> str:
+    """SQL expression for a measured or derived parameter, raising ValueError if unknown"""
+    if parameter in MOSTRES_NUMERIC_COLUMNS:
+        return parameter
+    if parameter in DERIVED_PARAMETERS:
+        return f"({DERIVED_PARAMETERS[parameter]})"
+    raise ValueError(f"Unknown parameter: {parameter}")
+
+
+async def fetch_mostres_series(
+    parameter: str,
+    bucket: str = 'day',
+    agg: str = 'mean',
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Aggregate a parameter of the validated samples into time buckets, per sampling point
+
+    Returns one entry per location with parallel dates / values / counts
+    arrays, dates ascending. Samples without a value for the parameter are
+    ignored. With bucket='sample' every sample is its own point (agg is not
+    applied and each count is 1).
+    """
+    if bucket not in SERIES_BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(SERIES_BUCKETS)}")
+    if agg not in SERIES_AGGREGATES:
+        raise ValueError(f"agg must be one of: {', '.join(SERIES_AGGREGATES)}")
+    expression = parameter_expression(parameter)
+
+    values: List[Any] = []
+    conditions = ["validated = TRUE", f"{expression} IS NOT NULL"]
+    conditions += _mostres_filter_conditions(filters, values)
+
+    if bucket == 'sample':
         query = f"""
-            INSERT INTO mostres ({', '.join(fields)})
-            VALUES ({', '.join(placeholders)})
-            RETURNING id
+            SELECT punt_mostreig, data AS bucket, ({expression})::float8 AS value, 1 AS samples
+            FROM mostres
+            WHERE {' AND '.join(conditions)}
+            ORDER BY punt_mostreig, data, created_at, id
         """
-        
-        cur.execute(query, values)
-        new_id = cur.fetchone()[0]
-        conn.commit()
-        return new_id
-    finally:
-        cur.close()
-        conn.close()
+    else:
+        values.append(bucket)
+        query = f"""
+            SELECT punt_mostreig,
+                   date_trunc(${len(values)}, data::timestamp)::date AS bucket,
+                   {SERIES_AGGREGATES[agg]}({expression})::float8 AS value,
+                   COUNT(*) AS samples
+            FROM mostres
+            WHERE {' AND '.join(conditions)}
+            GROUP BY punt_mostreig, bucket
+            ORDER BY punt_mostreig, bucket
+        """
+    async with get_db_connection(read_only=True) as conn:
+        rows = await conn.fetch(query, *values)
 
-def fetch_all_mostres() -> List[Dict[str, Any]]:
-    """Fetch ALL sample data from mostres table (including unvalidated) - ADMIN ONLY"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT id, data, punt_mostreig, temperatura, clor_lliure, clor_total,
-                   recompte_escherichia_coli, recompte_enterococ, recompte_microorganismes_aerobis_22c,
-                   recompte_coliformes_totals, conductivitat_20c, ph, terbolesa, color, olor, sabor,
-                   acid_monocloroacetic, acid_dicloroacetic, acid_tricloroacetic,
-                   acid_monobromoacetic, acid_dibromoacetic, created_at, validated
-            FROM mostres 
-            ORDER BY validated ASC, data DESC, created_at DESC
+    series: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        entry = series.setdefault(row['punt_mostreig'], {
+            "location": row['punt_mostreig'], "dates": [], "values": [], "counts": []
+        })
+        entry["dates"].append(row['bucket'])
+        entry["values"].append(row['value'])
+        entry["counts"].append(row['samples'])
+    return list(series.values())
+
+
+async def fetch_mostres_fingerprint(read_only: bool = False) -> Dict[str, Any]:
+    """Cheap change fingerprint of the mostres table (row count, newest update, highest id)
+
+    Every write path touches at least one of these: inserts raise the count
+    and max id, validation changes and edits refresh updated_at, deletes
+    lower the count. Read on the primary by default: it versions the dataset
+    (change events, If-None-Match checks) and must never step back to an
+    older replica state. read_only=True reads it where the other reads of a
+    read_snapshot() come from, to version a body read there.
+    """
+    async with get_db_connection(read_only=read_only) as conn:
+        row = await conn.fetchrow("""
+            SELECT COUNT(*) AS row_count,
+                   MAX(updated_at) AS updated_at,
+                   MAX(id) AS max_id
+            FROM mostres
         """)
-        rows = cur.fetchall()
-        
-        columns = [
-            'id', 'data', 'punt_mostreig', 'temperatura', 'clor_lliure', 'clor_total',
-            'recompte_escherichia_coli', 'recompte_enterococ', 'recompte_microorganismes_aerobis_22c',
-            'recompte_coliformes_totals', 'conductivitat_20c', 'ph', 'terbolesa', 'color', 'olor', 'sabor',
-            'acid_monocloroacetic', 'acid_dicloroacetic', 'acid_tricloroacetic',
-            'acid_monobromoacetic', 'acid_dibromoacetic', 'created_at', 'validated'
-        ]
-        
-        return [dict(zip(columns, row)) for row in rows]
-    finally:
-        cur.close()
-        conn.close()
+        return dict(row)
+
+
+def dataset_version(fingerprint: Dict[str, Any]) -> str:
+    """Opaque token identifying the current state of mostres (shared by every worker)"""
+    return hashlib.sha1(
+        f"{fingerprint['row_count']}|{fingerprint['updated_at']}|{fingerprint['max_id']}".encode()
+    ).hexdigest()[:16]
+
+
+async def count_pending_mostres() -> int:
+    """Count samples that are waiting for admin validation"""
+    async with get_db_connection(read_only=True) as conn:
+        return await run_prepared(conn, 'pending_count', 'fetchval')
+
+
+async def create_mostre(mostre_data: Dict[str, Any]) -> int:
+    """Create a new sample entry with validated=FALSE by default and return the new ID"""
+    # Build dynamic query based on provided fields
+    fields = []
+    values = []
+
+    for field, value in mostre_data.items():
+        if value is not None:
+            fields.append(field)
+            values.append(value)
+
+    if not fields:
+        raise ValueError("At least one field must be provided")
+
+    # Explicitly set validated to FALSE for new submissions
+    fields.append('validated')
+    values.append(False)
+    placeholders = [f"${i}" for i in range(1, len(values) + 1)]
+
+    query = f"""
+        INSERT INTO mostres ({', '.join(fields)})
+        VALUES ({', '.join(placeholders)})
+        RETURNING id
+    """
+
+    async with get_db_connection() as conn:
+        new_id = await conn.fetchval(query, *values)
+    _after_write()
+    return new_id
+
+
+async def fetch_all_mostres(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Fetch ALL sample data from mostres table (including unvalidated) - ADMIN ONLY
+
+    Unvalidated samples come first. Returns the rows and the cursor of the
+    next page (None on the last page).
+    """
+    return await _fetch_mostres_page('admin', limit, cursor, filters, fields)
 
-def validate_mostre(sample_id: int) -> bool:
+
+async def bulk_create_mostres(samples: List[Dict[str, Any]]) -> int:
+    """Insert many samples (validated=FALSE) with a single COPY in one transaction, returning the row count"""
+    if not samples:
+        return 0
+    records = [
+        tuple(
+            Decimal(str(sample.get(column))) if column in MOSTRES_NUMERIC_COLUMNS and sample.get(column) is not None
+            else sample.get(column)
+            for column in MOSTRES_INSERT_COLUMNS
+        )
+        for sample in samples
+    ]
+
+    async with get_db_connection() as conn:
+        # Binary COPY needs asyncpg's built-in NUMERIC codec, not the float text codec set in _set_type_codecs
+        await conn.reset_type_codec('numeric', schema='pg_catalog')
+        try:
+            async with conn.transaction():
+                status = await conn.copy_records_to_table('mostres', records=records, columns=MOSTRES_INSERT_COLUMNS)
+        finally:
+            await _set_type_codecs(conn)
+    _after_write()
+    return _affected_rows(status)
+
+
+async def validate_mostre(sample_id: int) -> bool:
     """Validate a sample (set validated=TRUE) - ADMIN ONLY"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            UPDATE mostres 
-            SET validated = TRUE, updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (sample_id,))
-        
-        success = cur.rowcount > 0
-        conn.commit()
-        return success
-    finally:
-        cur.close()
-        conn.close()
+    return await set_mostre_validation(sample_id, True)
 
-def invalidate_mostre(sample_id: int) -> bool:
+
+async def invalidate_mostre(sample_id: int) -> bool:
     """Invalidate a sample (set validated=FALSE) - ADMIN ONLY"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+    return await set_mostre_validation(sample_id, False)
+
+
+async def set_mostre_validation(sample_id: int, validated: bool) -> bool:
+    """Set the validation flag of a sample, returning False if it does not exist - ADMIN ONLY"""
+    async with get_db_connection() as conn:
+        status = await conn.execute("""
+            UPDATE mostres
+            SET validated = $1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $2
+        """, validated, sample_id)
+    _after_write()
+    return _affected_rows(status) > 0
+
+
+async def bulk_set_mostres_validation(sample_ids: List[int], validated: bool) -> int:
+    """Set the validation flag of several samples at once and return how many changed - ADMIN ONLY"""
+    async with get_db_connection() as conn:
+        status = await conn.execute("""
+            UPDATE mostres
+            SET validated = $1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ANY($2::int[])
+        """, validated, sample_ids)
+    _after_write()
+    return _affected_rows(status)
+
+
+async def delete_mostre(sample_id: int) -> bool:
+    """Delete a sample, returning False if it does not exist - ADMIN ONLY"""
+    async with get_db_connection() as conn:
+        status = await conn.execute("DELETE FROM mostres WHERE id = $1", sample_id)
+    _after_write()
+    return _affected_rows(status) > 0
+
+
+async def update_mostre(sample_id: int, sample_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Update the editable fields of a sample and return the updated row - ADMIN ONLY
+
+    Returns None if the sample does not exist. Raises ValueError if no editable
+    field was provided.
+    """
+    update_fields = []
+    values = []
+
+    for field, value in sample_data.items():
+        if field in MOSTRES_EDITABLE_FIELDS:
+            values.append(_coerce_mostre_value(field, value))
+            update_fields.append(f"{field} = ${len(values)}")
+
+    if not update_fields:
+        raise ValueError("No valid fields to update")
+
+    values.append(sample_id)  # For WHERE clause
+
+    async with get_db_connection() as conn:
+        row = await conn.fetchrow(f"""
+            UPDATE mostres
+            SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ${len(values)}
+            RETURNING *
+        """, *values)
+    _after_write()
+    return dict(row) if row else None
+
+
+async def fetch_admin_samples() -> List[Dict[str, Any]]:
+    """Fetch all samples ordered by submission time for the admin dashboard - ADMIN ONLY"""
+    async with get_db_connection() as conn:
+        rows = await conn.fetch(f"""
+            SELECT {_mostres_select(MOSTRES_COLUMNS)}
+            FROM mostres
+            ORDER BY created_at DESC
+        """)
+        return [dict(row) for row in rows]
+
+
+# Visits before this day are in the rollup tables (visits_daily*, visits_monthly); later ones are
+# read live. '-infinity' until the first refresh_visit_rollups() run, i.e. everything is live
+_VISITS_TAIL_START = "COALESCE((SELECT next_day FROM visits_rollup_state WHERE id = 1), '-infinity'::date)"
+_VALID_VISIT_IP = "ip_address IS NOT NULL AND ip_address NOT IN ('', 'pending')"
+# How long after a visit its session may still fill in the client IP
+VISIT_IP_UPDATE_WINDOW_SECONDS = float(os.getenv("VISIT_IP_UPDATE_WINDOW_SECONDS", "300"))
+
+
+async def _timed_query(timings: Dict[str, float], name: str, method: str, query: str, *args) -> Any:
+    """Run one query on its own pooled connection, recording its wall time (ms, including the pool wait)"""
+    started = time.monotonic()
+    async with get_db_connection(read_only=True) as conn:
+        result = await getattr(conn, method)(query, *args)
+    timings[name] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+async def fetch_admin_statistics() -> Dict[str, Any]:
+    """Sample and visit counters for the admin dashboard - ADMIN ONLY
+
+    The sample counters come from one statement and each visit aggregate from
+    another; the four run concurrently on separate pooled connections. The
+    per-query timings are returned under "timings".
+    """
+    timings: Dict[str, float] = {}
+
+    # Totals, samples per location and the five latest samples in one pass over mostres
+    samples_query = """
+        WITH totals AS (
+            SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE validated) AS validated FROM mostres
+        ),
+        by_location AS (
+            SELECT punt_mostreig, COUNT(*) AS samples FROM mostres GROUP BY punt_mostreig
+        ),
+        recent AS (
+            SELECT id, data, punt_mostreig, validated, created_at
+            FROM mostres
+            ORDER BY created_at DESC
+            LIMIT 5
+        )
+        SELECT
+            t.total,
+            t.validated,
+            (SELECT COALESCE(json_agg(json_build_array(punt_mostreig, samples) ORDER BY samples DESC), '[]')
+             FROM by_location) AS by_location,
+            (SELECT COALESCE(json_agg(recent ORDER BY created_at DESC), '[]') FROM recent) AS recent
+        FROM totals t
+    """
+
+    # Visitor statistics come from the rollup tables for complete days plus the live tail of visits
+    # (see _VISITS_TAIL_START), so their cost does not grow with the size of visits
+
+    # Unique visitors by IP per day for the last 7 days
+    visits_daily_query = f"""
+        WITH tail AS (SELECT {_VISITS_TAIL_START} AS start_day),
+        since AS (SELECT (NOW() - INTERVAL '7 days')::date AS day)
+        SELECT day AS visit_date, unique_visitors
+        FROM visits_daily
+        WHERE day >= (SELECT day FROM since) AND day < (SELECT start_day FROM tail)
+        UNION ALL
+        SELECT timestamp::date, COUNT(DISTINCT ip_address) FILTER (WHERE {_VALID_VISIT_IP})
+        FROM visits
+        WHERE timestamp >= GREATEST((SELECT start_day FROM tail), (SELECT day FROM since))
+        GROUP BY 1
+        ORDER BY visit_date ASC
+    """
+
+    # Unique visitors by IP per month for the last year
+    visits_monthly_query = f"""
+        WITH tail AS (SELECT {_VISITS_TAIL_START} AS start_day),
+        months AS (
+            SELECT generate_series(
+                DATE_TRUNC('month', NOW() - INTERVAL '1 year'),
+                DATE_TRUNC('month', NOW()),
+                INTERVAL '1 month'
+            )::date as month_date
+        ),
+        open_month_visitors AS (
+            -- Months not closed in visits_monthly yet
+            SELECT DATE_TRUNC('month', day)::date AS month_date, ip_address
+            FROM visits_daily_visitors
+            WHERE day >= DATE_TRUNC('month', (SELECT start_day FROM tail))
+              AND day < (SELECT start_day FROM tail)
+            UNION
+            SELECT DATE_TRUNC('month', timestamp)::date, ip_address
+            FROM visits
+            WHERE timestamp >= (SELECT start_day FROM tail) AND {_VALID_VISIT_IP}
+        )
+        SELECT
+            m.month_date,
+            COALESCE(vm.unique_visitors, COUNT(DISTINCT o.ip_address)) as unique_visitors
+        FROM months m
+        LEFT JOIN visits_monthly vm ON vm.month = m.month_date
+        LEFT JOIN open_month_visitors o ON o.month_date = m.month_date
+        GROUP BY m.month_date, vm.unique_visitors
+        ORDER BY m.month_date ASC
+    """
+
+    # Total unique visitors for the last 30 days
+    unique_visitors_query = f"""
+        WITH tail AS (SELECT {_VISITS_TAIL_START} AS start_day),
+        since AS (SELECT (NOW() - INTERVAL '30 days')::date AS day)
+        SELECT COUNT(DISTINCT ip_address) FROM (
+            SELECT ip_address FROM visits_daily_visitors
+            WHERE day >= (SELECT day FROM since) AND day < (SELECT start_day FROM tail)
+            UNION ALL
+            SELECT ip_address FROM visits
+            WHERE timestamp >= GREATEST((SELECT start_day FROM tail), (SELECT day FROM since))
+              AND {_VALID_VISIT_IP}
+        ) ips
+    """
+
+    started = time.monotonic()
+    samples, visits_daily, visits_monthly, unique_visitors_30_days = await asyncio.gather(
+        _timed_query(timings, "samples", "fetchrow", samples_query),
+        _timed_query(timings, "visits_daily", "fetch", visits_daily_query),
+        _timed_query(timings, "visits_monthly", "fetch", visits_monthly_query),
+        _timed_query(timings, "visitors_30d", "fetchval", unique_visitors_query),
+    )
+    timings["total"] = round((time.monotonic() - started) * 1000, 1)
+
+    return {
+        "total_samples": samples["total"],
+        "validated_samples": samples["validated"],
+        "samples_by_location": [tuple(r) for r in json.loads(samples["by_location"])],
+        # Dates and timestamps arrive as ISO 8601 strings from json_agg
+        "recent_samples": json.loads(samples["recent"]),
+        "visits_daily": [tuple(r) for r in visits_daily],
+        "visits_monthly": [tuple(r) for r in visits_monthly],
+        "unique_visitors_30_days": unique_visitors_30_days,
+        "timings": timings,
+    }
+
+
+async def fetch_visits_statistics(days: int) -> Dict[str, Any]:
+    """Visit counters by day and by page for the last N days (whole days, from the rollups) - ADMIN ONLY"""
+    window = f"""
+        WITH tail AS (SELECT {_VISITS_TAIL_START} AS start_day),
+        since AS (SELECT (NOW() - make_interval(days => $1))::date AS day)
+    """
+    rolled_up = "day >= (SELECT day FROM since) AND day < (SELECT start_day FROM tail)"
+    live = "timestamp >= GREATEST((SELECT start_day FROM tail), (SELECT day FROM since))"
+
+    async with get_db_connection(read_only=True) as conn:
+        daily_visits = await conn.fetch(f"""
+            {window}
+            SELECT day AS visit_date, visits, unique_visitors
+            FROM visits_daily
+            WHERE {rolled_up}
+            UNION ALL
+            SELECT timestamp::date, COUNT(*), COUNT(DISTINCT ip_address) FILTER (WHERE {_VALID_VISIT_IP})
+            FROM visits
+            WHERE {live}
+            GROUP BY 1
+            ORDER BY visit_date ASC
+        """, days)
+
+        page_visits = await conn.fetch(f"""
+            {window},
+            page_counts AS (
+                SELECT page, SUM(visits)::bigint AS visits FROM (
+                    SELECT page, visits FROM visits_daily_pages WHERE {rolled_up}
+                    UNION ALL
+                    SELECT page, COUNT(*) FROM visits WHERE {live} GROUP BY page
+                ) counts
+                GROUP BY page
+            ),
+            page_visitors AS (
+                SELECT page, COUNT(DISTINCT ip_address) AS unique_visitors FROM (
+                    SELECT page, ip_address FROM visits_daily_visitors WHERE {rolled_up}
+                    UNION ALL
+                    SELECT page, ip_address FROM visits WHERE {live} AND {_VALID_VISIT_IP}
+                ) ips
+                GROUP BY page
+            )
+            SELECT c.page, c.visits, COALESCE(u.unique_visitors, 0) AS unique_visitors
+            FROM page_counts c
+            LEFT JOIN page_visitors u ON u.page = c.page
+            ORDER BY c.visits DESC
+        """, days)
+
+        totals = await conn.fetchrow(f"""
+            {window}
+            SELECT
+                (SELECT COALESCE(SUM(visits), 0)::bigint FROM visits_daily WHERE {rolled_up})
+                + (SELECT COUNT(*) FROM visits WHERE {live}) as total_visits,
+                (SELECT COUNT(DISTINCT ip_address) FROM (
+                    SELECT ip_address FROM visits_daily_visitors WHERE {rolled_up}
+                    UNION ALL
+                    SELECT ip_address FROM visits WHERE {live} AND {_VALID_VISIT_IP}
+                ) ips) as total_unique_visitors
+        """, days)
+
+        return {
+            "daily_visits": [tuple(r) for r in daily_visits],
+            "page_visits": [tuple(r) for r in page_visits],
+            "totals": tuple(totals) if totals else None,
+        }
+
+
+async def fetch_index_usage(table: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Scan counters and sizes of the user indexes (pg_stat_user_indexes), optionally for one table - ADMIN ONLY
+
+    idx_tup_fetch below idx_tup_read means some scans were answered from the
+    index alone (index-only scans); visible_pages_ratio is the share of the
+    table the visibility map lets them skip.
+    """
+    async with get_db_connection() as conn:
+        rows = await conn.fetch("""
+            SELECT
+                s.relname AS table_name,
+                s.indexrelname AS index_name,
+                s.idx_scan,
+                s.idx_tup_read,
+                s.idx_tup_fetch,
+                pg_relation_size(s.indexrelid) AS index_bytes,
+                i.indisvalid AS is_valid,
+                pg_get_indexdef(s.indexrelid) AS definition,
+                t.seq_scan AS table_seq_scan,
+                t.n_live_tup AS table_live_rows,
+                CASE WHEN c.relpages > 0 THEN round(c.relallvisible::numeric / c.relpages, 3) END AS visible_pages_ratio
+            FROM pg_stat_user_indexes s
+            JOIN pg_index i ON i.indexrelid = s.indexrelid
+            JOIN pg_stat_user_tables t ON t.relid = s.relid
+            JOIN pg_class c ON c.oid = s.relid
+            WHERE $1::text IS NULL OR s.relname = $1
+            ORDER BY s.relname, s.idx_scan DESC, s.indexrelname
+        """, table)
+        return [dict(row) for row in rows]
+
+
+async def refresh_visit_rollups(lag_seconds: float, max_days: int = 31) -> int:
+    """Roll up complete days of visits (older than the lag), returning how many days were added"""
+    async with get_db_connection() as conn:
+        return await conn.fetchval(
+            "SELECT refresh_visit_rollups((NOW() - make_interval(secs => $1))::date, $2)",
+            float(lag_seconds), max_days
+        )
+
+
+async def ensure_visit_partitions(months_ahead: int) -> int:
+    """Create the missing monthly visits partitions up to N months ahead, returning how many were created"""
+    async with get_db_connection() as conn:
+        return await conn.fetchval("SELECT ensure_visit_partitions($1)", months_ahead)
+
+
+async def expire_visit_partitions(retention_months: int, archive: bool) -> int:
+    """Detach and drop (or archive) visits partitions older than the retention, returning how many"""
+    async with get_db_connection() as conn:
+        return await conn.fetchval("SELECT expire_visit_partitions($1, $2)", retention_months, archive)
+
+
+async def insert_visits(visits: List[Tuple[str, str, str, Optional[str], float]]) -> int:
+    """Store a batch of (page, user_agent, ip_address, session_id, queued_at) visits in one statement
+
+    queued_at is a time.monotonic() reading; the visit time is the database
+    clock minus the time spent queued. Returns the row count.
+    """
+    if not visits:
+        return 0
+    now = time.monotonic()
+    pages, user_agents, ips, sessions, queued = zip(*visits)
+    ages = [max(now - queued_at, 0.0) for queued_at in queued]
+    async with get_db_connection() as conn:
+        return await run_prepared(conn, 'visit_insert', 'fetchval',
+                                  list(pages), list(user_agents), list(ips), list(sessions), ages)
+
+
+async def update_pending_visit_ips(session_id: str, ip_address: str) -> int:
+    """Fill in the IP of a session's recent visits recorded before the client IP was known"""
+    async with get_db_connection() as conn:
+        # Matches idx_visits_pending_session exactly, so only this session's pending rows are
+        # touched; the time bound keeps the lookup to the current partition
+        return await run_prepared(conn, 'visit_ip_update', 'fetchval',
+                                  session_id, ip_address, VISIT_IP_UPDATE_WINDOW_SECONDS)
+
+
+def _affected_rows(status: str) -> int:
+    """Parse the row count out of an asyncpg command status such as 'UPDATE 3'"""
     try:
-        cur.execute("""
-            UPDATE mostres 
-            SET validated = FALSE, updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (sample_id,))
-        
-        success = cur.rowcount > 0
-        conn.commit()
-        return success
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        return int(status.split()[-1])
+    except (AttributeError, IndexError, ValueError):
+        return 0
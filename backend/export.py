@@ -0,0 +1,142 @@
+"""
+Streaming sample exports (CSV and XLSX)
+
+CSV is produced by Postgres itself through COPY and relayed chunk by chunk.
+COPY is started (and its first chunk awaited) before the response begins,
+so a failure to start still becomes a 5xx instead of a truncated 200.
+
+XLSX is not streamed: rows are read from a server-side cursor and written by
+xlsxwriter in constant_memory mode to a temporary file, and the finished
+file is then served. Either way memory use does not grow with the export size.
+"""
+
+import asyncio
+import csv
+import io
+import os
+import shutil
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import xlsxwriter
+
+from database import copy_mostres_csv, iter_mostres_chunks
+
+# Column headers in Catalan and their corresponding mostres columns
+EXPORT_COLUMNS = [
+    ('ID', 'id'),
+    ('Data de recollida', 'data'),
+    ('Punt de mostreig', 'punt_mostreig'),
+    ('pH', 'ph'),
+    ('Temperatura (°C)', 'temperatura'),
+    ('Conductivitat 20°C (μS/cm)', 'conductivitat_20c'),
+    ('Terbolesa (UNF)', 'terbolesa'),
+    ('Color (mg/L Pt-Co)', 'color'),
+    ('Olor (índex dilució 25°C)', 'olor'),
+    ('Sabor (índex dilució 25°C)', 'sabor'),
+    ('Clor lliure (mg/L)', 'clor_lliure'),
+    ('Clor total (mg/L)', 'clor_total'),
+    ('E. coli (NPM/100mL)', 'recompte_escherichia_coli'),
+    ('Enterococs (NPM/100mL)', 'recompte_enterococ'),
+    ('Microorganismes aerobis 22°C (UFC/1mL)', 'recompte_microorganismes_aerobis_22c'),
+    ('Coliformes totals (NMP/100mL)', 'recompte_coliformes_totals'),
+    ('Àcid monocloroacètic (μg/L)', 'acid_monocloroacetic'),
+    ('Àcid dicloroacètic (μg/L)', 'acid_dicloroacetic'),
+    ('Àcid tricloroacètic (μg/L)', 'acid_tricloroacetic'),
+    ('Àcid monobromoacètic (μg/L)', 'acid_monobromoacetic'),
+    ('Àcid dibromoacètic (μg/L)', 'acid_dibromoacetic'),
+]
+EXPORT_HEADERS = [header for header, _ in EXPORT_COLUMNS]
+EXPORT_FIELDS = [column for _, column in EXPORT_COLUMNS]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+# COPY chunks buffered between Postgres and the HTTP client before COPY is paused
+EXPORT_QUEUE_CHUNKS = 8
+
+_END = object()
+
+
+async def start_csv_export(filters: Optional[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Start COPY and wait for its first chunk, then return the stream: Catalan header line and COPY output
+
+    Errors up to the first chunk (no connection, bad filter) are raised here,
+    before anything is sent to the client.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+
+    async def produce():
+        try:
+            await copy_mostres_csv(EXPORT_FIELDS, filters, queue.put)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        first = await queue.get()
+    except BaseException:
+        producer.cancel()
+        raise
+    if isinstance(first, Exception):
+        raise first
+
+    async def stream() -> AsyncIterator[bytes]:
+        header = io.StringIO()
+        csv.writer(header).writerow(EXPORT_HEADERS)
+        chunk = first
+        try:
+            yield header.getvalue().encode('utf-8')
+            while chunk is not _END:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+                chunk = await queue.get()
+        finally:
+            # Client went away (or COPY failed): stop reading from Postgres
+            if not producer.done():
+                producer.cancel()
+
+    return stream()
+
+
+def _write_rows(sheet, first_row: int, rows: List[Any]):
+    for offset, row in enumerate(rows):
+        sheet.write_row(first_row + offset, 0, list(row))
+
+
+async def build_xlsx_export(filters: Optional[Dict[str, Any]]) -> str:
+    """Write the whole workbook to a temporary file and return its path
+
+    Not streamed: the file is complete before the response starts, so errors
+    become a 5xx. Remove it with remove_export once it has been sent.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="aigualba-export-")
+    try:
+        path = os.path.join(tmpdir, "mostres.xlsx")
+        workbook = xlsxwriter.Workbook(path, {
+            'constant_memory': True,
+            'tmpdir': tmpdir,
+            'default_date_format': 'yyyy-mm-dd',
+        })
+        sheet = workbook.add_worksheet('Mostres')
+        sheet.write_row(0, 0, EXPORT_HEADERS, workbook.add_format({'bold': True}))
+
+        next_row = 1
+        async for rows in iter_mostres_chunks(EXPORT_FIELDS, filters, EXPORT_CHUNK_ROWS):
+            # xlsxwriter is synchronous; keep the event loop free while it serializes
+            await asyncio.to_thread(_write_rows, sheet, next_row, rows)
+            next_row += len(rows)
+        await asyncio.to_thread(workbook.close)
+        return path
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+
+def remove_export(path: str):
+    """Delete a file made by build_xlsx_export together with its temporary directory"""
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
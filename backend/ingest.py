@@ -0,0 +1,91 @@
+"""
+Bulk sample ingest (NDJSON or CSV)
+
+Every row is validated with MostreData. Rows that pass are loaded together
+by bulk_create_mostres (one COPY, one transaction), and failures are
+reported per row. CSV headers may be the mostres column names or the
+Catalan headers written by the export, so an exported file can be loaded
+again as-is.
+"""
+
+import csv
+import io
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from export import EXPORT_COLUMNS
+from models import MostreData
+
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "100000"))
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("BULK_MAX_REPORTED_ERRORS", "1000"))
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+
+_HEADER_ALIASES = {header: column for header, column in EXPORT_COLUMNS}
+
+
+def _ndjson_rows(text: str):
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Each line must be a JSON object"
+            continue
+        yield line_number, row, None
+
+
+def _csv_rows(text: str):
+    reader = csv.DictReader(io.StringIO(text))
+    if reader.fieldnames:
+        reader.fieldnames = [_HEADER_ALIASES.get(name.strip(), name.strip()) for name in reader.fieldnames]
+    for row in reader:
+        # Data rows start on line 2; empty cells mean "not measured"
+        yield reader.line_num, {key: (value if value != '' else None) for key, value in row.items() if key}, None
+
+
+def parse_bulk_samples(body: bytes, content_type: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
+    """Validate an upload, returning (valid rows, errors, rows received)
+
+    Raises ValueError for an unsupported content type or an oversized upload.
+    Errors carry the line number in the upload and always a list of
+    {"field", "message"} problems (field is None when the line did not parse).
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    text = body.decode("utf-8-sig")
+    if media_type in NDJSON_CONTENT_TYPES:
+        rows = _ndjson_rows(text)
+    elif media_type in CSV_CONTENT_TYPES:
+        rows = _csv_rows(text)
+    else:
+        raise ValueError("Content-Type must be application/x-ndjson or text/csv")
+
+    valid: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    received = 0
+    for line_number, row, problem in rows:
+        received += 1
+        if received > BULK_MAX_ROWS:
+            raise ValueError(f"At most {BULK_MAX_ROWS} rows can be uploaded at once")
+        if problem is not None:
+            # Unparseable line: same shape as a validation error, without a field
+            problem = [{"field": None, "message": problem}]
+        else:
+            try:
+                valid.append(MostreData(**row).dict())
+                continue
+            except ValidationError as e:
+                problem = [
+                    {"field": ".".join(str(part) for part in error["loc"]), "message": error["msg"]}
+                    for error in e.errors()
+                ]
+        errors.append({"line": line_number, "errors": problem})
+    return valid, errors, received
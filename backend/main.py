@@ -1,13 +1,75 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
 
+from database import (PoolTimeoutError, init_pool, close_pool, pool_stats, statement_stats, ClientPin,
+                      bind_client_pin, reset_client_pin, DB_REPLICA_PIN_COOKIE, DB_REPLICA_PIN_SECONDS)
+from cache import response_cache
+from responses import FastJSONResponse
+from visit_buffer import visit_buffer
+from visit_maintenance import visit_maintenance_job
+from notifications import change_listener, sample_events
 from routers import parameters_router, samples_router, public_router
 from routers.admin_router import router as admin_router
 
+
+class ReadYourWritesMiddleware:
+    """Pin a client's reads to the primary shortly after it writes (DB_REPLICA_PIN_COOKIE)
+
+    Only the writing client is pinned; everyone else keeps reading from the
+    replicas. Plain ASGI, so streamed responses (exports, SSE) pass through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        pin = ClientPin.from_cookie(Request(scope).cookies.get(DB_REPLICA_PIN_COOKIE))
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and pin.wrote:
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{DB_REPLICA_PIN_COOKIE}={pin.pinned_until:.3f}; Max-Age={int(DB_REPLICA_PIN_SECONDS) + 1}; "
+                    f"Path=/; HttpOnly; SameSite=lax",
+                )
+            await send(message)
+
+        token = bind_client_pin(pin)
+        try:
+            await self.app(scope, receive, send_with_pin)
+        finally:
+            reset_client_pin(token)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks"""
+    await init_pool()
+    await visit_buffer.start()
+    await visit_maintenance_job.start()
+    await sample_events.start()
+    await change_listener.start()
+    yield
+    await change_listener.stop()
+    await sample_events.stop()
+    await visit_maintenance_job.stop()
+    await visit_buffer.stop()
+    await close_pool()
+
+
 app = FastAPI(
     title="Aigualba API", 
     description="API for water quality management",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # Add CORS middleware
@@ -17,7 +79,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "Link", "ETag", "Last-Modified"],
 )
+app.add_middleware(ReadYourWritesMiddleware)
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    """The connection pool is saturated: ask clients to retry instead of queueing forever"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database busy, please retry"},
+        headers={"Retry-After": "1"},
+    )
 
 # Include routers
 app.include_router(parameters_router)
@@ -27,6 +100,25 @@ app.include_router(admin_router)
 
 
 @app.get("/api/health")
-def health_check():
+async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "Aigualba API is running"}
+
+
+@app.get("/api/health/db")
+async def database_health():
+    """Connection pool size and saturation statistics, and prepared statement timings"""
+    return {"pool": pool_stats(), "statements": statement_stats()}
+
+
+@app.get("/api/health/cache")
+async def cache_health():
+    """Response cache hit/miss/eviction counters and current dataset generation"""
+    return {"cache": response_cache.stats(), "notifications": change_listener.stats(),
+            "sample_events": sample_events.stats()}
+
+
+@app.get("/api/health/visits")
+async def visits_health():
+    """Visit write-behind buffer backlog, flush and drop counters, and partition/rollup maintenance state"""
+    return {"visit_buffer": visit_buffer.stats(), "maintenance": visit_maintenance_job.stats()}
@@ -0,0 +1,206 @@
+"""
+Cross-worker change notifications via Postgres LISTEN/NOTIFY
+
+Statement-level triggers on mostres and parameters publish on the
+'aigualba_changes' channel (see db/migrate_add_change_notifications.py).
+Each worker holds one dedicated listening connection, outside the pool, and
+hands every event to its subscribers. The default subscribers drop the
+response cache, so a write handled by one worker is seen by all of them, and
+forward sample events to Server-Sent Event clients.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import asyncpg
+
+from cache import response_cache
+from database import DATABASE_URL, PoolTimeoutError, fetch_mostres_fingerprint, dataset_version
+
+CHANGES_CHANNEL = "aigualba_changes"
+NOTIFY_RECONNECT_DELAY = float(os.getenv("NOTIFY_RECONNECT_DELAY", "5"))
+SSE_CLIENT_QUEUE_SIZE = int(os.getenv("SSE_CLIENT_QUEUE_SIZE", "16"))
+# The fingerprint also catches writes that sent no notification (listener down, triggers missing),
+# so it is only reused briefly, not for the cache-wide TTL
+DATASET_FINGERPRINT_TTL = float(os.getenv("DATASET_FINGERPRINT_TTL", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeListener:
+    """Background task that LISTENs on a channel and fans events out to subscribers"""
+
+    def __init__(self, channel: str, reconnect_delay: float):
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._subscribers: List[Callable[[Dict[str, Any]], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[asyncpg.Connection] = None
+        self._stats = {"notifications": 0, "reconnects": 0, "last_event_at": None}
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        """Register a callback invoked with the decoded payload of every change"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _dispatch(self, event: Dict[str, Any]):
+        self._stats["last_event_at"] = time.time()
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("Change subscriber failed")
+
+    def _on_notification(self, connection, pid, channel, payload):
+        self._stats["notifications"] += 1
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            event = {"table": None, "op": payload}
+        self._dispatch(event)
+
+    async def _run(self):
+        while True:
+            lost = asyncio.Event()
+            try:
+                self._conn = await asyncpg.connect(DATABASE_URL)
+                self._conn.add_termination_listener(lambda conn: lost.set())
+                await self._conn.add_listener(self.channel, self._on_notification)
+                # Changes may have happened while we were not listening
+                self._dispatch({"table": None, "op": "RESYNC"})
+                await lost.wait()
+                logger.warning("Lost LISTEN connection on %s, reconnecting", self.channel)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.warning("LISTEN on %s failed: %s", self.channel, e)
+            except Exception:
+                # Keep listening: without it cache invalidation and SSE events would silently stop
+                logger.exception("LISTEN on %s failed unexpectedly", self.channel)
+            finally:
+                if self._conn is not None and not self._conn.is_closed():
+                    self._conn.terminate()
+                self._conn = None
+            self._stats["reconnects"] += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def start(self):
+        """Start listening in the background (called on application startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop listening and close the dedicated connection (called on application shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "channel": self.channel,
+            "listening": self._conn is not None and not self._conn.is_closed(),
+            "subscribers": len(self._subscribers),
+        }
+
+
+async def current_fingerprint() -> Dict[str, Any]:
+    """The primary's mostres fingerprint, cached for DATASET_FINGERPRINT_TTL seconds"""
+    return await response_cache.get_or_load(("fingerprint",), fetch_mostres_fingerprint, ttl=DATASET_FINGERPRINT_TTL)
+
+
+async def current_dataset_version() -> str:
+    """Dataset version as seen by this worker (fingerprint shared with the conditional GETs)"""
+    return dataset_version(await current_fingerprint())
+
+
+class SampleEventStream:
+    """Fans mostres change events out to connected Server-Sent Event clients
+
+    Events are stamped with the new dataset version by a single background
+    task, so the fingerprint is read once per change rather than once per
+    client, and clients receive events in commit order.
+    """
+
+    def __init__(self, client_queue_size: int):
+        self.client_queue_size = client_queue_size
+        self._clients: Set[asyncio.Queue] = set()
+        self._pending: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"published": 0, "dropped": 0}
+
+    def connect(self) -> asyncio.Queue:
+        """Register a client and return the queue its events will arrive on"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.client_queue_size)
+        self._clients.add(queue)
+        return queue
+
+    def disconnect(self, queue: asyncio.Queue):
+        self._clients.discard(queue)
+
+    def on_change(self, event: Dict[str, Any]):
+        """ChangeListener subscriber: queue mostres events (and resyncs) for publishing"""
+        if event.get("table") not in ("mostres", None) or self._pending is None:
+            return
+        if not self._clients:
+            return
+        self._pending.put_nowait(event)
+
+    async def _publish(self):
+        while True:
+            event = await self._pending.get()
+            try:
+                version = await current_dataset_version()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, PoolTimeoutError) as e:
+                logger.warning("Could not read dataset version: %s", e)
+                version = None
+            except Exception:
+                logger.exception("Could not read dataset version")
+                version = None
+            message = {
+                "event": event.get("event") or ("resync" if event.get("op") == "RESYNC" else "deleted"),
+                "count": event.get("count"),
+                "version": version,
+            }
+            for queue in list(self._clients):
+                if queue.full():
+                    # A slow client only needs to know something changed: keep the newest event
+                    queue.get_nowait()
+                    self._stats["dropped"] += 1
+                queue.put_nowait(message)
+            self._stats["published"] += 1
+
+    async def start(self):
+        if self._task is None:
+            self._pending = asyncio.Queue()
+            self._task = asyncio.create_task(self._publish())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._pending = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "clients": len(self._clients)}
+
+
+change_listener = ChangeListener(CHANGES_CHANNEL, NOTIFY_RECONNECT_DELAY)
+change_listener.subscribe(lambda event: response_cache.bump_generation())
+sample_events = SampleEventStream(SSE_CLIENT_QUEUE_SIZE)
+change_listener.subscribe(sample_events.on_change)
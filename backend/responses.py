@@ -0,0 +1,48 @@
+"""
+Fast JSON responses for row-heavy endpoints
+
+FastAPI runs every returned value through jsonable_encoder, which walks each
+field of each row in Python before json.dumps runs. The endpoints that return
+sample rows build the response themselves through json_response(), so
+serialization happens in one orjson call. Dates and datetimes serialize
+natively as ISO 8601. NUMERIC columns already arrive as float because of
+the codec registered in database.py.
+"""
+
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+
+def _default(value: Any) -> Any:
+    """Fallback for types orjson does not know (Decimal from ad-hoc NUMERIC expressions)"""
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> FastJSONResponse:
+    """Serialize content directly, carrying over headers set on the injected Response (ETag, pagination)"""
+    headers = None
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
+
+
+def columnar(rows: List[Dict[str, Any]], columns: List[str]) -> Dict[str, Any]:
+    """Struct-of-arrays form of a row list: {"columns": [...], "data": {column: [values...]}}
+
+    Key names are sent once instead of once per row; nulls are kept so every
+    array has one entry per row.
+    """
+    return {"columns": columns, "data": {column: [row.get(column) for row in rows] for column in columns}}
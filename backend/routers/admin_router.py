@@ -1,29 +1,25 @@
 """
 Admin API routes for sample management
 """
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import List, Dict, Any, Optional
-import psycopg2
+from typing import Dict, Any, Optional
+import asyncpg
 import os
-from datetime import datetime
-import json
+import time
+
+from cache import response_cache
+from responses import json_response
+from database import (fetch_admin_samples, set_mostre_validation, delete_mostre, update_mostre,
+                      bulk_set_mostres_validation, fetch_admin_statistics, fetch_visits_statistics,
+                      fetch_index_usage, parse_bool)
+
+# Visits are not tracked by the cache generation, so the statistics are only cached briefly
+ADMIN_STATISTICS_CACHE_TTL = float(os.getenv("ADMIN_STATISTICS_CACHE_TTL", "30"))
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 security = HTTPBearer()
 
-def get_db_connection():
-    """Get database connection"""
-    try:
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            raise HTTPException(status_code=500, detail="DATABASE_URL environment variable not set")
-        connection = psycopg2.connect(database_url)
-        return connection
-    except psycopg2.Error as e:
-        print(f"Database connection error: {e}")
-        raise HTTPException(status_code=500, detail="Database connection failed")
-
 def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify admin authentication token"""
     # In production, implement proper JWT token verification
@@ -38,312 +34,164 @@ def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(secur
     return token
 
 @router.get("/samples")
-def get_all_samples_admin(token: str = Depends(verify_admin_token)):
+async def get_all_samples_admin(token: str = Depends(verify_admin_token)):
     """Get all samples with validation status for admin management"""
-    connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT id, data, punt_mostreig, temperatura, ph, conductivitat_20c, 
-                       terbolesa, color, olor, sabor, clor_lliure, clor_total,
-                       acid_monocloroacetic, acid_dicloroacetic, acid_tricloroacetic,
-                       acid_monobromoacetic, acid_dibromoacetic,
-                       recompte_escherichia_coli, recompte_enterococ,
-                       recompte_microorganismes_aerobis_22c, recompte_coliformes_totals,
-                       validated, created_at
-                FROM mostres
-                ORDER BY created_at DESC
-            """)
-            
-            columns = [desc[0] for desc in cursor.description]
-            samples = []
-            
-            for row in cursor.fetchall():
-                sample = dict(zip(columns, row))
-                # Convert date to string if it's a date object
-                if sample.get('data') and hasattr(sample['data'], 'strftime'):
-                    sample['data'] = sample['data'].strftime('%Y-%m-%d')
-                if sample.get('created_at') and hasattr(sample['created_at'], 'isoformat'):
-                    sample['created_at'] = sample['created_at'].isoformat()
-                samples.append(sample)
-            
-            return samples
-            
-    except psycopg2.Error as e:
+        # Dates and timestamps serialize natively as ISO 8601
+        return json_response(await fetch_admin_samples())
+
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
 
 @router.patch("/samples/{sample_id}/validate")
-def validate_sample(
+async def validate_sample(
     sample_id: int, 
     validation_data: Dict[str, bool],
     token: str = Depends(verify_admin_token)
 ):
     """Update sample validation status"""
-    connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            validated = validation_data.get("validated", True)
-            cursor.execute(
-                "UPDATE mostres SET validated = %s WHERE id = %s",
-                (validated, sample_id)
-            )
-            
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Sample not found")
-            
-            connection.commit()
-            return {"message": f"Sample {sample_id} validation status updated to {validated}"}
-            
-    except psycopg2.Error as e:
-        connection.rollback()
+        validated = validation_data.get("validated", True)
+        if not await set_mostre_validation(sample_id, validated):
+            raise HTTPException(status_code=404, detail="Sample not found")
+
+        return {"message": f"Sample {sample_id} validation status updated to {validated}"}
+
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
 
 @router.delete("/samples/{sample_id}")
-def delete_sample(sample_id: int, token: str = Depends(verify_admin_token)):
+async def delete_sample(sample_id: int, token: str = Depends(verify_admin_token)):
     """Delete a sample"""
-    connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("DELETE FROM mostres WHERE id = %s", (sample_id,))
-            
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Sample not found")
-            
-            connection.commit()
-            return {"message": f"Sample {sample_id} deleted successfully"}
-            
-    except psycopg2.Error as e:
-        connection.rollback()
+        if not await delete_mostre(sample_id):
+            raise HTTPException(status_code=404, detail="Sample not found")
+
+        return {"message": f"Sample {sample_id} deleted successfully"}
+
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
 
 @router.put("/samples/{sample_id}")
-def update_sample(
+async def update_sample(
     sample_id: int, 
     sample_data: Dict[str, Any],
     token: str = Depends(verify_admin_token)
 ):
     """Update sample data"""
-    connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            # First check if sample exists
-            cursor.execute("SELECT id FROM mostres WHERE id = %s", (sample_id,))
-            if not cursor.fetchone():
-                raise HTTPException(status_code=404, detail="Sample not found")
-            
-            # Build dynamic update query
-            update_fields = []
-            values = []
-            
-            allowed_fields = {
-                'data', 'punt_mostreig', 'temperatura', 'ph', 'conductivitat_20c',
-                'terbolesa', 'color', 'olor', 'sabor', 'clor_lliure', 'clor_total',
-                'acid_monocloroacetic', 'acid_dicloroacetic', 'acid_tricloroacetic',
-                'acid_monobromoacetic', 'acid_dibromoacetic',
-                'recompte_escherichia_coli', 'recompte_enterococ',
-                'recompte_microorganismes_aerobis_22c', 'recompte_coliformes_totals',
-                'validated'
-            }
-            
-            for field, value in sample_data.items():
-                if field in allowed_fields:
-                    update_fields.append(f"{field} = %s")
-                    values.append(value)
-            
-            if not update_fields:
-                raise HTTPException(status_code=400, detail="No valid fields to update")
-            
-            values.append(sample_id)  # For WHERE clause
-            
-            update_query = f"""
-                UPDATE mostres 
-                SET {', '.join(update_fields)}
-                WHERE id = %s
-                RETURNING *
-            """
-            
-            cursor.execute(update_query, values)
-            updated_row = cursor.fetchone()
-            
-            if updated_row:
-                columns = [desc[0] for desc in cursor.description]
-                updated_sample = dict(zip(columns, updated_row))
-                
-                # Convert date to string if it's a date object
-                if updated_sample.get('data') and hasattr(updated_sample['data'], 'strftime'):
-                    updated_sample['data'] = updated_sample['data'].strftime('%Y-%m-%d')
-                if updated_sample.get('created_at') and hasattr(updated_sample['created_at'], 'isoformat'):
-                    updated_sample['created_at'] = updated_sample['created_at'].isoformat()
-                
-                connection.commit()
-                return updated_sample
-            else:
-                raise HTTPException(status_code=500, detail="Failed to update sample")
-            
-    except psycopg2.Error as e:
-        connection.rollback()
+        updated_sample = await update_mostre(sample_id, sample_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
+
+    if updated_sample is None:
+        raise HTTPException(status_code=404, detail="Sample not found")
+
+    return json_response(updated_sample)
 
 @router.post("/samples/bulk-validate")
-def bulk_validate_samples(
+async def bulk_validate_samples(
     bulk_data: Dict[str, Any],
     token: str = Depends(verify_admin_token)
 ):
     """Bulk validate/unvalidate samples"""
-    connection = get_db_connection()
+    sample_ids = bulk_data.get("sample_ids", [])
+    validated = bulk_data.get("validated", True)
+
+    if not sample_ids:
+        raise HTTPException(status_code=400, detail="No sample IDs provided")
     try:
-        sample_ids = bulk_data.get("sample_ids", [])
-        validated = bulk_data.get("validated", True)
-        
-        if not sample_ids:
-            raise HTTPException(status_code=400, detail="No sample IDs provided")
-        
-        with connection.cursor() as cursor:
-            # Use tuple format for IN clause
-            placeholders = ','.join(['%s'] * len(sample_ids))
-            cursor.execute(
-                f"UPDATE mostres SET validated = %s WHERE id IN ({placeholders})",
-                [validated] + sample_ids
-            )
-            
-            updated_count = cursor.rowcount
-            connection.commit()
-            
-            return {
-                "message": f"Bulk validation updated for {updated_count} samples",
-                "updated_count": updated_count
-            }
-            
-    except psycopg2.Error as e:
-        connection.rollback()
+        if not isinstance(sample_ids, list):
+            raise TypeError
+        sample_ids = [int(sample_id) for sample_id in sample_ids]
+        validated = parse_bool(validated)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400,
+                            detail="sample_ids must be a list of integers and validated true or false")
+
+    try:
+        updated_count = await bulk_set_mostres_validation(sample_ids, validated)
+
+        return {
+            "message": f"Bulk validation updated for {updated_count} samples",
+            "updated_count": updated_count
+        }
+
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
+
+def _server_timing(timings: Dict[str, float], cached: bool, lookup_ms: float) -> str:
+    """Server-Timing header value: the query times on a miss, only the cache lookup time on a hit"""
+    if cached:
+        return f'cache;desc="hit";dur={round(lookup_ms, 2)}'
+    metrics = [f"{name};dur={duration}" for name, duration in timings.items()]
+    metrics.append('cache;desc="miss"')
+    return ", ".join(metrics)
 
 @router.get("/statistics")
-def get_admin_statistics(token: str = Depends(verify_admin_token)):
-    """Get statistics for admin dashboard"""
-    connection = get_db_connection()
+async def get_admin_statistics(response: Response, token: str = Depends(verify_admin_token)):
+    """Get statistics for admin dashboard
+
+    Cached for ADMIN_STATISTICS_CACHE_TTL seconds and dropped on every
+    sample write. On a miss the Server-Timing header breaks down the query
+    times; on a hit it only gives the cache lookup time.
+    """
+    loaded = False
+
+    async def load():
+        nonlocal loaded
+        loaded = True
+        return await fetch_admin_statistics()
+
+    started = time.monotonic()
     try:
-        with connection.cursor() as cursor:
-            # Total samples
-            cursor.execute("SELECT COUNT(*) FROM mostres")
-            total_samples = cursor.fetchone()[0]
-            
-            # Validated samples
-            cursor.execute("SELECT COUNT(*) FROM mostres WHERE validated = true")
-            validated_samples = cursor.fetchone()[0]
-            
-            # Pending samples
-            pending_samples = total_samples - validated_samples
-            
-            # Samples by location
-            cursor.execute("""
-                SELECT punt_mostreig, COUNT(*) 
-                FROM mostres 
-                GROUP BY punt_mostreig
-                ORDER BY COUNT(*) DESC
-            """)
-            samples_by_location = dict(cursor.fetchall())
-            
-            # Recent samples (last 5)
-            cursor.execute("""
-                SELECT id, data, punt_mostreig, validated, created_at
-                FROM mostres
-                ORDER BY created_at DESC
-                LIMIT 5
-            """)
-            
-            columns = ['id', 'data', 'punt_mostreig', 'validated', 'created_at']
-            recent_samples = []
-            
-            for row in cursor.fetchall():
-                sample = dict(zip(columns, row))
-                if sample.get('data') and hasattr(sample['data'], 'strftime'):
-                    sample['data'] = sample['data'].strftime('%Y-%m-%d')
-                if sample.get('created_at') and hasattr(sample['created_at'], 'isoformat'):
-                    sample['created_at'] = sample['created_at'].isoformat()
-                recent_samples.append(sample)
-            
-            # Get visits statistics for last 7 days (unique visitors by IP per day)
-            cursor.execute("""
-                SELECT 
-                    DATE(timestamp) as visit_date,
-                    COUNT(DISTINCT ip_address) as unique_visitors
-                FROM visits 
-                WHERE timestamp >= NOW() - INTERVAL '7 days'
-                  AND ip_address IS NOT NULL 
-                  AND ip_address != ''
-                GROUP BY DATE(timestamp)
-                ORDER BY visit_date ASC
-            """)
-            
-            visits_data = []
-            for row in cursor.fetchall():
-                visits_data.append({
-                    "date": row[0].strftime('%Y-%m-%d'),
-                    "visits": row[1]  # Now represents unique visitors
-                })
-            
-            # Get monthly visits statistics for last year (unique visitors by IP per month)
-            cursor.execute("""
-                WITH months AS (
-                    SELECT DATE_TRUNC('month', generate_series(
-                        NOW() - INTERVAL '1 year',
-                        NOW(),
-                        INTERVAL '1 month'
-                    )) as month_date
-                )
-                SELECT 
-                    m.month_date,
-                    COALESCE(COUNT(DISTINCT v.ip_address), 0) as unique_visitors
-                FROM months m
-                LEFT JOIN visits v ON DATE_TRUNC('month', v.timestamp) = m.month_date
-                  AND v.ip_address IS NOT NULL 
-                  AND v.ip_address != ''
-                GROUP BY m.month_date
-                ORDER BY m.month_date ASC
-            """)
-            
-            visits_monthly_data = []
-            for row in cursor.fetchall():
-                visits_monthly_data.append({
-                    "month": row[0].strftime('%Y-%m'),
-                    "visits": row[1]  # Now represents unique visitors
-                })
-            
-            # Get total unique visitors for last 30 days
-            cursor.execute("""
-                SELECT COUNT(DISTINCT ip_address) FROM visits 
-                WHERE timestamp >= NOW() - INTERVAL '30 days'
-                  AND ip_address IS NOT NULL 
-                  AND ip_address != ''
-            """)
-            total_visits = cursor.fetchone()[0]
-            
-            return {
-                "total_samples": total_samples,
-                "validated_samples": validated_samples,
-                "pending_samples": pending_samples,
-                "samples_by_location": samples_by_location,
-                "recent_samples": recent_samples,
-                "visits_last_7_days": visits_data,
-                "visits_last_year_monthly": visits_monthly_data,
-                "total_visits_30_days": total_visits
-            }
-            
-    except psycopg2.Error as e:
+        stats = await response_cache.get_or_load(("admin-statistics",), load, ttl=ADMIN_STATISTICS_CACHE_TTL)
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
+    response.headers["Server-Timing"] = _server_timing(stats["timings"], cached=not loaded,
+                                                       lookup_ms=(time.monotonic() - started) * 1000)
+
+    visits_data = []
+    for visit_date, unique_visitors in stats["visits_daily"]:
+        visits_data.append({
+            "date": visit_date,
+            "visits": unique_visitors  # Now represents unique visitors
+        })
+
+    visits_monthly_data = []
+    for month_date, unique_visitors in stats["visits_monthly"]:
+        visits_monthly_data.append({
+            "month": month_date.strftime('%Y-%m'),
+            "visits": unique_visitors  # Now represents unique visitors
+        })
+
+    return json_response({
+        "total_samples": stats["total_samples"],
+        "validated_samples": stats["validated_samples"],
+        "pending_samples": stats["total_samples"] - stats["validated_samples"],
+        "samples_by_location": dict(stats["samples_by_location"]),
+        "recent_samples": stats["recent_samples"],
+        "visits_last_7_days": visits_data,
+        "visits_last_year_monthly": visits_monthly_data,
+        "total_visits_30_days": stats["unique_visitors_30_days"]
+    }, response)
+
+@router.get("/indexes")
+async def get_index_usage(table: Optional[str] = None, token: str = Depends(verify_admin_token)):
+    """Index scan counters and sizes from pg_stat_user_indexes (optionally for one table)
+
+    Used to check that the listing indexes are picked, and answer from the
+    index alone, as the tables grow. Counters are cumulative since the last
+    statistics reset.
+    """
+    try:
+        indexes = await fetch_index_usage(table)
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    return json_response({"table": table, "indexes": indexes})
 
 @router.get("/logs/{service}")
 def get_service_logs(
@@ -451,74 +299,38 @@ def get_all_services_logs(
     }
 
 @router.get("/visits")
-def get_visits_statistics(
+async def get_visits_statistics(
     days: int = 30,
     token: str = Depends(verify_admin_token)
 ):
     """Get visits statistics for the last N days"""
-    connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            # Get visits by day for the last N days
-            cursor.execute("""
-                SELECT 
-                    DATE(timestamp) as visit_date,
-                    COUNT(*) as visits,
-                    COUNT(DISTINCT ip_address) as unique_visitors
-                FROM visits 
-                WHERE timestamp >= NOW() - INTERVAL '%s days'
-                GROUP BY DATE(timestamp)
-                ORDER BY visit_date ASC
-            """, (days,))
-            
-            daily_visits = []
-            for row in cursor.fetchall():
-                daily_visits.append({
-                    "date": row[0].strftime('%Y-%m-%d'),
-                    "visits": row[1],
-                    "unique_visitors": row[2]
-                })
-            
-            # Get visits by page for the last N days
-            cursor.execute("""
-                SELECT 
-                    page,
-                    COUNT(*) as visits,
-                    COUNT(DISTINCT ip_address) as unique_visitors
-                FROM visits 
-                WHERE timestamp >= NOW() - INTERVAL '%s days'
-                GROUP BY page
-                ORDER BY visits DESC
-            """, (days,))
-            
-            page_visits = []
-            for row in cursor.fetchall():
-                page_visits.append({
-                    "page": row[0],
-                    "visits": row[1],
-                    "unique_visitors": row[2]
-                })
-            
-            # Get total visits and unique visitors
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_visits,
-                    COUNT(DISTINCT ip_address) as total_unique_visitors
-                FROM visits 
-                WHERE timestamp >= NOW() - INTERVAL '%s days'
-            """, (days,))
-            
-            totals = cursor.fetchone()
-            
-            return {
-                "period_days": days,
-                "total_visits": totals[0] if totals else 0,
-                "total_unique_visitors": totals[1] if totals else 0,
-                "daily_visits": daily_visits,
-                "page_visits": page_visits
-            }
-            
-    except psycopg2.Error as e:
+        stats = await fetch_visits_statistics(days)
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
+
+    daily_visits = []
+    for visit_date, visits, unique_visitors in stats["daily_visits"]:
+        daily_visits.append({
+            "date": visit_date,
+            "visits": visits,
+            "unique_visitors": unique_visitors
+        })
+
+    page_visits = []
+    for page, visits, unique_visitors in stats["page_visits"]:
+        page_visits.append({
+            "page": page,
+            "visits": visits,
+            "unique_visitors": unique_visitors
+        })
+
+    totals = stats["totals"]
+
+    return json_response({
+        "period_days": days,
+        "total_visits": totals[0] if totals else 0,
+        "total_unique_visitors": totals[1] if totals else 0,
+        "daily_visits": daily_visits,
+        "page_visits": page_visits
+    })
@@ -1,13 +1,16 @@
 from fastapi import APIRouter, HTTPException
-from database import fetch_parameters
+from database import fetch_parameters, PoolTimeoutError
+from cache import response_cache
 
 router = APIRouter(prefix="/api/parameters", tags=["parameters"])
 
 
 @router.get("/")
-def read_parameters():
+async def read_parameters():
     """Get all water quality parameters"""
     try:
-        return fetch_parameters()
+        return await response_cache.get_or_load(("parameters",), fetch_parameters)
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching parameters: {str(e)}")
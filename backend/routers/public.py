@@ -1,92 +1,118 @@
 """
 Public API routes that don't require authentication
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any
-import psycopg2
+import asyncio
+import asyncpg
+import json
+import logging
 import os
+import uuid
 from datetime import datetime
 
+from database import update_pending_visit_ips, PoolTimeoutError
+from visit_buffer import visit_buffer
+from notifications import sample_events, current_dataset_version
+
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "5000"))
+
 router = APIRouter(prefix="/public", tags=["public"])
 
-def get_db_connection():
-    """Get database connection"""
-    try:
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            raise HTTPException(status_code=500, detail="DATABASE_URL environment variable not set")
-        connection = psycopg2.connect(database_url)
-        return connection
-    except psycopg2.Error as e:
-        print(f"Database connection error: {e}")
-        raise HTTPException(status_code=500, detail="Database connection failed")
+logger = logging.getLogger(__name__)
 
 @router.post("/visits")
-def track_visit(visit_data: Dict[str, Any]):
-    """Track a page visit (public endpoint, no authentication required)"""
-    connection = get_db_connection()
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO visits (page, user_agent, ip_address) 
-                VALUES (%s, %s, %s)
-                RETURNING id, timestamp
-            """, (
-                visit_data.get('page', 'unknown'),
-                visit_data.get('user_agent', ''),
-                visit_data.get('ip_address', '')
-            ))
-            
-            result = cursor.fetchone()
-            visit_id = result[0]
-            timestamp = result[1]
-            connection.commit()
-            
-            return {
-                "message": "Visit tracked successfully", 
-                "visit_id": visit_id,
-                "timestamp": timestamp.isoformat() if timestamp else None,
-                "page": visit_data.get('page', 'unknown'),
-                "ip_address": visit_data.get('ip_address', '')
-            }
-            
-    except psycopg2.Error as e:
-        connection.rollback()
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
+async def track_visit(visit_data: Dict[str, Any]):
+    """Track a page visit (public endpoint, no authentication required)
+
+    The visit is queued and written in a batch shortly afterwards, so
+    visit_id is a UUID assigned here rather than the database row id. If the
+    backlog is full the visit is dropped, which is reported as queued=false.
+    """
+    queued = visit_buffer.add(
+        visit_data.get('page', 'unknown'),
+        visit_data.get('user_agent', ''),
+        visit_data.get('ip_address', ''),
+        visit_data.get('session_id') or None
+    )
+
+    return {
+        "message": "Visit tracked successfully" if queued else "Visit dropped: tracking backlog is full",
+        "visit_id": str(uuid.uuid4()),
+        "queued": queued,
+        "timestamp": datetime.now().isoformat(),
+        "page": visit_data.get('page', 'unknown'),
+        "ip_address": visit_data.get('ip_address', '')
+    }
 
 @router.put("/visits/update-ip")
-def update_visit_ip(ip_data: Dict[str, Any]):
-    """Update IP address for recent visits from the same session (public endpoint)"""
-    connection = get_db_connection()
+async def update_visit_ip(ip_data: Dict[str, Any]):
+    """Fill in the IP address of a session's recent visits recorded as pending (public endpoint)
+
+    Only visits tracked with the same session_id are updated, including the
+    ones still waiting in the visit buffer. Clients that predate session_id
+    (cached pages) still get a 200, with nothing updated, so that no other
+    visitor's rows are rewritten.
+    """
+    real_ip = ip_data.get('ip_address')
+    session_id = ip_data.get('session_id')
+
+    if not real_ip:
+        raise HTTPException(status_code=400, detail="IP address required")
+    if not session_id:
+        logger.warning("IP update without session_id ignored; the client predates session tracking")
+        return {
+            "message": "Updated IP address for 0 recent visits (session_id missing)",
+            "updated_count": 0,
+            "ip_address": real_ip
+        }
+
     try:
-        with connection.cursor() as cursor:
-            real_ip = ip_data.get('ip_address')
-            
-            if not real_ip:
-                raise HTTPException(status_code=400, detail="IP address required")
-            
-            # Update recent visits (last 5 minutes) that have 'pending' IP or empty IP
-            # This handles cases where JavaScript detects real IP after initial page load
-            cursor.execute("""
-                UPDATE visits 
-                SET ip_address = %s 
-                WHERE (ip_address = 'pending' OR ip_address = '' OR ip_address IS NULL)
-                  AND timestamp >= NOW() - INTERVAL '5 minutes'
-            """, (real_ip,))
-            
-            updated_count = cursor.rowcount
-            connection.commit()
-            
-            return {
-                "message": f"Updated IP address for {updated_count} recent visits",
-                "updated_count": updated_count,
-                "ip_address": real_ip
-            }
-            
-    except psycopg2.Error as e:
-        connection.rollback()
+        updated_count = visit_buffer.update_pending_ip(session_id, real_ip)
+        updated_count += await update_pending_visit_ips(session_id, real_ip)
+
+        return {
+            "message": f"Updated IP address for {updated_count} recent visits",
+            "updated_count": updated_count,
+            "ip_address": real_ip
+        }
+
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
\ No newline at end of file
+
+@router.get("/mostres/events")
+async def sample_change_events(request: Request):
+    """Server-Sent Events stream of sample changes (created/validated/invalidated/updated/deleted)
+
+    The first event, `ready`, carries the current dataset version so a
+    reconnecting client can tell whether it missed anything. Every change
+    is then sent as an unnamed message whose data is
+    {"event", "count", "version"}.
+    """
+    queue = sample_events.connect()
+    try:
+        version = await current_dataset_version()
+    except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, PoolTimeoutError):
+        version = None
+
+    async def stream():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\nevent: ready\ndata: {json.dumps({'version': version})}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(message)}\n\n"
+        finally:
+            sample_events.disconnect(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
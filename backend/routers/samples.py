@@ -1,65 +1,316 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import date, timezone
+from email.utils import format_datetime
+import hashlib
 from models import MostreData
-from database import fetch_mostres, create_mostre, fetch_all_mostres, validate_mostre, invalidate_mostre
-import psycopg2
-import os
+from database import (fetch_mostres, fetch_mostre, fetch_mostres_by_ids, create_mostre, fetch_all_mostres,
+                      validate_mostre, invalidate_mostre, count_pending_mostres, count_mostres, MAX_PAGE_SIZE,
+                      MOSTRES_NUMERIC_COLUMNS, validate_fields, fetch_mostres_series, fetch_latest_mostre,
+                      fetch_mostres_fingerprint, dataset_version, bulk_create_mostres, MOSTRES_COLUMNS,
+                      read_snapshot, PoolTimeoutError)
+from cache import response_cache, query_key
+from responses import columnar, json_response
+from export import EXPORT_FORMATS, start_csv_export, build_xlsx_export, remove_export
+from ingest import parse_bulk_samples, BULK_MAX_REPORTED_ERRORS
+from notifications import current_fingerprint
+import asyncio
+import asyncpg
 
 router = APIRouter(prefix="/api/mostres", tags=["samples"])
 
-def get_db_connection():
-    """Get database connection"""
+# Body layouts of the sample listings (?format=)
+SAMPLE_FORMATS = ('rows', 'columnar')
+
+
+def pagination_headers(request: Request, next_cursor: Optional[str], total: Optional[int]) -> Dict[str, str]:
+    """Headers exposing the next-page cursor and the total count"""
+    headers = {}
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return headers
+
+
+def validator_headers(request: Request, fingerprint: Dict[str, Any]) -> Dict[str, str]:
+    """ETag (and informational Last-Modified) of the request's response at the given table fingerprint
+
+    The strong ETag hashes the fingerprint together with the request path and
+    query, so each distinct URL has its own validator.
+    """
+    digest = hashlib.sha1(
+        f"{dataset_version(fingerprint)}|{request.url.path}|{query_key(request)}".encode()
+    ).hexdigest()
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "no-cache"}
+    if fingerprint['updated_at'] is not None:
+        # updated_at is a naive server timestamp stored in UTC
+        headers["Last-Modified"] = format_datetime(fingerprint['updated_at'].replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+async def conditional_get(request: Request):
+    """Answer If-None-Match with 304 before running the real query
+
+    Compared against the primary's current fingerprint: a match means the
+    client already holds the current body. Last-Modified is informational:
+    deletes do not move it, so only the ETag is compared.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return
+    try:
+        fingerprint = await current_fingerprint()
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    headers = validator_headers(request, fingerprint)
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if headers["ETag"] in candidates or "*" in candidates:
+        raise HTTPException(status_code=304, headers=headers)
+
+
+async def versioned(request: Request, loader: Callable[[], Awaitable[Any]]) -> Tuple[Any, Dict[str, str]]:
+    """Load a response body together with the validators of the state it was read from
+
+    Body and fingerprint come from one read_snapshot(), so a body served by a
+    lagging replica is never labelled with the primary's newer ETag.
+    """
+    async with read_snapshot():
+        fingerprint = await fetch_mostres_fingerprint(read_only=True)
+        body = await loader()
+    return body, validator_headers(request, fingerprint)
+
+
+def sample_filters(
+    request: Request,
+    date_from: Optional[date] = Query(None, description="Only samples taken on or after this date"),
+    date_to: Optional[date] = Query(None, description="Only samples taken on or before this date"),
+    location: Optional[List[str]] = Query(None, description="Sampling point(s); repeat to select several"),
+) -> Dict[str, Any]:
+    """Collect the listing filters, including <parameter>_min / <parameter>_max value ranges
+
+    Range bounds are read from the raw query string because there is one pair
+    per measured parameter (e.g. ph_min=6.5&ph_max=9.5).
+    """
+    ranges: Dict[str, List[Optional[float]]] = {}
+    for key, value in request.query_params.multi_items():
+        if not (key.endswith('_min') or key.endswith('_max')):
+            continue
+        column, bound = key[:-4], key[-3:]
+        if column not in MOSTRES_NUMERIC_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"Unknown parameter for range filter: {column}")
+        try:
+            number = float(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{key} must be a number")
+        ranges.setdefault(column, [None, None])[0 if bound == 'min' else 1] = number
+
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "locations": [loc for loc in (location or []) if loc and loc != 'all'],
+        "ranges": {column: tuple(bounds) for column, bounds in ranges.items()},
+    }
+
+
+def sample_fields(
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. id,data,punt_mostreig"),
+) -> Optional[List[str]]:
+    """Parse and validate the ?fields= sparse fieldset (None means every column)"""
+    if fields is None:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    if not requested:
+        raise HTTPException(status_code=400, detail="fields must name at least one column")
     try:
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            raise HTTPException(status_code=500, detail="DATABASE_URL environment variable not set")
-        connection = psycopg2.connect(database_url)
-        return connection
-    except psycopg2.Error as e:
-        print(f"Database connection error: {e}")
-        raise HTTPException(status_code=500, detail="Database connection failed")
-
-@router.get("/pending-count")
-def get_pending_validation_count():
+        return validate_fields(requested)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def sample_format(
+    format: str = Query('rows', description="rows (one object per sample) or columnar ({columns, data: {column: [values]}})"),
+) -> str:
+    """Validate the ?format= body layout of the sample listings"""
+    if format not in SAMPLE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}. Use rows or columnar")
+    return format
+
+
+def listing_body(samples: List[Dict[str, Any]], fields: Optional[List[str]], format: str) -> Any:
+    """Sample rows as sent: unchanged, or as columns in the selected field order"""
+    if format == 'columnar':
+        return columnar(samples, fields or MOSTRES_COLUMNS)
+    return samples
+
+
+def parse_ids(ids: str) -> List[int]:
+    """Parse a comma-separated list of sample ids, raising ValueError if malformed"""
+    try:
+        sample_ids = [int(part) for part in ids.split(',') if part.strip()]
+    except ValueError:
+        raise ValueError("ids must be a comma-separated list of integers")
+    if not sample_ids:
+        raise ValueError("ids must contain at least one sample id")
+    if len(sample_ids) > MAX_PAGE_SIZE:
+        raise ValueError(f"At most {MAX_PAGE_SIZE} ids can be requested at once")
+    return sample_ids
+
+@router.get("/pending-count", dependencies=[Depends(conditional_get)])
+async def get_pending_validation_count(request: Request, response: Response):
     """Get count of samples pending validation (public endpoint)"""
-    connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            # Count samples that are not validated
-            cursor.execute("SELECT COUNT(*) FROM mostres WHERE validated = false")
-            pending_count = cursor.fetchone()[0]
-            
+        pending_count, validators = await response_cache.get_or_load(
+            ("pending-count",), lambda: versioned(request, count_pending_mostres)
+        )
+        response.headers.update(validators)
         return {"pending_count": pending_count}
-    except psycopg2.Error as e:
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        connection.close()
 
-@router.get("/")
-def read_samples():
-    """Get all sample data from mostres table"""
+@router.get("/latest", dependencies=[Depends(conditional_get)])
+async def read_latest_sample(
+    request: Request,
+    response: Response,
+    location: Optional[str] = Query(None, description="Sampling point; the most recent of any point if omitted"),
+):
+    """Get the latest validated sample of a sampling point from the maintained snapshot (public endpoint)"""
+    try:
+        sample, validators = await response_cache.get_or_load(
+            ("latest", query_key(request)),
+            lambda: versioned(request, lambda: fetch_latest_mostre(location if location != 'all' else None))
+        )
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    if sample is None:
+        detail = f"No validated samples for {location}" if location else "No validated samples"
+        raise HTTPException(status_code=404, detail=detail)
+    response.headers.update(validators)
+    return json_response(sample, response)
+
+@router.get("/series", dependencies=[Depends(conditional_get)])
+async def read_sample_series(
+    request: Request,
+    response: Response,
+    parameter: str = Query(..., description="Measured column or derived parameter (suma_haloacetics, clor_combinat_residual)"),
+    location: Optional[List[str]] = Query(None, description="Sampling point(s); all locations if omitted or 'all'"),
+    bucket: str = Query('day', description="Time bucket: day, week or month, or sample for every sample unaggregated"),
+    agg: str = Query('mean', description="Aggregate per bucket: mean, min or max"),
+    date_from: Optional[date] = Query(None, description="Only samples taken on or after this date"),
+    date_to: Optional[date] = Query(None, description="Only samples taken on or before this date"),
+):
+    """Get a parameter's time series per sampling point, aggregated in SQL (public endpoint)"""
+    filters = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "locations": [loc for loc in (location or []) if loc and loc != 'all'],
+    }
     try:
-        return fetch_mostres()
+        series, validators = await response_cache.get_or_load(
+            ("series", query_key(request)),
+            lambda: versioned(request, lambda: fetch_mostres_series(parameter, bucket, agg, filters))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    response.headers.update(validators)
+    return json_response({"parameter": parameter, "bucket": bucket, "agg": agg, "series": series}, response)
+
+@router.get("/export")
+async def export_samples(
+    format: str = Query('csv', description="File format: csv or xlsx"),
+    filters: Dict[str, Any] = Depends(sample_filters),
+):
+    """Download validated samples (same filters as the listing) with Catalan headers
+
+    CSV is streamed from Postgres COPY; XLSX is built to a temporary file first and then served.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {format}. Use csv or xlsx")
+
+    filename = f"mostres_aigua_gualba_{date.today().isoformat()}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    try:
+        if format == 'csv':
+            stream = await start_csv_export(filters)
+            return StreamingResponse(stream, media_type=EXPORT_FORMATS[format], headers=headers)
+        path = await build_xlsx_export(filters)
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return FileResponse(path, media_type=EXPORT_FORMATS[format], headers=headers,
+                        background=BackgroundTask(remove_export, path))
+
+@router.get("/", dependencies=[Depends(conditional_get)])
+async def read_samples(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size (all samples if omitted)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous X-Next-Cursor header"),
+    include_total: bool = Query(True, description="Send the X-Total-Count header"),
+    ids: Optional[str] = Query(None, description="Comma-separated sample ids to fetch in one request"),
+    filters: Dict[str, Any] = Depends(sample_filters),
+    fields: Optional[List[str]] = Depends(sample_fields),
+    format: str = Depends(sample_format),
+):
+    """Get validated samples from mostres table, newest first, with optional keyset pagination"""
+    async def load():
+        if ids is not None:
+            samples = await fetch_mostres_by_ids(parse_ids(ids), fields=fields)
+            return samples, {"X-Total-Count": str(len(samples))} if include_total else {}
+
+        samples, next_cursor = await fetch_mostres(limit=limit, cursor=cursor, filters=filters, fields=fields)
+        total = None
+        if include_total:
+            paginated = limit is not None or cursor is not None
+            total = await count_mostres(filters=filters) if paginated else len(samples)
+        return samples, pagination_headers(request, next_cursor, total)
+
+    try:
+        (samples, headers), validators = await response_cache.get_or_load(
+            ("mostres", query_key(request)), lambda: versioned(request, load)
+        )
+        response.headers.update({**headers, **validators})
+        return json_response(listing_body(samples, fields, format), response)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching samples: {str(e)}")
 
 
-@router.get("/{sample_id}")
-def read_sample(sample_id: int):
+@router.get("/{sample_id}", dependencies=[Depends(conditional_get)])
+async def read_sample(request: Request, response: Response, sample_id: int,
+                      fields: Optional[List[str]] = Depends(sample_fields)):
     """Get a specific sample by ID"""
     try:
-        samples = fetch_mostres()
-        for sample in samples:
-            if sample.get('id') == sample_id:
-                return sample
-        raise HTTPException(status_code=404, detail=f"Sample with id {sample_id} not found")
+        sample, validators = await response_cache.get_or_load(
+            ("mostre", sample_id, query_key(request)),
+            lambda: versioned(request, lambda: fetch_mostre(sample_id, fields=fields))
+        )
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching sample: {str(e)}")
 
+    if sample is None:
+        raise HTTPException(status_code=404, detail=f"Sample with id {sample_id} not found")
+    response.headers.update(validators)
+    return json_response(sample, response)
+
 @router.post("/")
-def create_sample(mostre: MostreData):
+async def create_sample(mostre: MostreData):
     """Create a new sample entry (will be unvalidated by default)"""
     try:
-        new_id = create_mostre(mostre.dict())
+        new_id = await create_mostre(mostre.dict())
         return {
             "message": "Mostra pujada amb èxit. Serà visible un cop validada per un administrador.", 
             "id": new_id,
@@ -67,40 +318,95 @@ def create_sample(mostre: MostreData):
         }
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating sample: {str(e)}")
 
+@router.post("/bulk")
+async def create_samples_bulk(request: Request):
+    """Create many samples from an NDJSON or CSV upload (all unvalidated), reporting invalid rows
+
+    Valid rows are loaded together in one transaction; invalid rows are
+    skipped and listed in the response with their line number.
+    """
+    body = await request.body()
+    if not body.strip():
+        raise HTTPException(status_code=400, detail="Empty upload")
+    try:
+        # Validation is CPU-bound; keep the event loop responsive for large archives
+        valid, errors, received = await asyncio.to_thread(
+            parse_bulk_samples, body, request.headers.get("content-type", "")
+        )
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Upload must be UTF-8 encoded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        inserted = await bulk_create_mostres(valid)
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    return {
+        "message": f"{inserted} mostres pujades. Seran visibles un cop validades per un administrador.",
+        "received": received,
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": errors[:BULK_MAX_REPORTED_ERRORS],
+        "validated": False,
+    }
+
 # Admin-only endpoints
 @router.get("/admin/all")
-def read_all_samples():
+async def read_all_samples(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size (all samples if omitted)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous X-Next-Cursor header"),
+    include_total: bool = Query(True, description="Send the X-Total-Count header"),
+    filters: Dict[str, Any] = Depends(sample_filters),
+    fields: Optional[List[str]] = Depends(sample_fields),
+    format: str = Depends(sample_format),
+):
     """Get all sample data including unvalidated samples - ADMIN ONLY"""
     try:
-        return fetch_all_mostres()
+        samples, next_cursor = await fetch_all_mostres(limit=limit, cursor=cursor, filters=filters, fields=fields)
+        total = None
+        if include_total:
+            paginated = limit is not None or cursor is not None
+            total = await count_mostres(validated_only=False, filters=filters) if paginated else len(samples)
+        response.headers.update(pagination_headers(request, next_cursor, total))
+        return json_response(listing_body(samples, fields, format), response)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching all samples: {str(e)}")
 
 @router.post("/{sample_id}/validate")
-def validate_sample(sample_id: int):
+async def validate_sample(sample_id: int):
     """Validate a sample to make it visible to public - ADMIN ONLY"""
     try:
-        success = validate_mostre(sample_id)
+        success = await validate_mostre(sample_id)
         if not success:
             raise HTTPException(status_code=404, detail=f"Sample with id {sample_id} not found")
         return {"message": f"Sample {sample_id} validated successfully"}
-    except HTTPException:
+    except (HTTPException, PoolTimeoutError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error validating sample: {str(e)}")
 
 @router.post("/{sample_id}/invalidate")
-def invalidate_sample(sample_id: int):
+async def invalidate_sample(sample_id: int):
     """Invalidate a sample to hide it from public view - ADMIN ONLY"""
     try:
-        success = invalidate_mostre(sample_id)
+        success = await invalidate_mostre(sample_id)
         if not success:
             raise HTTPException(status_code=404, detail=f"Sample with id {sample_id} not found")
         return {"message": f"Sample {sample_id} invalidated successfully"}
-    except HTTPException:
+    except (HTTPException, PoolTimeoutError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error invalidating sample: {str(e)}")
@@ -0,0 +1,8 @@
+"""
+Test setup: the backend modules are imported flat, as uvicorn runs them from backend/
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,77 @@
+"""
+Response cache: generations, TTL and LRU eviction
+"""
+
+import asyncio
+
+import pytest
+
+import cache
+from cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_and_miss():
+    response_cache = ResponseCache(max_entries=4, ttl=60)
+    response_cache.set(("a",), 1, response_cache.generation)
+    assert response_cache.get(("a",)) == (True, 1)
+    assert response_cache.get(("b",)) == (False, None)
+    assert response_cache.stats()["hits"] == 1
+    assert response_cache.stats()["misses"] == 1
+
+
+def test_bump_generation_invalidates_and_drops_stale_loads():
+    response_cache = ResponseCache(max_entries=4, ttl=60)
+    generation = response_cache.generation
+    response_cache.set(("a",), 1, generation)
+    response_cache.bump_generation()
+    assert response_cache.get(("a",)) == (False, None)
+    # A value computed before the write is not stored under the new generation
+    response_cache.set(("a",), 1, generation)
+    assert response_cache.get(("a",)) == (False, None)
+
+
+def test_ttl_and_per_call_override(clock):
+    response_cache = ResponseCache(max_entries=4, ttl=60)
+    response_cache.set(("a",), 1, response_cache.generation)
+    clock[0] += 10
+    assert response_cache.get(("a",), ttl=5) == (False, None)
+    response_cache.set(("a",), 1, response_cache.generation)
+    clock[0] += 30
+    assert response_cache.get(("a",)) == (True, 1)
+    clock[0] += 31
+    assert response_cache.get(("a",)) == (False, None)
+    assert response_cache.stats()["expirations"] == 2
+
+
+def test_lru_eviction():
+    response_cache = ResponseCache(max_entries=2, ttl=60)
+    response_cache.set(("a",), 1, 0)
+    response_cache.set(("b",), 2, 0)
+    response_cache.get(("a",))
+    response_cache.set(("c",), 3, 0)
+    assert response_cache.get(("b",)) == (False, None)
+    assert response_cache.get(("a",)) == (True, 1)
+    assert response_cache.get(("c",)) == (True, 3)
+    assert response_cache.stats()["evictions"] == 1
+
+
+def test_get_or_load_calls_loader_once():
+    response_cache = ResponseCache(max_entries=4, ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return "value"
+
+    async def run():
+        return [await response_cache.get_or_load(("a",), loader) for _ in range(3)]
+
+    assert asyncio.run(run()) == ["value"] * 3
+    assert len(calls) == 1
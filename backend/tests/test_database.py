@@ -0,0 +1,64 @@
+"""
+Pure helpers of the data layer: pagination cursors and value coercion
+"""
+
+from datetime import date, datetime
+
+import pytest
+
+from database import _coerce_mostre_value, decode_cursor, encode_cursor, parse_bool
+
+SAMPLE = {"id": 42, "data": date(2024, 5, 1), "created_at": datetime(2024, 5, 1, 9, 30, 15, 123456), "validated": False}
+
+
+def test_public_cursor_round_trip():
+    cursor = encode_cursor('public', SAMPLE)
+    assert '=' not in cursor
+    assert decode_cursor('public', cursor) == (SAMPLE['data'], SAMPLE['created_at'], 42)
+
+
+def test_admin_cursor_carries_validated():
+    cursor = encode_cursor('admin', SAMPLE)
+    assert decode_cursor('admin', cursor) == (SAMPLE['data'], SAMPLE['created_at'], 42, False)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "bnVsbA", encode_cursor('admin', SAMPLE)])
+def test_malformed_or_foreign_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid pagination cursor"):
+        decode_cursor('public', cursor)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, True), (False, False), (1, True), (0, False),
+    ("true", True), (" FALSE ", False), ("1", True), ("0", False),
+])
+def test_parse_bool_accepts(value, expected):
+    assert parse_bool(value) is expected
+
+
+@pytest.mark.parametrize("value", [None, "", "yes", "no", 2, -1, 1.0, [], "t"])
+def test_parse_bool_rejects(value):
+    with pytest.raises(ValueError):
+        parse_bool(value)
+
+
+def test_coerce_converts_loose_json_types():
+    assert _coerce_mostre_value('data', '2024-05-01T00:00:00') == date(2024, 5, 1)
+    assert _coerce_mostre_value('validated', 'false') is False
+    assert _coerce_mostre_value('punt_mostreig', 12) == '12'
+    assert _coerce_mostre_value('ph', '7.5') == 7.5
+    assert _coerce_mostre_value('ph', 7) == 7
+
+
+@pytest.mark.parametrize("value", [None, ''])
+def test_coerce_empty_clears_measurements_only(value):
+    assert _coerce_mostre_value('ph', value) is None
+    for field in ('data', 'punt_mostreig', 'validated'):
+        with pytest.raises(ValueError, match="cannot be empty"):
+            _coerce_mostre_value(field, value)
+
+
+@pytest.mark.parametrize("field, value", [('validated', 'maybe'), ('ph', 'high'), ('data', '2024-13-01')])
+def test_coerce_rejects_wrong_types(field, value):
+    with pytest.raises(ValueError):
+        _coerce_mostre_value(field, value)
@@ -0,0 +1,58 @@
+"""
+Bulk upload parsing (NDJSON and CSV)
+"""
+
+import json
+
+import pytest
+
+import ingest
+from ingest import parse_bulk_samples
+
+
+def ndjson(*rows):
+    return "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows).encode()
+
+
+def test_ndjson_valid_and_invalid_rows():
+    body = ndjson(
+        {"data": "2024-05-01", "punt_mostreig": "Gualba", "ph": 7.4},
+        "",
+        "{not json",
+        [1, 2],
+        {"data": "2024-05-02", "punt_mostreig": "Gualba", "ph": 20},
+    )
+    valid, errors, received = parse_bulk_samples(body, "application/x-ndjson; charset=utf-8")
+
+    assert received == 4
+    assert [row["ph"] for row in valid] == [7.4]
+    assert [error["line"] for error in errors] == [3, 4, 5]
+    for error in errors:
+        assert isinstance(error["errors"], list)
+        assert set(error["errors"][0]) == {"field", "message"}
+    assert errors[0]["errors"][0]["field"] is None
+    assert errors[2]["errors"][0]["field"] == "ph"
+
+
+def test_csv_accepts_export_headers_and_empty_cells():
+    body = "\ufeffData de recollida,Punt de mostreig,pH,temperatura\n2024-05-01,Gualba,7.1,\n,Gualba,7.0,12\n".encode()
+    valid, errors, received = parse_bulk_samples(body, "text/csv")
+
+    assert received == 2
+    assert len(valid) == 1
+    assert valid[0]["punt_mostreig"] == "Gualba"
+    assert valid[0]["temperatura"] is None
+    assert errors[0]["line"] == 3
+    assert errors[0]["errors"][0]["field"] == "data"
+
+
+def test_unsupported_content_type():
+    with pytest.raises(ValueError, match="Content-Type"):
+        parse_bulk_samples(b"{}", "application/json")
+
+
+def test_row_limit(monkeypatch):
+    monkeypatch.setattr(ingest, "BULK_MAX_ROWS", 1)
+    body = ndjson({"data": "2024-05-01", "punt_mostreig": "A"}, {"data": "2024-05-01", "punt_mostreig": "B"})
+    with pytest.raises(ValueError, match="At most 1 rows"):
+        parse_bulk_samples(body, "application/x-ndjson")
@@ -0,0 +1,14 @@
+"""
+Columnar listing bodies
+"""
+
+from responses import columnar
+
+
+def test_columnar_keeps_order_and_nulls():
+    rows = [{"id": 1, "ph": 7.1, "data": "2024-05-01"}, {"id": 2, "data": "2024-05-02"}]
+    assert columnar(rows, ["id", "ph"]) == {"columns": ["id", "ph"], "data": {"id": [1, 2], "ph": [7.1, None]}}
+
+
+def test_columnar_empty_listing():
+    assert columnar([], ["id"]) == {"columns": ["id"], "data": {"id": []}}
@@ -0,0 +1,43 @@
+"""
+Listing filters parsed from the query string
+"""
+
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from routers.samples import sample_filters
+
+
+def request_with(query: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/api/mostres/", "query_string": query.encode(),
+                    "headers": []})
+
+
+def test_ranges_and_locations():
+    filters = sample_filters(request_with("ph_min=6.5&ph_max=9.5&clor_lliure_max=1"),
+                             date_from=date(2024, 1, 1), date_to=None, location=["Gualba", "all", ""])
+    assert filters == {
+        "date_from": date(2024, 1, 1),
+        "date_to": None,
+        "locations": ["Gualba"],
+        "ranges": {"ph": (6.5, 9.5), "clor_lliure": (None, 1.0)},
+    }
+
+
+def test_no_filters():
+    filters = sample_filters(request_with(""), date_from=None, date_to=None, location=None)
+    assert filters["locations"] == [] and filters["ranges"] == {}
+
+
+@pytest.mark.parametrize("query, detail", [
+    ("unknown_min=1", "Unknown parameter for range filter: unknown"),
+    ("ph_min=low", "ph_min must be a number"),
+])
+def test_bad_ranges_are_400(query, detail):
+    with pytest.raises(HTTPException) as excinfo:
+        sample_filters(request_with(query), date_from=None, date_to=None, location=None)
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == detail
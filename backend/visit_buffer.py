@@ -0,0 +1,190 @@
+"""
+Write-behind buffer for page visits
+
+track_visit only appends to an in-process queue. A background task writes
+the queue to Postgres in batches, either when VISIT_BUFFER_MAX_BATCH visits
+are waiting or every VISIT_BUFFER_FLUSH_MS, using one INSERT per batch. The
+backlog is bounded: when the database cannot keep up, new visits are dropped
+and counted instead of growing memory without limit. Whatever is still
+queued at shutdown is flushed before the pool closes.
+
+Fields are coerced to text and truncated to the column widths when queued.
+The queueing instant is kept as a monotonic reading and the visit time is
+resolved on the database clock at write time (now minus the time queued), so
+a batch written late (after an outage) keeps the original times without
+depending on the worker's clock or time zone. A batch the database rejects is split in halves
+until the offending rows are found; those are dropped and counted, the rest
+are stored. Only failures to reach the database put the batch back.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from database import PoolTimeoutError, insert_visits
+
+VISIT_BUFFER_MAX_BATCH = int(os.getenv("VISIT_BUFFER_MAX_BATCH", "500"))
+VISIT_BUFFER_FLUSH_MS = int(os.getenv("VISIT_BUFFER_FLUSH_MS", "1000"))
+VISIT_BUFFER_MAX_BACKLOG = int(os.getenv("VISIT_BUFFER_MAX_BACKLOG", "10000"))
+
+# Column widths of the visits table (user_agent is TEXT, capped to bound memory)
+VISIT_PAGE_MAX = 100
+VISIT_USER_AGENT_MAX = 1000
+VISIT_IP_MAX = 45
+VISIT_SESSION_MAX = 64
+
+logger = logging.getLogger(__name__)
+
+# (page, user_agent, ip_address, session_id, queued_at as time.monotonic())
+Visit = Tuple[str, str, str, Optional[str], float]
+
+PENDING_IPS = (None, '', 'pending')
+
+# The database refused the rows themselves (value out of range, invalid text): retrying cannot help
+REJECTED_VISIT_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError, TypeError, ValueError)
+# The database is unreachable or busy: the batch is kept for the next attempt
+RETRYABLE_ERRORS = (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, PoolTimeoutError)
+
+
+def _clip(value: Any, limit: int) -> str:
+    """Client-supplied visit field as text of at most `limit` characters"""
+    if value is None:
+        return ''
+    text = value if isinstance(value, str) else str(value)
+    return text.replace('\x00', '')[:limit]
+
+
+class VisitBuffer:
+    """Bounded in-process queue of visits flushed to the database in batches"""
+
+    def __init__(self, max_batch: int, flush_interval: float, max_backlog: int):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self._pending: Deque[Visit] = deque()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"accepted": 0, "flushed": 0, "dropped": 0, "batches": 0, "failed_batches": 0,
+                       "rejected": 0, "last_flush_at": None, "last_flush_ms": None}
+
+    def add(self, page: Any, user_agent: Any, ip_address: Any, session_id: Any = None) -> bool:
+        """Queue a visit; returns False (and counts a drop) when the backlog is full"""
+        if len(self._pending) >= self.max_backlog:
+            self._stats["dropped"] += 1
+            return False
+        self._pending.append((
+            _clip(page, VISIT_PAGE_MAX) or 'unknown',
+            _clip(user_agent, VISIT_USER_AGENT_MAX),
+            _clip(ip_address, VISIT_IP_MAX),
+            _clip(session_id, VISIT_SESSION_MAX) or None,
+            time.monotonic(),
+        ))
+        self._stats["accepted"] += 1
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+        return True
+
+    def update_pending_ip(self, session_id: str, ip_address: str) -> int:
+        """Fill in the IP of a session's visits that are still queued, returning how many"""
+        updated = 0
+        ip_address = _clip(ip_address, VISIT_IP_MAX)
+        for index, (page, user_agent, pending_ip, visit_session, queued_at) in enumerate(self._pending):
+            if visit_session == session_id and pending_ip in PENDING_IPS:
+                self._pending[index] = (page, user_agent, ip_address, visit_session, queued_at)
+                updated += 1
+        return updated
+
+    async def flush(self) -> int:
+        """Write up to one batch of queued visits, returning how many were stored"""
+        if not self._pending:
+            return 0
+        batch: List[Visit] = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+        started = time.monotonic()
+        # Stack of chunks still to write; a rejected chunk is replaced by its two halves
+        chunks = [batch]
+        stored = 0
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                stored += await insert_visits(chunk)
+            except REJECTED_VISIT_ERRORS as e:
+                if len(chunk) > 1:
+                    middle = len(chunk) // 2
+                    chunks.extend((chunk[middle:], chunk[:middle]))
+                    continue
+                self._stats["rejected"] += 1
+                logger.warning("Dropping visit to %r rejected by the database: %s", chunk[0][0], e)
+            except RETRYABLE_ERRORS as e:
+                self._stats["failed_batches"] += 1
+                # Put the unwritten visits back in front for the next attempt, keeping the backlog bound
+                unwritten = chunk + [visit for rest in reversed(chunks) for visit in rest]
+                room = self.max_backlog - len(self._pending)
+                requeued = unwritten[:max(room, 0)]
+                self._pending.extendleft(reversed(requeued))
+                self._stats["dropped"] += len(unwritten) - len(requeued)
+                self._stats["flushed"] += stored
+                logger.warning("Visit flush of %d rows failed: %s", len(unwritten), e)
+                raise
+        self._stats["flushed"] += stored
+        self._stats["batches"] += 1
+        self._stats["last_flush_at"] = time.time()
+        self._stats["last_flush_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return stored
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while self._pending:
+                    await self.flush()
+                    if len(self._pending) < self.max_batch:
+                        break
+            except RETRYABLE_ERRORS:
+                # Already logged and requeued; retry on the next tick
+                pass
+            except Exception:
+                # Never let the flusher die: the backlog would fill and every visit be dropped
+                logger.exception("Unexpected error flushing visits")
+
+    async def start(self):
+        """Start the background flusher (called on application startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out everything still queued (called on application shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            while self._pending:
+                await self.flush()
+        except Exception:
+            self._stats["dropped"] += len(self._pending)
+            logger.error("Dropping %d unflushed visits at shutdown", len(self._pending))
+            self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "backlog": len(self._pending),
+            "max_backlog": self.max_backlog,
+            "max_batch": self.max_batch,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+        }
+
+
+visit_buffer = VisitBuffer(VISIT_BUFFER_MAX_BATCH, VISIT_BUFFER_FLUSH_MS / 1000, VISIT_BUFFER_MAX_BACKLOG)
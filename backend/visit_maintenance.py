@@ -0,0 +1,122 @@
+"""
+Background maintenance of the visits table: partitions, rollups and retention
+
+Every VISIT_MAINTENANCE_INTERVAL seconds each worker:
+
+1. pre-creates the monthly visits partitions for the next
+   VISIT_PARTITIONS_AHEAD months (ensure_visit_partitions),
+2. rolls up the complete days of visits not yet in visits_daily /
+   visits_daily_pages / visits_monthly (refresh_visit_rollups); a day counts
+   as complete VISIT_ROLLUP_LAG seconds after midnight, which leaves room for
+   buffered visits and late IP updates,
+3. detaches and drops (or archives) the partitions older than
+   VISITS_RETENTION_MONTHS (expire_visit_partitions). The SQL function only
+   expires months behind the rollup watermark, so a pass whose rollup was
+   skipped (another worker held the lock) never drops unrolled visits.
+
+The SQL functions take advisory locks, so concurrent workers wait or skip
+instead of doing the work twice.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+from database import PoolTimeoutError, refresh_visit_rollups, ensure_visit_partitions, expire_visit_partitions
+
+VISIT_MAINTENANCE_INTERVAL = float(os.getenv("VISIT_MAINTENANCE_INTERVAL", "300"))
+VISIT_ROLLUP_LAG = float(os.getenv("VISIT_ROLLUP_LAG", "900"))
+VISIT_PARTITIONS_AHEAD = int(os.getenv("VISIT_PARTITIONS_AHEAD", "3"))
+# 0 keeps visits forever
+VISITS_RETENTION_MONTHS = int(os.getenv("VISITS_RETENTION_MONTHS", "24"))
+VISITS_RETENTION_ACTION = os.getenv("VISITS_RETENTION_ACTION", "drop")
+
+logger = logging.getLogger(__name__)
+
+
+class VisitMaintenanceJob:
+    """Periodic task that keeps visit partitions, rollups and retention up to date"""
+
+    def __init__(self, interval: float, lag: float, partitions_ahead: int, retention_months: int, archive: bool):
+        self.interval = interval
+        self.lag = lag
+        self.partitions_ahead = partitions_ahead
+        self.retention_months = retention_months
+        self.archive = archive
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"runs": 0, "days_rolled_up": 0, "partitions_created": 0, "partitions_expired": 0,
+                       "failures": 0, "last_run_at": None, "last_run_ms": None}
+
+    async def run_once(self) -> Dict[str, int]:
+        """One maintenance pass; rollups run in bounded chunks, one transaction each"""
+        started = time.monotonic()
+        created = await ensure_visit_partitions(self.partitions_ahead)
+
+        rolled_up = 0
+        while True:
+            days = await refresh_visit_rollups(self.lag)
+            if not days:
+                break
+            rolled_up += days
+
+        expired = 0
+        if self.retention_months > 0:
+            expired = await expire_visit_partitions(self.retention_months, self.archive)
+
+        self._stats["runs"] += 1
+        self._stats["days_rolled_up"] += rolled_up
+        self._stats["partitions_created"] += created
+        self._stats["partitions_expired"] += expired
+        self._stats["last_run_at"] = time.time()
+        self._stats["last_run_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return {"partitions_created": created, "days_rolled_up": rolled_up, "partitions_expired": expired}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, PoolTimeoutError) as e:
+                self._stats["failures"] += 1
+                logger.warning("Visit maintenance failed: %s", e)
+            except Exception:
+                # Keep the loop alive: partitions, rollups and retention would silently stop
+                self._stats["failures"] += 1
+                logger.exception("Visit maintenance failed unexpectedly")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        """Start the periodic maintenance (called on application startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "interval_seconds": self.interval,
+            "rollup_lag_seconds": self.lag,
+            "partitions_ahead": self.partitions_ahead,
+            "retention_months": self.retention_months,
+            "retention_action": "archive" if self.archive else "drop",
+        }
+
+
+visit_maintenance_job = VisitMaintenanceJob(
+    VISIT_MAINTENANCE_INTERVAL,
+    VISIT_ROLLUP_LAG,
+    VISIT_PARTITIONS_AHEAD,
+    VISITS_RETENTION_MONTHS,
+    archive=VISITS_RETENTION_ACTION == "archive",
+)
@@ -31,8 +31,8 @@ CREATE TABLE IF NOT EXISTS mostres (
     acid_tricloroacetic DECIMAL(10,2), -- ug/l
     acid_monobromoacetic DECIMAL(10,2), -- ug/l
     acid_dibromoacetic DECIMAL(10,2), -- ug/l
-    validated BOOLEAN DEFAULT FALSE, -- Whether the sample has been admin-validated
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    validated BOOLEAN NOT NULL DEFAULT FALSE, -- Whether the sample has been admin-validated
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- keyset pagination sort key
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -45,8 +45,102 @@ INSERT INTO parameters (name, value) VALUES
 CREATE INDEX IF NOT EXISTS idx_mostres_data ON mostres(data DESC);
 CREATE INDEX IF NOT EXISTS idx_mostres_punt_mostreig ON mostres(punt_mostreig);
 CREATE INDEX IF NOT EXISTS idx_mostres_created_at ON mostres(created_at DESC);
+-- Sample listing access paths: public listing (validated, newest first, keyset on data/created_at/id),
+-- admin listing (pending first) and the pending count (index-only scan of the pending rows)
+CREATE INDEX IF NOT EXISTS idx_mostres_public_listing ON mostres(data DESC, created_at DESC, id DESC)
+    WHERE validated = TRUE;
+CREATE INDEX IF NOT EXISTS idx_mostres_admin_listing ON mostres(validated ASC, data DESC, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_mostres_pending ON mostres(id) WHERE validated = FALSE;
+-- Newest validated samples of one sampling point (refresh_mostres_latest)
+CREATE INDEX IF NOT EXISTS idx_mostres_location_latest ON mostres(punt_mostreig, data DESC) WHERE validated = TRUE;
 CREATE INDEX IF NOT EXISTS idx_parameters_name ON parameters(name);
 
+-- Latest validated sample per sampling point (home page snapshot)
+-- Maintained by trigger; completeness = number of reported parameters, used to break date ties
+CREATE TABLE IF NOT EXISTS mostres_latest (
+    punt_mostreig VARCHAR(255) PRIMARY KEY,
+    sample_id INTEGER NOT NULL,
+    data DATE NOT NULL,
+    completeness INTEGER NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_mostres_latest_recency ON mostres_latest(data DESC, completeness DESC);
+
+CREATE OR REPLACE FUNCTION mostres_completeness(m mostres) RETURNS INTEGER AS $$
+    SELECT num_nonnulls(
+        m.temperatura, m.clor_lliure, m.clor_total, m.recompte_escherichia_coli, m.recompte_enterococ,
+        m.recompte_microorganismes_aerobis_22c, m.recompte_coliformes_totals, m.conductivitat_20c,
+        m.ph, m.terbolesa, m.color, m.olor, m.sabor, m.acid_monocloroacetic, m.acid_dicloroacetic,
+        m.acid_tricloroacetic, m.acid_monobromoacetic, m.acid_dibromoacetic
+    );
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION refresh_mostres_latest(location VARCHAR) RETURNS VOID AS $$
+DECLARE
+    latest RECORD;
+BEGIN
+    -- Serialize refreshes of the same location so concurrent writers cannot race
+    PERFORM pg_advisory_xact_lock(hashtext('mostres_latest:' || location));
+
+    SELECT m.id, m.data, mostres_completeness(m) AS completeness INTO latest
+    FROM mostres m
+    WHERE m.punt_mostreig = location AND m.validated = TRUE
+    ORDER BY m.data DESC, mostres_completeness(m) DESC, m.created_at DESC, m.id DESC
+    LIMIT 1;
+
+    IF NOT FOUND THEN
+        DELETE FROM mostres_latest WHERE punt_mostreig = location;
+    ELSE
+        INSERT INTO mostres_latest (punt_mostreig, sample_id, data, completeness, refreshed_at)
+        VALUES (location, latest.id, latest.data, latest.completeness, CURRENT_TIMESTAMP)
+        ON CONFLICT (punt_mostreig) DO UPDATE
+        SET sample_id = EXCLUDED.sample_id,
+            data = EXCLUDED.data,
+            completeness = EXCLUDED.completeness,
+            refreshed_at = EXCLUDED.refreshed_at;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level: every location touched by the statement is refreshed once, in name order (the
+-- advisory locks of refresh_mostres_latest are then always taken in the same order)
+CREATE OR REPLACE FUNCTION mostres_latest_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_mostres_latest(punt_mostreig)
+        FROM (SELECT DISTINCT punt_mostreig FROM new_rows WHERE validated ORDER BY 1) locations;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM refresh_mostres_latest(punt_mostreig)
+        FROM (SELECT punt_mostreig FROM old_rows UNION SELECT punt_mostreig FROM new_rows ORDER BY 1) locations;
+    ELSE
+        PERFORM refresh_mostres_latest(punt_mostreig)
+        FROM (SELECT DISTINCT punt_mostreig FROM old_rows ORDER BY 1) locations;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables allow a single event per trigger
+DROP TRIGGER IF EXISTS trg_mostres_latest ON mostres;
+DROP TRIGGER IF EXISTS trg_mostres_latest_insert ON mostres;
+CREATE TRIGGER trg_mostres_latest_insert
+    AFTER INSERT ON mostres REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mostres_latest_trigger();
+DROP TRIGGER IF EXISTS trg_mostres_latest_update ON mostres;
+CREATE TRIGGER trg_mostres_latest_update
+    AFTER UPDATE ON mostres REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mostres_latest_trigger();
+DROP TRIGGER IF EXISTS trg_mostres_latest_delete ON mostres;
+CREATE TRIGGER trg_mostres_latest_delete
+    AFTER DELETE ON mostres REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mostres_latest_trigger();
+
+-- Backfill from existing samples
+SELECT refresh_mostres_latest(punt_mostreig) FROM (SELECT DISTINCT punt_mostreig FROM mostres) locations;
+
+COMMENT ON TABLE mostres_latest IS 'Latest validated sample per sampling point, maintained by the trg_mostres_latest_* triggers';
+
 -- Add comments to tables for documentation
 COMMENT ON TABLE parameters IS 'System configuration parameters';
 COMMENT ON TABLE mostres IS 'Water quality samples and measurements';
@@ -65,16 +159,291 @@ COMMENT ON COLUMN mostres.recompte_microorganismes_aerobis_22c IS 'Aerobic micro
 COMMENT ON COLUMN mostres.recompte_coliformes_totals IS 'Total coliforms count in NMP/100ml';
 COMMENT ON COLUMN mostres.validated IS 'Whether the sample has been admin-validated for public display';
 
+-- Visits are range-partitioned by month (visits_YYYY_MM). The backend pre-creates future partitions and
+-- expires old ones (ensure_visit_partitions / expire_visit_partitions), so retention never needs a DELETE
 CREATE TABLE IF NOT EXISTS visits (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     page VARCHAR(100) NOT NULL,
     user_agent TEXT,
     ip_address VARCHAR(45),
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    session_id VARCHAR(64),
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches visits outside the created monthly partitions (clock skew, far future timestamps) instead of
+-- failing their whole COPY batch; ensure_visit_partitions moves them out when their month is created
+CREATE TABLE IF NOT EXISTS visits_default PARTITION OF visits DEFAULT;
+
+-- Create the monthly partitions from months_back months ago to months_ahead months ahead. Rows already
+-- caught by visits_default for a new month are moved into its partition before it is attached
+CREATE OR REPLACE FUNCTION ensure_visit_partitions(months_ahead INTEGER DEFAULT 3, months_back INTEGER DEFAULT 0)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('visit_partitions'));
+    FOR i IN -months_back..months_ahead LOOP
+        month_start := (date_trunc('month', CURRENT_DATE::timestamp) + make_interval(months => i))::date;
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := 'visits_' || to_char(month_start, 'YYYY_MM');
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        IF EXISTS (SELECT 1 FROM visits_default WHERE timestamp >= month_start AND timestamp < month_end) THEN
+            EXECUTE format('CREATE TABLE %I (LIKE visits INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format('WITH moved AS (DELETE FROM visits_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+            EXECUTE format('ALTER TABLE visits ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_end);
+        ELSE
+            EXECUTE format('CREATE TABLE %I PARTITION OF visits FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_end);
+        END IF;
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach the partitions of months that ended more than retention_months ago and drop them,
+-- or keep them as standalone visits_archive_YYYY_MM tables when archive is true. Only months
+-- already rolled up (ending on or before visits_rollup_state.next_day) are expired; the
+-- visits_daily_visitors rows and stray visits_default rows of those days go with them
+CREATE OR REPLACE FUNCTION expire_visit_partitions(retention_months INTEGER, archive BOOLEAN DEFAULT FALSE)
+RETURNS INTEGER AS $$
+DECLARE
+    part RECORD;
+    cutoff DATE := (date_trunc('month', CURRENT_DATE::timestamp) - make_interval(months => retention_months))::date;
+    rolled_up_until DATE;
+    expired INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('visit_partitions'));
+    SELECT next_day INTO rolled_up_until FROM visits_rollup_state WHERE id = 1;
+    IF rolled_up_until IS NULL THEN
+        RETURN 0;
+    END IF;
+    cutoff := LEAST(cutoff, rolled_up_until);
+
+    FOR part IN
+        SELECT c.relname, to_date(substring(c.relname FROM '^visits_(\d{4}_\d{2})$'), 'YYYY_MM') AS month_start
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visits'::regclass AND c.relname ~ '^visits_\d{4}_\d{2}$'
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN part.month_start + INTERVAL '1 month' > cutoff;
+        EXECUTE format('ALTER TABLE visits DETACH PARTITION %I', part.relname);
+        IF archive THEN
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', part.relname,
+                           'visits_archive_' || to_char(part.month_start, 'YYYY_MM'));
+        ELSE
+            EXECUTE format('DROP TABLE %I', part.relname);
+        END IF;
+        expired := expired + 1;
+    END LOOP;
+
+    DELETE FROM visits_default WHERE timestamp < cutoff;
+    DELETE FROM visits_daily_visitors WHERE day < cutoff;
+    RETURN expired;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_visit_partitions(3);
 
 -- Indexes for visits
 CREATE INDEX IF NOT EXISTS idx_visits_timestamp ON visits(timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_visits_page ON visits(page);
+-- Visits still waiting for the client IP, looked up by session when the IP arrives
+CREATE INDEX IF NOT EXISTS idx_visits_pending_session ON visits(session_id, timestamp)
+    WHERE ip_address IS NULL OR ip_address IN ('', 'pending');
 
 COMMENT ON TABLE visits IS 'Page visit tracking for admin/dashboard analytics';
+COMMENT ON COLUMN visits.session_id IS 'Client session (browser tab) that recorded the visit';
+
+-- Change notifications: every write to mostres/parameters emits one NOTIFY per statement so
+-- each API worker can invalidate its in-process caches (see backend/notifications.py)
+CREATE OR REPLACE FUNCTION notify_data_change() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('aigualba_changes', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- mostres events also say what happened (created/validated/invalidated/updated/deleted) and to how
+-- many rows, so the live sample stream can forward them to browsers
+CREATE OR REPLACE FUNCTION notify_mostres_change() RETURNS TRIGGER AS $$
+DECLARE
+    change_event TEXT;
+    affected INTEGER;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT 'created', COUNT(*) INTO change_event, affected FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT 'deleted', COUNT(*) INTO change_event, affected FROM old_rows;
+    ELSE
+        SELECT CASE
+                   WHEN bool_or(n.validated IS TRUE AND o.validated IS NOT TRUE) THEN 'validated'
+                   WHEN bool_or(o.validated IS TRUE AND n.validated IS NOT TRUE) THEN 'invalidated'
+                   ELSE 'updated'
+               END,
+               COUNT(*)
+        INTO change_event, affected
+        FROM new_rows n JOIN old_rows o ON o.id = n.id;
+    END IF;
+    IF affected > 0 THEN
+        PERFORM pg_notify('aigualba_changes', json_build_object(
+            'table', TG_TABLE_NAME, 'op', TG_OP, 'event', change_event, 'count', affected)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_mostres_notify ON mostres;
+DROP TRIGGER IF EXISTS trg_mostres_notify_insert ON mostres;
+CREATE TRIGGER trg_mostres_notify_insert
+    AFTER INSERT ON mostres REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_mostres_change();
+
+DROP TRIGGER IF EXISTS trg_mostres_notify_update ON mostres;
+CREATE TRIGGER trg_mostres_notify_update
+    AFTER UPDATE ON mostres REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_mostres_change();
+
+DROP TRIGGER IF EXISTS trg_mostres_notify_delete ON mostres;
+CREATE TRIGGER trg_mostres_notify_delete
+    AFTER DELETE ON mostres REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_mostres_change();
+
+DROP TRIGGER IF EXISTS trg_mostres_notify_truncate ON mostres;
+CREATE TRIGGER trg_mostres_notify_truncate
+    AFTER TRUNCATE ON mostres
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change();
+
+DROP TRIGGER IF EXISTS trg_parameters_notify ON parameters;
+CREATE TRIGGER trg_parameters_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON parameters
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change();
+
+-- Visit rollups: per-day/page counters, per-day and per-month totals and the distinct visitors per day/page
+-- (to combine unique counts over arbitrary windows). Complete days are rolled up by
+-- refresh_visit_rollups(); statistics read the rollups plus the live visits since next_day.
+CREATE TABLE IF NOT EXISTS visits_daily_visitors (
+    day DATE NOT NULL,
+    page VARCHAR(100) NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    PRIMARY KEY (day, page, ip_address)
+);
+
+CREATE TABLE IF NOT EXISTS visits_daily_pages (
+    day DATE NOT NULL,
+    page VARCHAR(100) NOT NULL,
+    visits BIGINT NOT NULL,
+    unique_visitors BIGINT NOT NULL,
+    PRIMARY KEY (day, page)
+);
+
+CREATE TABLE IF NOT EXISTS visits_daily (
+    day DATE PRIMARY KEY,
+    visits BIGINT NOT NULL,
+    unique_visitors BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS visits_monthly (
+    month DATE PRIMARY KEY,
+    visits BIGINT NOT NULL,
+    unique_visitors BIGINT NOT NULL
+);
+
+-- Single-row watermark: every day before next_day is rolled up
+CREATE TABLE IF NOT EXISTS visits_rollup_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    next_day DATE NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION refresh_visit_rollups(complete_before DATE, max_days INTEGER DEFAULT 31) RETURNS INTEGER AS $$
+DECLARE
+    start_day DATE;
+    end_day DATE;
+BEGIN
+    -- One refresher at a time; concurrent callers (other API workers) simply skip
+    IF NOT pg_try_advisory_xact_lock(hashtext('visit_rollups')) THEN
+        RETURN 0;
+    END IF;
+
+    SELECT next_day INTO start_day FROM visits_rollup_state WHERE id = 1;
+    IF start_day IS NULL THEN
+        SELECT COALESCE(MIN(timestamp)::date, complete_before) INTO start_day FROM visits;
+    END IF;
+    end_day := LEAST(complete_before, start_day + max_days);
+    IF start_day >= end_day THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM visits_daily_visitors WHERE day >= start_day AND day < end_day;
+    INSERT INTO visits_daily_visitors (day, page, ip_address)
+    SELECT DISTINCT timestamp::date, page, ip_address
+    FROM visits
+    WHERE timestamp >= start_day AND timestamp < end_day
+      AND ip_address IS NOT NULL AND ip_address NOT IN ('', 'pending');
+
+    DELETE FROM visits_daily_pages WHERE day >= start_day AND day < end_day;
+    INSERT INTO visits_daily_pages (day, page, visits, unique_visitors)
+    SELECT timestamp::date, page, COUNT(*),
+           COUNT(DISTINCT ip_address) FILTER (WHERE ip_address NOT IN ('', 'pending'))
+    FROM visits
+    WHERE timestamp >= start_day AND timestamp < end_day
+    GROUP BY 1, 2;
+
+    DELETE FROM visits_daily WHERE day >= start_day AND day < end_day;
+    INSERT INTO visits_daily (day, visits, unique_visitors)
+    SELECT p.day, SUM(p.visits),
+           (SELECT COUNT(DISTINCT v.ip_address) FROM visits_daily_visitors v WHERE v.day = p.day)
+    FROM visits_daily_pages p
+    WHERE p.day >= start_day AND p.day < end_day
+    GROUP BY p.day;
+
+    -- Months that are now complete
+    INSERT INTO visits_monthly (month, visits, unique_visitors)
+    SELECT m.month::date,
+           COALESCE((SELECT SUM(d.visits) FROM visits_daily d
+                     WHERE d.day >= m.month AND d.day < m.month + INTERVAL '1 month'), 0),
+           (SELECT COUNT(DISTINCT v.ip_address) FROM visits_daily_visitors v
+            WHERE v.day >= m.month AND v.day < m.month + INTERVAL '1 month')
+    FROM generate_series(date_trunc('month', start_day::timestamp),
+                         date_trunc('month', end_day::timestamp) - INTERVAL '1 month',
+                         INTERVAL '1 month') AS m(month)
+    ON CONFLICT (month) DO UPDATE
+    SET visits = EXCLUDED.visits, unique_visitors = EXCLUDED.unique_visitors;
+
+    INSERT INTO visits_rollup_state (id, next_day, refreshed_at)
+    VALUES (1, end_day, CURRENT_TIMESTAMP)
+    ON CONFLICT (id) DO UPDATE SET next_day = EXCLUDED.next_day, refreshed_at = EXCLUDED.refreshed_at;
+
+    RETURN end_day - start_day;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON TABLE visits_daily IS 'Visits and unique visitors per day, maintained by refresh_visit_rollups()';
+COMMENT ON TABLE visits_monthly IS 'Visits and unique visitors per complete month, maintained by refresh_visit_rollups()';
+
+-- Versioned migrations (db/migrate.py). A fresh database already has the schema of every
+-- migration listed here; their checksums are filled in by the first migrate.py run.
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(20) PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    checksum CHAR(64),
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    execution_ms INTEGER
+);
+
+INSERT INTO schema_migrations (version, name) VALUES
+('0001', 'baseline'),
+('0002', 'mostres_listing_indexes'),
+('0003', 'visit_partition_safety'),
+('0004', 'mostres_location_latest_index'),
+('0005', 'mostres_latest_statement_triggers'),
+('0006', 'mostres_sort_keys_not_null')
+ON CONFLICT (version) DO NOTHING;
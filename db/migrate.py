@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migration runner
+Applies the pending migrations in db/migrations in version order and records
+each one in schema_migrations (version, name, checksum, applied_at, execution_ms).
+
+Migration files are named NNNN_description.sql or NNNN_description.py:
+
+- SQL files run in one transaction with a short lock_timeout. A file starting
+  with the line `-- migrate: no-transaction` runs statement by statement in
+  autocommit instead, which CREATE INDEX CONCURRENTLY and VACUUM require.
+  Before it is retried, invalid indexes left behind by an interrupted
+  concurrent build of the same migration are dropped.
+- Python files define migrate(ctx) and may set TRANSACTIONAL = False. ctx.execute
+  runs a statement. ctx.backfill updates a large table in small committed
+  batches (only when TRANSACTIONAL = False), so rows are never locked for long.
+
+The checksum of every applied migration is compared with its file, and the run
+stops if one was edited after being applied. A session advisory lock keeps
+two runners from applying migrations at the same time.
+
+Usage:
+    python migrate.py             # apply pending migrations
+    python migrate.py --dry-run   # print what would run, change nothing
+    python migrate.py --status    # list applied and pending migrations
+    python migrate.py --target 0003
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+import time
+
+import psycopg2
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Transactional steps give up instead of queueing behind long readers (and blocking everyone after them)
+MIGRATE_LOCK_TIMEOUT = os.getenv("MIGRATE_LOCK_TIMEOUT", "5s")
+MIGRATE_BACKFILL_BATCH = int(os.getenv("MIGRATE_BACKFILL_BATCH", "5000"))
+# How long a backfill waits for rows locked by other sessions before giving up
+MIGRATE_BACKFILL_LOCK_WAIT = float(os.getenv("MIGRATE_BACKFILL_LOCK_WAIT", "60"))
+
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.(sql|py)$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE
+)
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(20) PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        checksum CHAR(64),
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        execution_ms INTEGER
+    )
+"""
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, "rb") as f:
+            self.source = f.read()
+        self.checksum = hashlib.sha256(self.source).hexdigest()
+        self.kind = path.rsplit(".", 1)[1]
+        self.transactional = True
+        if self.kind == "sql":
+            self.transactional = not self.text.lstrip().startswith(NO_TRANSACTION)
+
+    @property
+    def text(self):
+        return self.source.decode("utf-8")
+
+    def __str__(self):
+        return f"{self.version}_{self.name}"
+
+
+class MigrationContext:
+    """What a Python migration gets: statement execution and batched backfills, both dry-run aware"""
+
+    def __init__(self, conn, dry_run, transactional):
+        self.conn = conn
+        self.dry_run = dry_run
+        self.transactional = transactional
+
+    def execute(self, statement, params=None):
+        if self.dry_run:
+            print(f"    would run: {_summary(statement)}")
+            return
+        with self.conn.cursor() as cur:
+            cur.execute(statement, params)
+
+    def backfill(self, table, set_clause, where, key="id", batch_size=MIGRATE_BACKFILL_BATCH, pause=0.0):
+        """UPDATE table SET set_clause for the rows matching where, batch_size keys per committed transaction
+
+        where must stop matching a row once it is updated (e.g. "new_column IS NULL"),
+        otherwise the loop never ends. Rows locked by other sessions are skipped
+        and picked up by a later batch: when only locked rows remain, it retries
+        with backoff and raises if they are still pending after
+        MIGRATE_BACKFILL_LOCK_WAIT seconds. Returns the number of rows updated.
+        """
+        if self.transactional:
+            raise RuntimeError("backfill() commits per batch; set TRANSACTIONAL = False in the migration")
+        with self.conn.cursor() as cur:
+            if self.dry_run:
+                cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}")
+                rows = cur.fetchone()[0]
+                print(f"    would backfill {rows} rows of {table} in batches of {batch_size}: SET {set_clause}")
+                return 0
+            total = 0
+            waited, delay = 0.0, 0.1
+            while True:
+                cur.execute(f"""
+                    WITH batch AS (
+                        SELECT {key} FROM {table} WHERE {where} LIMIT %s FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE {table} AS t SET {set_clause} FROM batch WHERE t.{key} = batch.{key}
+                """, (batch_size,))
+                if cur.rowcount <= 0:
+                    # Nothing updated can also mean every remaining row is locked by someone else
+                    cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}")
+                    remaining = cur.fetchone()[0]
+                    if remaining == 0:
+                        return total
+                    if waited >= MIGRATE_BACKFILL_LOCK_WAIT:
+                        raise RuntimeError(
+                            f"Backfill of {table} stopped with {remaining} rows still locked "
+                            f"after {MIGRATE_BACKFILL_LOCK_WAIT:.0f}s; rerun the migration"
+                        )
+                    print(f"    {remaining} rows of {table} locked by other sessions, retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                    waited += delay
+                    delay = min(delay * 2, 5.0)
+                    continue
+                waited, delay = 0.0, 0.1
+                total += cur.rowcount
+                print(f"    backfilled {total} rows of {table}")
+                if pause:
+                    time.sleep(pause)
+
+
+def split_statements(sql):
+    """Split a SQL script on top-level semicolons (quotes, dollar quotes and comments respected)"""
+    statements, current, i, n = [], [], 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end + 1
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+        elif ch in ("'", '"'):
+            end = i + 1
+            while end < n:
+                if sql[end] == ch:
+                    if end + 1 < n and sql[end + 1] == ch:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            end = min(end + 1, n)
+        elif ch == "$" and re.match(r"\$\w*\$", sql[i:]):
+            tag = re.match(r"\$\w*\$", sql[i:]).group(0)
+            end = sql.find(tag, i + len(tag))
+            end = n if end == -1 else end + len(tag)
+        elif ch == ";":
+            statements.append("".join(current).strip())
+            current, i = [], i + 1
+            continue
+        else:
+            end = i + 1
+        current.append(sql[i:end])
+        i = end
+    statements.append("".join(current).strip())
+    return [s for s in statements if _strip_comments(s)]
+
+
+def _strip_comments(statement):
+    return re.sub(r"--[^\n]*", "", statement).strip()
+
+
+def _summary(statement):
+    line = " ".join(_strip_comments(statement).split())
+    return line if len(line) <= 100 else line[:97] + "..."
+
+
+def load_migrations():
+    """Migration files by version, checking for duplicate versions"""
+    migrations = {}
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+        version, name, _ = match.groups()
+        if version in migrations:
+            raise ValueError(f"Duplicate migration version {version}: {migrations[version].path} and {filename}")
+        migrations[version] = Migration(version, name, os.path.join(MIGRATIONS_DIR, filename))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def get_db_connection():
+    """Get a database connection"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required")
+    return psycopg2.connect(DATABASE_URL)
+
+
+def fetch_applied(conn):
+    """{version: checksum} of the applied migrations (empty before the first run)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return {}
+        cur.execute("SELECT version, checksum FROM schema_migrations")
+        return dict(cur.fetchall())
+
+
+def check_checksums(conn, migrations, applied, dry_run):
+    """Refuse to run if an applied migration changed; adopt the checksums of rows written by init.*.sql"""
+    changed = [m for m in migrations if applied.get(m.version) and applied[m.version].strip() != m.checksum]
+    if changed:
+        raise RuntimeError("Applied migrations were modified since: " + ", ".join(str(m) for m in changed)
+                           + ". Add a new migration instead of editing an applied one.")
+    adopt = [m for m in migrations if m.version in applied and not applied[m.version]]
+    if adopt and not dry_run:
+        with conn.cursor() as cur:
+            for migration in adopt:
+                cur.execute("UPDATE schema_migrations SET checksum = %s WHERE version = %s",
+                            (migration.checksum, migration.version))
+        conn.commit()
+
+
+def _drop_invalid_indexes(conn, migration):
+    """Drop the invalid indexes a previous, interrupted run of this migration left behind"""
+    names = CONCURRENT_INDEX.findall(migration.text)
+    if not names:
+        return
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid AND c.relname = ANY(%s)
+        """, (names,))
+        for (name,) in cur.fetchall():
+            print(f"    dropping invalid index {name} from an interrupted run")
+            cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def _load_python(migration):
+    spec = importlib.util.spec_from_file_location(f"migration_{migration.version}", migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    migration.transactional = getattr(module, "TRANSACTIONAL", True)
+    return module
+
+
+def _run_python(conn, migration, module, dry_run):
+    conn.autocommit = not migration.transactional
+    if migration.transactional and not dry_run:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL lock_timeout = %s", (MIGRATE_LOCK_TIMEOUT,))
+    module.migrate(MigrationContext(conn, dry_run, migration.transactional))
+
+
+def apply_migration(conn, migration, dry_run):
+    module = _load_python(migration) if migration.kind == "py" else None
+    mode = "transaction" if migration.transactional else "no transaction"
+    print(f"{'Would apply' if dry_run else 'Applying'} {migration} ({mode})")
+    started = time.monotonic()
+
+    if migration.kind == "py":
+        _run_python(conn, migration, module, dry_run)
+    elif dry_run:
+        for statement in split_statements(migration.text):
+            print(f"    would run: {_summary(statement)}")
+    elif migration.transactional:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL lock_timeout = %s", (MIGRATE_LOCK_TIMEOUT,))
+            cur.execute(migration.text)
+    else:
+        conn.autocommit = True
+        _drop_invalid_indexes(conn, migration)
+        with conn.cursor() as cur:
+            for statement in split_statements(migration.text):
+                print(f"    {_summary(statement)}")
+                cur.execute(statement)
+
+    if dry_run:
+        conn.rollback()
+        conn.autocommit = False
+        return
+
+    # Recorded in the migration's own transaction when it has one, so both commit or neither does
+    elapsed_ms = int((time.monotonic() - started) * 1000)
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO schema_migrations (version, name, checksum, execution_ms)
+            VALUES (%s, %s, %s, %s)
+        """, (migration.version, migration.name, migration.checksum, elapsed_ms))
+    if not conn.autocommit:
+        conn.commit()
+    conn.autocommit = False
+    print(f"✓ {migration} applied in {elapsed_ms} ms")
+
+
+def run(dry_run=False, status=False, target=None):
+    migrations = load_migrations()
+    if target:
+        migrations = [m for m in migrations if m.version <= target]
+
+    conn = get_db_connection()
+    try:
+        print("✓ Connected to database successfully")
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext('schema_migrations'))")
+            if not cur.fetchone()[0]:
+                raise RuntimeError("Another migration run holds the schema_migrations lock")
+        conn.commit()
+
+        if not (dry_run or status):
+            with conn.cursor() as cur:
+                cur.execute(SCHEMA_MIGRATIONS_DDL)
+            conn.commit()
+
+        applied = fetch_applied(conn)
+        check_checksums(conn, migrations, applied, dry_run or status)
+        # End the read transaction: no-transaction migrations switch the connection to autocommit
+        conn.commit()
+        pending = [m for m in migrations if m.version not in applied]
+
+        if status:
+            for migration in migrations:
+                print(f"  [{'x' if migration.version in applied else ' '}] {migration}")
+            print(f"{len(pending)} pending")
+            return
+
+        if not pending:
+            print("✓ Schema is up to date")
+            return
+        for migration in pending:
+            try:
+                apply_migration(conn, migration, dry_run)
+            except Exception:
+                if not conn.autocommit:
+                    conn.rollback()
+                conn.autocommit = False
+                print(f"✗ {migration} failed; later migrations were not run")
+                raise
+        if dry_run:
+            print(f"Dry run: {len(pending)} migration(s) would be applied")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the versioned migrations in db/migrations")
+    parser.add_argument("--dry-run", action="store_true", help="print the pending migrations without applying them")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--target", help="stop after this version (e.g. 0003)")
+    args = parser.parse_args()
+    try:
+        run(dry_run=args.dry_run, status=args.status, target=args.target)
+    except Exception as e:
+        print(f"Migration error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
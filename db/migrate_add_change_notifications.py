@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Migration script to add change notifications
+This script will:
+1. Create the notify_data_change() trigger function
+2. Attach statement-level NOTIFY triggers to mostres and parameters
+
+API workers LISTEN on the 'aigualba_changes' channel and drop their
+in-process caches when a notification arrives. It is safe to run more than once.
+"""
+
+import os
+import psycopg2
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+NOTIFY_DDL = """
+    CREATE OR REPLACE FUNCTION notify_data_change() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM pg_notify('aigualba_changes', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_mostres_notify ON mostres;
+    CREATE TRIGGER trg_mostres_notify
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON mostres
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change();
+
+    DROP TRIGGER IF EXISTS trg_parameters_notify ON parameters;
+    CREATE TRIGGER trg_parameters_notify
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON parameters
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change();
+"""
+
+def get_db_connection():
+    """Get a database connection"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required")
+    return psycopg2.connect(DATABASE_URL)
+
+def run_migration():
+    """Run the change notification migration"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        print("✓ Connected to database successfully")
+        print("Creating NOTIFY triggers on mostres and parameters...")
+        cur.execute(NOTIFY_DDL)
+
+        conn.commit()
+        print("✓ Migration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Migration failed: {str(e)}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    try:
+        run_migration()
+    except Exception as e:
+        print(f"Migration error: {e}")
+        exit(1)
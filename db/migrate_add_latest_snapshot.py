@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the mostres_latest snapshot table
+This script will:
+1. Create the mostres_latest table (latest validated sample per sampling point)
+2. Create the trigger that keeps it up to date on every insert/update/delete of mostres
+3. Backfill it from the existing samples
+
+It is safe to run more than once.
+"""
+
+import os
+import psycopg2
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+SNAPSHOT_DDL = """
+    -- Latest validated sample per sampling point (home page snapshot)
+    -- Maintained by trigger; completeness = number of reported parameters, used to break date ties
+    CREATE TABLE IF NOT EXISTS mostres_latest (
+        punt_mostreig VARCHAR(255) PRIMARY KEY,
+        sample_id INTEGER NOT NULL,
+        data DATE NOT NULL,
+        completeness INTEGER NOT NULL,
+        refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_mostres_latest_recency ON mostres_latest(data DESC, completeness DESC);
+
+    CREATE OR REPLACE FUNCTION mostres_completeness(m mostres) RETURNS INTEGER AS $$
+        SELECT num_nonnulls(
+            m.temperatura, m.clor_lliure, m.clor_total, m.recompte_escherichia_coli, m.recompte_enterococ,
+            m.recompte_microorganismes_aerobis_22c, m.recompte_coliformes_totals, m.conductivitat_20c,
+            m.ph, m.terbolesa, m.color, m.olor, m.sabor, m.acid_monocloroacetic, m.acid_dicloroacetic,
+            m.acid_tricloroacetic, m.acid_monobromoacetic, m.acid_dibromoacetic
+        );
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION refresh_mostres_latest(location VARCHAR) RETURNS VOID AS $$
+    DECLARE
+        latest RECORD;
+    BEGIN
+        -- Serialize refreshes of the same location so concurrent writers cannot race
+        PERFORM pg_advisory_xact_lock(hashtext('mostres_latest:' || location));
+
+        SELECT m.id, m.data, mostres_completeness(m) AS completeness INTO latest
+        FROM mostres m
+        WHERE m.punt_mostreig = location AND m.validated = TRUE
+        ORDER BY m.data DESC, mostres_completeness(m) DESC, m.created_at DESC, m.id DESC
+        LIMIT 1;
+
+        IF NOT FOUND THEN
+            DELETE FROM mostres_latest WHERE punt_mostreig = location;
+        ELSE
+            INSERT INTO mostres_latest (punt_mostreig, sample_id, data, completeness, refreshed_at)
+            VALUES (location, latest.id, latest.data, latest.completeness, CURRENT_TIMESTAMP)
+            ON CONFLICT (punt_mostreig) DO UPDATE
+            SET sample_id = EXCLUDED.sample_id,
+                data = EXCLUDED.data,
+                completeness = EXCLUDED.completeness,
+                refreshed_at = EXCLUDED.refreshed_at;
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION mostres_latest_trigger() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM refresh_mostres_latest(OLD.punt_mostreig);
+        END IF;
+        IF (TG_OP = 'INSERT' AND NEW.validated)
+           OR (TG_OP = 'UPDATE' AND NEW.punt_mostreig IS DISTINCT FROM OLD.punt_mostreig) THEN
+            PERFORM refresh_mostres_latest(NEW.punt_mostreig);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_mostres_latest ON mostres;
+    CREATE TRIGGER trg_mostres_latest
+        AFTER INSERT OR UPDATE OR DELETE ON mostres
+        FOR EACH ROW EXECUTE FUNCTION mostres_latest_trigger();
+"""
+
+def get_db_connection():
+    """Get a database connection"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required")
+    return psycopg2.connect(DATABASE_URL)
+
+def run_migration():
+    """Run the latest-sample snapshot migration"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        print("✓ Connected to database successfully")
+        print("Creating mostres_latest table and trigger...")
+        cur.execute(SNAPSHOT_DDL)
+
+        print("Backfilling latest sample per sampling point...")
+        cur.execute("""
+            SELECT refresh_mostres_latest(punt_mostreig)
+            FROM (SELECT DISTINCT punt_mostreig FROM mostres) locations
+        """)
+
+        conn.commit()
+        print("✓ Migration completed successfully!")
+
+        cur.execute("SELECT COUNT(*) FROM mostres_latest")
+        print(f"Summary:")
+        print(f"  - Sampling points in snapshot: {cur.fetchone()[0]}")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Migration failed: {str(e)}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    try:
+        run_migration()
+    except Exception as e:
+        print(f"Migration error: {e}")
+        exit(1)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Migration script to add typed sample change events
+This script will:
+1. Create the notify_mostres_change() trigger function
+2. Replace the generic mostres NOTIFY trigger with per-operation triggers that
+   report the kind of change (created/validated/invalidated/updated/deleted)
+
+Requires migrate_add_change_notifications.py to have been run first.
+It is safe to run more than once.
+"""
+
+import os
+import psycopg2
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+EVENTS_DDL = """
+    -- mostres events also say what happened (created/validated/invalidated/updated/deleted) and to how
+    -- many rows, so the live sample stream can forward them to browsers
+    CREATE OR REPLACE FUNCTION notify_mostres_change() RETURNS TRIGGER AS $$
+    DECLARE
+        change_event TEXT;
+        affected INTEGER;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            SELECT 'created', COUNT(*) INTO change_event, affected FROM new_rows;
+        ELSIF TG_OP = 'DELETE' THEN
+            SELECT 'deleted', COUNT(*) INTO change_event, affected FROM old_rows;
+        ELSE
+            SELECT CASE
+                       WHEN bool_or(n.validated IS TRUE AND o.validated IS NOT TRUE) THEN 'validated'
+                       WHEN bool_or(o.validated IS TRUE AND n.validated IS NOT TRUE) THEN 'invalidated'
+                       ELSE 'updated'
+                   END,
+                   COUNT(*)
+            INTO change_event, affected
+            FROM new_rows n JOIN old_rows o ON o.id = n.id;
+        END IF;
+        IF affected > 0 THEN
+            PERFORM pg_notify('aigualba_changes', json_build_object(
+                'table', TG_TABLE_NAME, 'op', TG_OP, 'event', change_event, 'count', affected)::text);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_mostres_notify ON mostres;
+    DROP TRIGGER IF EXISTS trg_mostres_notify_insert ON mostres;
+    CREATE TRIGGER trg_mostres_notify_insert
+        AFTER INSERT ON mostres REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_mostres_change();
+
+    DROP TRIGGER IF EXISTS trg_mostres_notify_update ON mostres;
+    CREATE TRIGGER trg_mostres_notify_update
+        AFTER UPDATE ON mostres REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_mostres_change();
+
+    DROP TRIGGER IF EXISTS trg_mostres_notify_delete ON mostres;
+    CREATE TRIGGER trg_mostres_notify_delete
+        AFTER DELETE ON mostres REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_mostres_change();
+
+    DROP TRIGGER IF EXISTS trg_mostres_notify_truncate ON mostres;
+    CREATE TRIGGER trg_mostres_notify_truncate
+        AFTER TRUNCATE ON mostres
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change();
+"""
+
+def get_db_connection():
+    """Get a database connection"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required")
+    return psycopg2.connect(DATABASE_URL)
+
+def run_migration():
+    """Run the sample change events migration"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        print("✓ Connected to database successfully")
+        print("Creating per-operation NOTIFY triggers on mostres...")
+        cur.execute(EVENTS_DDL)
+
+        conn.commit()
+        print("✓ Migration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Migration failed: {str(e)}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    try:
+        run_migration()
+    except Exception as e:
+        print(f"Migration error: {e}")
+        exit(1)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Migration script to add visit rollup tables
+This script will:
+1. Create visits_daily_visitors, visits_daily_pages, visits_daily, visits_monthly and visits_rollup_state
+2. Create the refresh_visit_rollups() function
+3. Roll up every complete day already in visits
+
+The backend keeps the rollups current afterwards (VISIT_ROLLUP_INTERVAL).
+It is safe to run more than once.
+"""
+
+import os
+import psycopg2
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+ROLLUP_DDL = """
+    -- Visit rollups: per-day/page counters, per-day and per-month totals and the distinct visitors per day/page
+    -- (to combine unique counts over arbitrary windows). Complete days are rolled up by
+    -- refresh_visit_rollups(); statistics read the rollups plus the live visits since next_day.
+    CREATE TABLE IF NOT EXISTS visits_daily_visitors (
+        day DATE NOT NULL,
+        page VARCHAR(100) NOT NULL,
+        ip_address VARCHAR(45) NOT NULL,
+        PRIMARY KEY (day, page, ip_address)
+    );
+
+    CREATE TABLE IF NOT EXISTS visits_daily_pages (
+        day DATE NOT NULL,
+        page VARCHAR(100) NOT NULL,
+        visits BIGINT NOT NULL,
+        unique_visitors BIGINT NOT NULL,
+        PRIMARY KEY (day, page)
+    );
+
+    CREATE TABLE IF NOT EXISTS visits_daily (
+        day DATE PRIMARY KEY,
+        visits BIGINT NOT NULL,
+        unique_visitors BIGINT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS visits_monthly (
+        month DATE PRIMARY KEY,
+        visits BIGINT NOT NULL,
+        unique_visitors BIGINT NOT NULL
+    );
+
+    -- Single-row watermark: every day before next_day is rolled up
+    CREATE TABLE IF NOT EXISTS visits_rollup_state (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        next_day DATE NOT NULL,
+        refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE OR REPLACE FUNCTION refresh_visit_rollups(complete_before DATE, max_days INTEGER DEFAULT 31) RETURNS INTEGER AS $$
+    DECLARE
+        start_day DATE;
+        end_day DATE;
+    BEGIN
+        -- One refresher at a time; concurrent callers (other API workers) simply skip
+        IF NOT pg_try_advisory_xact_lock(hashtext('visit_rollups')) THEN
+            RETURN 0;
+        END IF;
+
+        SELECT next_day INTO start_day FROM visits_rollup_state WHERE id = 1;
+        IF start_day IS NULL THEN
+            SELECT COALESCE(MIN(timestamp)::date, complete_before) INTO start_day FROM visits;
+        END IF;
+        end_day := LEAST(complete_before, start_day + max_days);
+        IF start_day >= end_day THEN
+            RETURN 0;
+        END IF;
+
+        DELETE FROM visits_daily_visitors WHERE day >= start_day AND day < end_day;
+        INSERT INTO visits_daily_visitors (day, page, ip_address)
+        SELECT DISTINCT timestamp::date, page, ip_address
+        FROM visits
+        WHERE timestamp >= start_day AND timestamp < end_day
+          AND ip_address IS NOT NULL AND ip_address NOT IN ('', 'pending');
+
+        DELETE FROM visits_daily_pages WHERE day >= start_day AND day < end_day;
+        INSERT INTO visits_daily_pages (day, page, visits, unique_visitors)
+        SELECT timestamp::date, page, COUNT(*),
+               COUNT(DISTINCT ip_address) FILTER (WHERE ip_address NOT IN ('', 'pending'))
+        FROM visits
+        WHERE timestamp >= start_day AND timestamp < end_day
+        GROUP BY 1, 2;
+
+        DELETE FROM visits_daily WHERE day >= start_day AND day < end_day;
+        INSERT INTO visits_daily (day, visits, unique_visitors)
+        SELECT p.day, SUM(p.visits),
+               (SELECT COUNT(DISTINCT v.ip_address) FROM visits_daily_visitors v WHERE v.day = p.day)
+        FROM visits_daily_pages p
+        WHERE p.day >= start_day AND p.day < end_day
+        GROUP BY p.day;
+
+        -- Months that are now complete
+        INSERT INTO visits_monthly (month, visits, unique_visitors)
+        SELECT m.month::date,
+               COALESCE((SELECT SUM(d.visits) FROM visits_daily d
+                         WHERE d.day >= m.month AND d.day < m.month + INTERVAL '1 month'), 0),
+               (SELECT COUNT(DISTINCT v.ip_address) FROM visits_daily_visitors v
+                WHERE v.day >= m.month AND v.day < m.month + INTERVAL '1 month')
+        FROM generate_series(date_trunc('month', start_day::timestamp),
+                             date_trunc('month', end_day::timestamp) - INTERVAL '1 month',
+                             INTERVAL '1 month') AS m(month)
+        ON CONFLICT (month) DO UPDATE
+        SET visits = EXCLUDED.visits, unique_visitors = EXCLUDED.unique_visitors;
+
+        INSERT INTO visits_rollup_state (id, next_day, refreshed_at)
+        VALUES (1, end_day, CURRENT_TIMESTAMP)
+        ON CONFLICT (id) DO UPDATE SET next_day = EXCLUDED.next_day, refreshed_at = EXCLUDED.refreshed_at;
+
+        RETURN end_day - start_day;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    COMMENT ON TABLE visits_daily IS 'Visits and unique visitors per day, maintained by refresh_visit_rollups()';
+    COMMENT ON TABLE visits_monthly IS 'Visits and unique visitors per complete month, maintained by refresh_visit_rollups()';
+"""
+
+def get_db_connection():
+    """Get a database connection"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required")
+    return psycopg2.connect(DATABASE_URL)
+
+def run_migration():
+    """Run the visit rollups migration"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        print("✓ Connected to database successfully")
+        print("Creating visit rollup tables and refresh function...")
+        cur.execute(ROLLUP_DDL)
+        conn.commit()
+
+        print("Rolling up existing visits (one month per transaction)...")
+        days = 0
+        while True:
+            cur.execute("SELECT refresh_visit_rollups(CURRENT_DATE)")
+            rolled = cur.fetchone()[0]
+            conn.commit()
+            if not rolled:
+                break
+            days += rolled
+
+        print("✓ Migration completed successfully!")
+
+        cur.execute("SELECT COUNT(*) FROM visits_daily")
+        print(f"Summary:")
+        print(f"  - Days rolled up now: {days}")
+        print(f"  - Days with visits: {cur.fetchone()[0]}")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Migration failed: {str(e)}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    try:
+        run_migration()
+    except Exception as e:
+        print(f"Migration error: {e}")
+        exit(1)
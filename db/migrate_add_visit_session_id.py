@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Migration script to key visit IP updates by client session
+This script will:
+1. Add the session_id column to visits
+2. Create the partial index of visits still waiting for their IP
+
+It is safe to run more than once.
+"""
+
+import os
+import psycopg2
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+def get_db_connection():
+    """Get a database connection"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required")
+    return psycopg2.connect(DATABASE_URL)
+
+def run_migration():
+    """Run the visit session migration"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        print("✓ Connected to database successfully")
+
+        print("Adding session_id to visits...")
+        cur.execute("""
+            ALTER TABLE visits ADD COLUMN IF NOT EXISTS session_id VARCHAR(64);
+            COMMENT ON COLUMN visits.session_id IS 'Client session (browser tab) that recorded the visit';
+        """)
+
+        print("Creating pending-IP session index...")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_visits_pending_session ON visits(session_id, timestamp)
+                WHERE ip_address IS NULL OR ip_address IN ('', 'pending');
+        """)
+
+        conn.commit()
+        print("✓ Migration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Migration failed: {str(e)}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    try:
+        run_migration()
+    except Exception as e:
+        print(f"Migration error: {e}")
+        exit(1)
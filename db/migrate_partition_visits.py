@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Migration script to partition the visits table by month
+This script will:
+1. Create visits_partitioned, range-partitioned by month on timestamp, with
+   one partition per month from the oldest visit up to three months ahead
+   and a DEFAULT partition (visits_default) for anything outside them
+2. Copy the visits across in batches of MIGRATE_VISITS_BATCH_SIZE rows, each
+   in its own transaction, while the backend keeps recording visits
+3. Lock visits briefly to copy the visits recorded meanwhile and re-copy the
+   recent ones (whose pending IP may have been filled in since), then swap
+   the tables, create the partition maintenance functions, keep the id
+   sequence and drop the old table
+
+Only the last step holds the ACCESS EXCLUSIVE lock, and it touches a day of
+visits at most. It is safe to run more than once: already partitioned tables
+are skipped, and an interrupted copy is discarded and started over.
+"""
+
+import os
+import psycopg2
+from psycopg2 import sql
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+MIGRATE_VISITS_BATCH_SIZE = int(os.getenv("MIGRATE_VISITS_BATCH_SIZE", "50000"))
+
+# Visits this recent when the copy starts are copied again under the lock: the backend only fills in
+# pending IPs of visits from the last VISIT_IP_UPDATE_WINDOW_SECONDS (5 minutes by default)
+RECOPY_WINDOW = "1 day"
+
+VISIT_COLUMNS = "id, page, user_agent, ip_address, session_id, timestamp"
+OLD_VISIT_VALUES = "id, page, user_agent, ip_address, session_id, COALESCE(timestamp, CURRENT_TIMESTAMP)"
+
+PARTITIONED_VISITS_DDL = r"""
+    CREATE TABLE visits_partitioned (
+        id INTEGER NOT NULL DEFAULT nextval('visits_id_seq'),
+        page VARCHAR(100) NOT NULL,
+        user_agent TEXT,
+        ip_address VARCHAR(45),
+        session_id VARCHAR(64),
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+
+    -- Rows outside the monthly partitions (far past or future timestamps) land here instead of failing
+    CREATE TABLE visits_default PARTITION OF visits_partitioned DEFAULT;
+
+    CREATE INDEX idx_visits_partitioned_timestamp ON visits_partitioned(timestamp DESC);
+    CREATE INDEX idx_visits_partitioned_page ON visits_partitioned(page);
+    CREATE INDEX idx_visits_partitioned_pending_session ON visits_partitioned(session_id, timestamp)
+        WHERE ip_address IS NULL OR ip_address IN ('', 'pending');
+"""
+
+# Same definitions as db/init.prod.sql and migration 0003; created once visits is the partitioned table
+PARTITION_FUNCTIONS_DDL = r"""
+    CREATE OR REPLACE FUNCTION ensure_visit_partitions(months_ahead INTEGER DEFAULT 3, months_back INTEGER DEFAULT 0)
+    RETURNS INTEGER AS $$
+    DECLARE
+        month_start DATE;
+        month_end DATE;
+        partition_name TEXT;
+        created INTEGER := 0;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('visit_partitions'));
+        FOR i IN -months_back..months_ahead LOOP
+            month_start := (date_trunc('month', CURRENT_DATE::timestamp) + make_interval(months => i))::date;
+            month_end := (month_start + INTERVAL '1 month')::date;
+            partition_name := 'visits_' || to_char(month_start, 'YYYY_MM');
+            CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+            IF EXISTS (SELECT 1 FROM visits_default WHERE timestamp >= month_start AND timestamp < month_end) THEN
+                EXECUTE format('CREATE TABLE %I (LIKE visits INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+                EXECUTE format('WITH moved AS (DELETE FROM visits_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                               'INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+                EXECUTE format('ALTER TABLE visits ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF visits FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+            END IF;
+            created := created + 1;
+        END LOOP;
+        RETURN created;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Detach the partitions of months that ended more than retention_months ago and drop them,
+    -- or keep them as standalone visits_archive_YYYY_MM tables when archive is true
+    CREATE OR REPLACE FUNCTION expire_visit_partitions(retention_months INTEGER, archive BOOLEAN DEFAULT FALSE)
+    RETURNS INTEGER AS $$
+    DECLARE
+        part RECORD;
+        cutoff DATE := (date_trunc('month', CURRENT_DATE::timestamp) - make_interval(months => retention_months))::date;
+        expired INTEGER := 0;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('visit_partitions'));
+        FOR part IN
+            SELECT c.relname, to_date(substring(c.relname FROM '^visits_(\d{4}_\d{2})$'), 'YYYY_MM') AS month_start
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'visits'::regclass AND c.relname ~ '^visits_\d{4}_\d{2}$'
+            ORDER BY 2
+        LOOP
+            CONTINUE WHEN part.month_start >= cutoff;
+            EXECUTE format('ALTER TABLE visits DETACH PARTITION %I', part.relname);
+            IF archive THEN
+                EXECUTE format('ALTER TABLE %I RENAME TO %I', part.relname,
+                               'visits_archive_' || to_char(part.month_start, 'YYYY_MM'));
+            ELSE
+                EXECUTE format('DROP TABLE %I', part.relname);
+            END IF;
+            expired := expired + 1;
+        END LOOP;
+        RETURN expired;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+def get_db_connection():
+    """Get a database connection"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required")
+    return psycopg2.connect(DATABASE_URL)
+
+def run_migration():
+    """Run the visits partitioning migration"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        print("✓ Connected to database successfully")
+
+        cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('visits')")
+        if cur.fetchone():
+            print("✓ visits is already partitioned, nothing to do")
+            return
+
+        print("Creating the partitioned table next to visits...")
+        cur.execute("""
+            DROP TABLE IF EXISTS visits_partitioned;
+            ALTER TABLE visits ADD COLUMN IF NOT EXISTS session_id VARCHAR(64);
+        """)
+        cur.execute(PARTITIONED_VISITS_DDL)
+        # One partition per month from the oldest visit to three months ahead
+        cur.execute("""
+            SELECT generate_series(
+                date_trunc('month', COALESCE(MIN(timestamp), CURRENT_DATE)),
+                date_trunc('month', CURRENT_DATE) + INTERVAL '3 months',
+                INTERVAL '1 month'
+            )::date
+            FROM visits
+        """)
+        months = [row[0] for row in cur.fetchall()]
+        for month_start in months:
+            cur.execute(
+                sql.SQL("CREATE TABLE {} PARTITION OF visits_partitioned "
+                        "FOR VALUES FROM (%s) TO ((%s::date + INTERVAL '1 month')::date)")
+                .format(sql.Identifier(f"visits_{month_start:%Y_%m}")),
+                (month_start, month_start)
+            )
+        cur.execute("SELECT COALESCE(MAX(id), 0), LOCALTIMESTAMP FROM visits")
+        copy_until, started_at = cur.fetchone()
+        conn.commit()
+        print(f"  - Partitions created: {len(months)} monthly, plus visits_default")
+
+        print(f"Copying visits in batches of {MIGRATE_VISITS_BATCH_SIZE}...")
+        copied = 0
+        last_id = 0
+        while last_id < copy_until:
+            batch_end = min(last_id + MIGRATE_VISITS_BATCH_SIZE, copy_until)
+            cur.execute(f"""
+                INSERT INTO visits_partitioned ({VISIT_COLUMNS})
+                SELECT {OLD_VISIT_VALUES} FROM visits WHERE id > %s AND id <= %s
+            """, (last_id, batch_end))
+            copied += cur.rowcount
+            conn.commit()
+            last_id = batch_end
+            print(f"  - Up to id {last_id} of {copy_until}")
+
+        print("Locking visits to copy the latest changes and swap the tables...")
+        cur.execute(f"""
+            LOCK TABLE visits IN ACCESS EXCLUSIVE MODE;
+            DELETE FROM visits_partitioned
+            WHERE id <= %(copy_until)s AND timestamp >= %(started_at)s - INTERVAL '{RECOPY_WINDOW}';
+            INSERT INTO visits_partitioned ({VISIT_COLUMNS})
+            SELECT {OLD_VISIT_VALUES} FROM visits
+            WHERE id > %(copy_until)s
+               OR timestamp >= %(started_at)s - INTERVAL '{RECOPY_WINDOW}'
+               OR timestamp IS NULL;
+        """, {"copy_until": copy_until, "started_at": started_at})
+        cur.execute("SELECT COUNT(*) FROM visits WHERE id > %s", (copy_until,))
+        copied += cur.fetchone()[0]
+        cur.execute("""
+            ALTER TABLE visits RENAME TO visits_unpartitioned;
+            ALTER TABLE visits_unpartitioned RENAME CONSTRAINT visits_pkey TO visits_unpartitioned_pkey;
+            ALTER INDEX IF EXISTS idx_visits_timestamp RENAME TO idx_visits_unpartitioned_timestamp;
+            ALTER INDEX IF EXISTS idx_visits_page RENAME TO idx_visits_unpartitioned_page;
+            ALTER INDEX IF EXISTS idx_visits_pending_session RENAME TO idx_visits_unpartitioned_pending_session;
+
+            ALTER TABLE visits_partitioned RENAME TO visits;
+            ALTER TABLE visits RENAME CONSTRAINT visits_partitioned_pkey TO visits_pkey;
+            ALTER INDEX idx_visits_partitioned_timestamp RENAME TO idx_visits_timestamp;
+            ALTER INDEX idx_visits_partitioned_page RENAME TO idx_visits_page;
+            ALTER INDEX idx_visits_partitioned_pending_session RENAME TO idx_visits_pending_session;
+            COMMENT ON TABLE visits IS 'Page visit tracking for admin/dashboard analytics (monthly partitions)';
+        """)
+        cur.execute(PARTITION_FUNCTIONS_DDL)
+        cur.execute("""
+            ALTER SEQUENCE visits_id_seq OWNED BY visits.id;
+            DROP TABLE visits_unpartitioned;
+        """)
+        cur.execute("SELECT COUNT(*) FROM visits_default")
+        outside = cur.fetchone()[0]
+
+        conn.commit()
+        print("✓ Migration completed successfully!")
+        print(f"Summary:")
+        print(f"  - Visits copied: {copied}")
+        print(f"  - Visits outside the monthly partitions (in visits_default): {outside}")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Migration failed: {str(e)}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    try:
+        run_migration()
+    except Exception as e:
+        print(f"Migration error: {e}")
+        exit(1)
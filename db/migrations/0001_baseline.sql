@@ -0,0 +1,4 @@
+-- Baseline: the schema as created by init.prod.sql / init.dev.sql, or reached by running the
+-- one-off db/migrate_*.py scripts up to db/migrate_add_visit_session_id.py. Nothing to do;
+-- applying it only records that later migrations build on this schema.
+SELECT 1;
@@ -0,0 +1,10 @@
+-- migrate: no-transaction
+-- Sample listing indexes: public listing (validated, newest first), admin listing (pending first)
+-- and the pending count (index-only scan). Built concurrently so sample writes are never blocked.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mostres_public_listing ON mostres(data DESC, created_at DESC, id DESC)
+    WHERE validated = TRUE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mostres_admin_listing ON mostres(validated ASC, data DESC, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mostres_pending ON mostres(id) WHERE validated = FALSE;
+
+-- Index-only scans need an up-to-date visibility map
+VACUUM (ANALYZE) mostres;
@@ -0,0 +1,79 @@
+-- Visit partition safety: a DEFAULT partition for visits outside the monthly partitions, partition
+-- creation that moves such rows out of it, and expiry that only drops months already rolled up
+-- (pruning visits_daily_visitors under the same retention)
+CREATE TABLE IF NOT EXISTS visits_default PARTITION OF visits DEFAULT;
+
+-- Create the monthly partitions from months_back months ago to months_ahead months ahead. Rows already
+-- caught by visits_default for a new month are moved into its partition before it is attached
+CREATE OR REPLACE FUNCTION ensure_visit_partitions(months_ahead INTEGER DEFAULT 3, months_back INTEGER DEFAULT 0)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('visit_partitions'));
+    FOR i IN -months_back..months_ahead LOOP
+        month_start := (date_trunc('month', CURRENT_DATE::timestamp) + make_interval(months => i))::date;
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := 'visits_' || to_char(month_start, 'YYYY_MM');
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        IF EXISTS (SELECT 1 FROM visits_default WHERE timestamp >= month_start AND timestamp < month_end) THEN
+            EXECUTE format('CREATE TABLE %I (LIKE visits INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format('WITH moved AS (DELETE FROM visits_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+            EXECUTE format('ALTER TABLE visits ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_end);
+        ELSE
+            EXECUTE format('CREATE TABLE %I PARTITION OF visits FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_end);
+        END IF;
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach the partitions of months that ended more than retention_months ago and drop them,
+-- or keep them as standalone visits_archive_YYYY_MM tables when archive is true. Only months
+-- already rolled up (ending on or before visits_rollup_state.next_day) are expired; the
+-- visits_daily_visitors rows and stray visits_default rows of those days go with them
+CREATE OR REPLACE FUNCTION expire_visit_partitions(retention_months INTEGER, archive BOOLEAN DEFAULT FALSE)
+RETURNS INTEGER AS $$
+DECLARE
+    part RECORD;
+    cutoff DATE := (date_trunc('month', CURRENT_DATE::timestamp) - make_interval(months => retention_months))::date;
+    rolled_up_until DATE;
+    expired INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('visit_partitions'));
+    SELECT next_day INTO rolled_up_until FROM visits_rollup_state WHERE id = 1;
+    IF rolled_up_until IS NULL THEN
+        RETURN 0;
+    END IF;
+    cutoff := LEAST(cutoff, rolled_up_until);
+
+    FOR part IN
+        SELECT c.relname, to_date(substring(c.relname FROM '^visits_(\d{4}_\d{2})$'), 'YYYY_MM') AS month_start
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visits'::regclass AND c.relname ~ '^visits_\d{4}_\d{2}$'
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN part.month_start + INTERVAL '1 month' > cutoff;
+        EXECUTE format('ALTER TABLE visits DETACH PARTITION %I', part.relname);
+        IF archive THEN
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', part.relname,
+                           'visits_archive_' || to_char(part.month_start, 'YYYY_MM'));
+        ELSE
+            EXECUTE format('DROP TABLE %I', part.relname);
+        END IF;
+        expired := expired + 1;
+    END LOOP;
+
+    DELETE FROM visits_default WHERE timestamp < cutoff;
+    DELETE FROM visits_daily_visitors WHERE day < cutoff;
+    RETURN expired;
+END;
+$$ LANGUAGE plpgsql;
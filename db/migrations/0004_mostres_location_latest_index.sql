@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- Newest validated samples of one sampling point, read by refresh_mostres_latest on every write.
+-- Built concurrently so sample writes are never blocked.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mostres_location_latest ON mostres(punt_mostreig, data DESC)
+    WHERE validated = TRUE;
@@ -0,0 +1,32 @@
+-- Replace the per-row trg_mostres_latest with statement-level triggers: a bulk insert or validation
+-- refreshes each affected sampling point once instead of once per row
+CREATE OR REPLACE FUNCTION mostres_latest_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_mostres_latest(punt_mostreig)
+        FROM (SELECT DISTINCT punt_mostreig FROM new_rows WHERE validated ORDER BY 1) locations;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM refresh_mostres_latest(punt_mostreig)
+        FROM (SELECT punt_mostreig FROM old_rows UNION SELECT punt_mostreig FROM new_rows ORDER BY 1) locations;
+    ELSE
+        PERFORM refresh_mostres_latest(punt_mostreig)
+        FROM (SELECT DISTINCT punt_mostreig FROM old_rows ORDER BY 1) locations;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables allow a single event per trigger
+DROP TRIGGER IF EXISTS trg_mostres_latest ON mostres;
+DROP TRIGGER IF EXISTS trg_mostres_latest_insert ON mostres;
+CREATE TRIGGER trg_mostres_latest_insert
+    AFTER INSERT ON mostres REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mostres_latest_trigger();
+DROP TRIGGER IF EXISTS trg_mostres_latest_update ON mostres;
+CREATE TRIGGER trg_mostres_latest_update
+    AFTER UPDATE ON mostres REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mostres_latest_trigger();
+DROP TRIGGER IF EXISTS trg_mostres_latest_delete ON mostres;
+CREATE TRIGGER trg_mostres_latest_delete
+    AFTER DELETE ON mostres REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mostres_latest_trigger();
@@ -0,0 +1,8 @@
+-- The sample listings page on (data, created_at, id), and the admin listing also on validated.
+-- A NULL in a sort key breaks the keyset comparison (rows skipped or repeated), so backfill both
+-- columns and make them NOT NULL. A NULL validated already meant "not public".
+UPDATE mostres SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL;
+UPDATE mostres SET validated = FALSE WHERE validated IS NULL;
+ALTER TABLE mostres
+    ALTER COLUMN created_at SET NOT NULL,
+    ALTER COLUMN validated SET NOT NULL;
@@ -3,8 +3,6 @@ from dash import html, dcc, Input, Output, State, ALL
 import sys
 import os
 import requests
-import csv
-import io
 from datetime import datetime
 
 # Add current directory to Python path for imports
@@ -22,9 +20,10 @@ from pages.admin import layout as admin_layout
 import callbacks.admin_callbacks
 from utils.helpers import (get_backend_url, fetch_parameters, create_parameter_card, create_data_table, 
                            submit_sample_data, validate_sample_data, fetch_samples, create_samples_table, create_sample_details,
-                           create_data_visualizations, filter_samples_by_criteria, get_unique_locations, 
+                           create_data_visualizations, build_sample_filter_params, fetch_sample_locations, 
                            fetch_latest_gualba_sample, create_latest_sample_summary, fetch_latest_sample_by_location,
-                           fetch_latest_sample_any_location, fetch_pending_samples_count)
+                           fetch_latest_sample_any_location, fetch_pending_samples_count,
+                           fetch_sample_series)
 
 # Get backend URL
 BACKEND_URL = get_backend_url()
@@ -35,41 +34,29 @@ def create_sample_detail_page(sample_id, referrer="/browse"):
     sample_data = None
     error_info = []
     
-    # First, try to get all samples to see what's available
-    all_samples = []
-    available_ids = []
+    # Primary-key lookup of the requested sample
     try:
-        all_samples = fetch_samples(BACKEND_URL)
-        available_ids = [str(s.get('id')) for s in all_samples if s.get('id') is not None]
-        error_info.append(f"Available sample IDs: {', '.join(available_ids) if available_ids else 'None'}")
+        response = requests.get(f"{BACKEND_URL}/api/mostres/{sample_id}", timeout=10)
         error_info.append(f"Looking for ID: {sample_id}")
-        error_info.append(f"Total samples found: {len(all_samples)}")
-        
-        # Search through all samples
-        for sample in all_samples:
-            if str(sample.get('id')) == str(sample_id):
-                sample_data = sample
-                error_info.append(f"Found sample in list")
-                break
-        
-        if not sample_data and available_ids:
-            error_info.append(f"Sample {sample_id} not found in available samples")
-            
+        error_info.append(f"Individual endpoint status: {response.status_code}")
+        if response.status_code == 200:
+            sample_data = response.json()
+        else:
+            error_info.append(f"Individual endpoint error: {response.text}")
     except Exception as e:
-        error_info.append(f"Error fetching samples: {str(e)}")
+        error_info.append(f"Individual endpoint exception: {str(e)}")
     
-    # If not found, try individual endpoint as backup
+    # If not found, list a few recent samples to suggest instead
+    available_ids = []
     if not sample_data:
         try:
-            response = requests.get(f"{BACKEND_URL}/api/mostres/{sample_id}")
-            error_info.append(f"Individual endpoint status: {response.status_code}")
-            if response.status_code == 200:
-                sample_data = response.json()
-                error_info.append(f"Got sample from individual endpoint")
-            else:
-                error_info.append(f"Individual endpoint error: {response.text}")
+            response = requests.get(f"{BACKEND_URL}/api/mostres", params={'limit': 5}, timeout=10)
+            recent_samples = response.json() if response.status_code == 200 else []
+            available_ids = [str(s.get('id')) for s in recent_samples if s.get('id') is not None]
+            error_info.append(f"Available sample IDs: {', '.join(available_ids) if available_ids else 'None'}")
+            error_info.append(f"Total samples found: {response.headers.get('X-Total-Count', len(recent_samples))}")
         except Exception as e:
-            error_info.append(f"Individual endpoint exception: {str(e)}")
+            error_info.append(f"Error fetching samples: {str(e)}")
     
     if not sample_data:
         return html.Div([
@@ -157,6 +144,29 @@ app.index_string = '''
         <link rel="icon" type="image/x-icon" sizes="256x256" href="/assets/favicon/favicon_256.ico">
         <link rel="manifest" href="/assets/favicon/site.webmanifest">
         <script>
+            // Random id for this browser tab, sent with every visit so the IP update only touches its own visits
+            function visitSessionId() {
+                let sessionId = sessionStorage.getItem('visitSessionId');
+                if (!sessionId) {
+                    sessionId = (window.crypto && crypto.randomUUID)
+                        ? crypto.randomUUID()
+                        : Date.now().toString(36) + Math.random().toString(36).slice(2);
+                    sessionStorage.setItem('visitSessionId', sessionId);
+                }
+                return sessionId;
+            }
+
+            // Attach the detected IP to this session's visits recorded before it was known
+            async function updateSessionVisitIP(realIP) {
+                await fetch('/api/public/visits/update-ip', {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ ip_address: realIP, session_id: visitSessionId() })
+                });
+            }
+
             // Function to detect real client IP using external services
             async function detectRealIP() {
                 const storedIP = sessionStorage.getItem('realClientIP');
@@ -197,6 +207,7 @@ app.index_string = '''
                         
                         if (ip && ip !== 'pending' && ip.trim() !== '' && ip !== 'undefined') {
                             sessionStorage.setItem('realClientIP', ip);
+                            updateSessionVisitIP(ip).catch(() => {});
                             
                             // Track visit with real IP
                             try {
@@ -240,7 +251,8 @@ app.index_string = '''
                     const visitData = {
                         page: pageName,
                         user_agent: navigator.userAgent || '',
-                        ip_address: realIP
+                        ip_address: realIP,
+                        session_id: visitSessionId()
                     };
                     
                     const response = await fetch('/api/public/visits', {
@@ -289,13 +301,53 @@ app.layout = html.Div([
     html.Div(id='page-content'),
     # Hidden div for IP detection
     html.Div(id='ip-detector', style={'display': 'none'}),
-    dcc.Store(id='client-ip-store')
+    dcc.Store(id='client-ip-store'),
+    # Latest sample change pushed by the backend event stream (browse/visualize refetch on it)
+    dcc.Store(id='sample-events')
 ], style={'fontFamily': 'Segoe UI, Tahoma, Geneva, Verdana, sans-serif', 'margin': '0', 'padding': '0', 'backgroundColor': '#f5f5f5'})
 
 # Enable URL routing
 app.title = "Aigualba - Qualitat de l'aigua"
 app.config.suppress_callback_exceptions = True
 
+# Clientside callback that subscribes to the backend sample change stream on live pages
+app.clientside_callback(
+    """
+    function(pathname) {
+        const livePages = ['/browse', '/visualize'];
+        if (!livePages.includes(pathname)) {
+            if (window.sampleEventSource) {
+                window.sampleEventSource.close();
+                window.sampleEventSource = null;
+            }
+            return window.dash_clientside.no_update;
+        }
+        if (window.sampleEventSource || typeof EventSource === 'undefined') {
+            return window.dash_clientside.no_update;
+        }
+
+        const source = new EventSource('/api/public/mostres/events');
+        source.addEventListener('ready', function(message) {
+            // On reconnect, refetch only if the dataset changed while we were away
+            const version = JSON.parse(message.data).version;
+            if (window.sampleEventsVersion && version && version !== window.sampleEventsVersion) {
+                window.dash_clientside.set_props('sample-events', {data: {event: 'resync', version: version}});
+            }
+            window.sampleEventsVersion = version;
+        });
+        source.onmessage = function(message) {
+            const change = JSON.parse(message.data);
+            window.sampleEventsVersion = change.version;
+            window.dash_clientside.set_props('sample-events', {data: change});
+        };
+        window.sampleEventSource = source;
+        return window.dash_clientside.no_update;
+    }
+    """,
+    Output('sample-events', 'data'),
+    Input('url', 'pathname')
+)
+
 # Clientside callback for IP detection
 app.clientside_callback(
     """
@@ -425,8 +477,7 @@ def display_page(pathname, search):
     [Input('home-location-selector', 'id')]
 )
 def populate_home_location_selector(trigger):
-    data = fetch_samples(BACKEND_URL)
-    locations = get_unique_locations(data)
+    locations = fetch_sample_locations(BACKEND_URL)
     
     # Add 'any location' option at the beginning
     options = [{'label': 'Qualsevol ubicació (més recent)', 'value': 'any_location'}]
@@ -647,11 +698,10 @@ def navigate_to_home_sample_details(n_clicks, sample_id):
 # Callback to populate location filter with unique locations
 @app.callback(
     Output('location-filter', 'options'),
-    [Input('interval-browse', 'n_intervals')]
+    [Input('sample-events', 'data')]
 )
-def populate_location_filter(n):
-    data = fetch_samples(BACKEND_URL)
-    locations = get_unique_locations(data)
+def populate_location_filter(sample_event):
+    locations = fetch_sample_locations(BACKEND_URL)
     options = [{'label': 'Totes les ubicacions', 'value': 'all'}]
     options.extend([{'label': location, 'value': location} for location in locations])
     return options
@@ -659,13 +709,13 @@ def populate_location_filter(n):
 # Callback to filter samples based on filter criteria
 @app.callback(
     Output('filtered-samples', 'data'),
-    [Input('interval-browse', 'n_intervals'),
+    [Input('sample-events', 'data'),
      Input('date-filter-from', 'date'),
      Input('date-filter-to', 'date'),
      Input('location-filter', 'value'),
      Input('clear-filters-btn', 'n_clicks')]
 )
-def filter_samples(n, date_from, date_to, location, clear_clicks):
+def filter_samples(sample_event, date_from, date_to, location, clear_clicks):
     ctx = dash.callback_context
     
     # Check if clear button was clicked
@@ -676,10 +726,8 @@ def filter_samples(n, date_from, date_to, location, clear_clicks):
             data = fetch_samples(BACKEND_URL)
             return data
     
-    # Apply filters
-    data = fetch_samples(BACKEND_URL)
-    filtered_data = filter_samples_by_criteria(data, date_from, date_to, location)
-    return filtered_data
+    # Apply filters in the backend so only matching rows are transferred
+    return fetch_samples(BACKEND_URL, build_sample_filter_params(date_from, date_to, location))
 
 # Callback for browse page samples table
 @app.callback(
@@ -710,9 +758,9 @@ def update_samples_table(filtered_data, current_page, page_size, sort_column, so
 # Callback for validation status notification on browse page
 @app.callback(
     Output('validation-status-notification', 'children'),
-    [Input('interval-browse', 'n_intervals')]
+    [Input('sample-events', 'data')]
 )
-def update_validation_status_notification(n_intervals):
+def update_validation_status_notification(sample_event):
     """Update the validation status notification banner"""
     try:
         pending_count = fetch_pending_samples_count(BACKEND_URL)
@@ -757,9 +805,10 @@ def update_validation_status_notification(n_intervals):
 # Callback for validation status notification on visualize page
 @app.callback(
     Output('validation-status-notification-visualize', 'children'),
-    [Input('url', 'pathname')]
+    [Input('url', 'pathname'),
+     Input('sample-events', 'data')]
 )
-def update_validation_status_notification_visualize(pathname):
+def update_validation_status_notification_visualize(pathname, sample_event):
     """Update the validation status notification banner on visualize page"""
     # Only show notification when on visualize page
     if pathname != '/visualize':
@@ -923,71 +972,32 @@ def handle_table_state(sort_id_clicks, sort_data_clicks, sort_punt_clicks,
     print(f"New state - Page: {new_page}, Size: {new_page_size}, Sort: {new_sort_column} {new_sort_order}")
     return new_page, new_page_size, new_sort_column, new_sort_order
 
-# Callback for CSV export
-@app.callback(
-    Output('download-csv', 'data'),
-    [Input('export-csv-btn', 'n_clicks')],
-    [State('filtered-samples', 'data')],
+# Clientside callback for CSV/XLSX export: the browser downloads straight from the backend,
+# which streams the filtered samples, so no data goes through the Dash process
+app.clientside_callback(
+    """
+    function(csvClicks, xlsxClicks, dateFrom, dateTo, location) {
+        const triggered = window.dash_clientside.callback_context.triggered;
+        if (!triggered.length || !triggered[0].value) {
+            return window.dash_clientside.no_update;
+        }
+        const format = triggered[0].prop_id.startsWith('export-xlsx-btn') ? 'xlsx' : 'csv';
+        const params = new URLSearchParams({format: format});
+        if (dateFrom) params.append('date_from', dateFrom.slice(0, 10));
+        if (dateTo) params.append('date_to', dateTo.slice(0, 10));
+        if (location && location !== 'all') params.append('location', location);
+        window.location.href = '/api/mostres/export?' + params.toString();
+        return format;
+    }
+    """,
+    Output('export-request', 'data'),
+    [Input('export-csv-btn', 'n_clicks'),
+     Input('export-xlsx-btn', 'n_clicks')],
+    [State('date-filter-from', 'date'),
+     State('date-filter-to', 'date'),
+     State('location-filter', 'value')],
     prevent_initial_call=True
 )
-def export_samples_to_csv(export_clicks, filtered_data):
-    """Export filtered samples data to CSV file"""
-    if not export_clicks:
-        return dash.no_update
-    
-    data = filtered_data if filtered_data else []
-    if not data:
-        return dash.no_update
-    
-    # Create CSV content
-    output = io.StringIO()
-    
-    # Define column headers in Catalan and their corresponding keys
-    columns = [
-        ('ID', 'id'),
-        ('Data de recollida', 'data'),
-        ('Punt de mostreig', 'punt_mostreig'),
-        ('pH', 'ph'),
-        ('Temperatura (°C)', 'temperatura'),
-        ('Conductivitat 20°C (μS/cm)', 'conductivitat_20c'),
-        ('Terbolesa (UNF)', 'terbolesa'),
-        ('Color (mg/L Pt-Co)', 'color'),
-        ('Olor (índex dilució 25°C)', 'olor'),
-        ('Sabor (índex dilució 25°C)', 'sabor'),
-        ('Clor lliure (mg/L)', 'clor_lliure'),
-        ('Clor total (mg/L)', 'clor_total'),
-        ('E. coli (NPM/100mL)', 'recompte_escherichia_coli'),
-        ('Enterococs (NPM/100mL)', 'recompte_enterococ'),
-        ('Microorganismes aerobis 22°C (UFC/1mL)', 'recompte_microorganismes_aerobis_22c'),
-        ('Coliformes totals (NMP/100mL)', 'recompte_coliformes_totals'),
-        ('Àcid monocloroacètic (μg/L)', 'acid_monocloroacetic'),
-        ('Àcid dicloroacètic (μg/L)', 'acid_dicloroacetic'),
-        ('Àcid tricloroacètic (μg/L)', 'acid_tricloroacetic'),
-        ('Àcid monobromoacètic (μg/L)', 'acid_monobromoacetic'),
-        ('Àcid dibromoacètic (μg/L)', 'acid_dibromoacetic'),
-    ]
-    
-    writer = csv.writer(output)
-    
-    # Write headers
-    writer.writerow([header for header, _ in columns])
-    
-    # Write data rows
-    for sample in data:
-        row = []
-        for _, key in columns:
-            value = sample.get(key, '')
-            # Handle None values
-            if value is None:
-                value = ''
-            row.append(str(value))
-        writer.writerow(row)
-    
-    # Generate filename with current date
-    current_date = datetime.now().strftime('%Y-%m-%d')
-    filename = f'mostres_aigua_gualba_{current_date}.csv'
-    
-    return dict(content=output.getvalue(), filename=filename)
 
 # Callback for navigation buttons on home page
 @app.callback(
@@ -1185,17 +1195,16 @@ def handle_sample_submission(n_clicks, sample_date, punt_mostreig, temperatura,
 # Visualization page callbacks
 @app.callback(
     Output('location-selector', 'options'),
-    Input('parameter-selector', 'value')
+    [Input('parameter-selector', 'value'),
+     Input('sample-events', 'data')]
 )
-def update_location_options(selected_parameter):
+def update_location_options(selected_parameter, sample_event):
     """Update the location selector options with all available locations"""
     try:
-        samples = fetch_samples(BACKEND_URL)
-        if not samples:
-            return [{'label': 'Tots els punts', 'value': 'all'}]
-        
         # Get all unique locations regardless of parameter data
-        locations = get_unique_locations(samples)
+        locations = fetch_sample_locations(BACKEND_URL)
+        if not locations:
+            return [{'label': 'Tots els punts', 'value': 'all'}]
         
         options = [{'label': 'Tots els punts', 'value': 'all'}]
         for location in locations:
@@ -1210,9 +1219,10 @@ def update_location_options(selected_parameter):
      Output('chart-title', 'children'),
      Output('chart-info', 'children')],
     [Input('parameter-selector', 'value'),
-     Input('location-selector', 'value')]
+     Input('location-selector', 'value'),
+     Input('sample-events', 'data')]
 )
-def update_chart(selected_parameter, selected_location):
+def update_chart(selected_parameter, selected_location, sample_event):
     """Update the time series chart based on selected parameter and location"""
     try:
         # Import plotly here to handle potential import issues
@@ -1238,51 +1248,10 @@ def update_chart(selected_parameter, selected_location):
             )
             return empty_fig, "Selecciona un paràmetre i punt de mostreig de la llista per generar el gràfic", None
         
-        # Fetch samples
-        samples = fetch_samples(BACKEND_URL)
-        if not samples:
-            empty_fig = go.Figure()
-            empty_fig.add_annotation(
-                text="No hi ha dades disponibles",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5, xanchor='center', yanchor='middle',
-                showarrow=False, font=dict(size=16, color="gray")
-            )
-            empty_fig.update_layout(
-                xaxis=dict(visible=False),
-                yaxis=dict(visible=False),
-                plot_bgcolor='white'
-            )
-            return empty_fig, "Gràfic de dades", None
+        # Fetch one point per sample, per location (derived parameters included)
+        series = fetch_sample_series(BACKEND_URL, selected_parameter, selected_location, bucket='sample')
         
-        # Filter samples based on parameter availability and location
-        filtered_samples = []
-        for sample in samples:
-            # Special handling for calculated fields
-            if selected_parameter == 'suma_haloacetics':
-                from utils.helpers import calculate_suma_haloacetics
-                param_value = calculate_suma_haloacetics(sample)
-            elif selected_parameter == 'clor_combinat_residual':
-                from utils.helpers import calculate_clor_combinat_residual
-                param_value = calculate_clor_combinat_residual(sample)
-            else:
-                param_value = sample.get(selected_parameter)
-            
-            # Check if sample has the parameter and it's not None/empty
-            if param_value is not None and param_value != '':
-                # Check location filter
-                if selected_location == 'all' or sample.get('punt_mostreig') == selected_location:
-                    # Check if sample has a valid date
-                    if sample.get('data'):
-                        # Add the calculated value to the sample for later use
-                        if selected_parameter in ['suma_haloacetics', 'clor_combinat_residual']:
-                            sample_copy = sample.copy()
-                            sample_copy[selected_parameter] = param_value
-                            filtered_samples.append(sample_copy)
-                        else:
-                            filtered_samples.append(sample)
-        
-        if not filtered_samples:
+        if not series:
             empty_fig = go.Figure()
             empty_fig.add_annotation(
                 text=f"No hi ha dades disponibles per al paràmetre seleccionat{' i punt de mostreig' if selected_location != 'all' else ''}",
@@ -1297,22 +1266,22 @@ def update_chart(selected_parameter, selected_location):
             )
             return empty_fig, get_parameter_label(selected_parameter), None
         
-        # Prepare data for plotting
-        dates = []
-        values = []
-        locations = []
-        
-        for sample in filtered_samples:
-            try:
-                # Parse date
-                date_str = sample.get('data')
-                if date_str:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                    dates.append(date_obj)
-                    values.append(float(sample.get(selected_parameter)))
-                    locations.append(sample.get('punt_mostreig', 'Desconegut'))
-            except (ValueError, TypeError):
-                continue
+        # Prepare data for plotting: the backend already groups the points by location
+        location_groups = {}
+        for location_series in series:
+            location = location_series.get('location') or 'Desconegut'
+            data = location_groups.setdefault(location, {'dates': [], 'values': []})
+            for date_str, value in zip(location_series['dates'], location_series['values']):
+                try:
+                    date = datetime.strptime(date_str, '%Y-%m-%d')
+                    value = float(value)
+                except (ValueError, TypeError):
+                    continue
+                data['dates'].append(date)
+                data['values'].append(value)
+        location_groups = {location: data for location, data in location_groups.items() if data['dates']}
+        dates = [date for data in location_groups.values() for date in data['dates']]
+        values = [value for data in location_groups.values() for value in data['values']]
         
         if not dates:
             empty_fig = go.Figure()
@@ -1333,14 +1302,6 @@ def update_chart(selected_parameter, selected_location):
         fig = go.Figure()
         
         if selected_location == 'all':
-            # Group by location and create separate traces
-            location_groups = {}
-            for date, value, location in zip(dates, values, locations):
-                if location not in location_groups:
-                    location_groups[location] = {'dates': [], 'values': []}
-                location_groups[location]['dates'].append(date)
-                location_groups[location]['values'].append(value)
-            
             # Add traces for each location
             colors = px.colors.qualitative.Set2
             for i, (location, data) in enumerate(location_groups.items()):
@@ -1359,9 +1320,10 @@ def update_chart(selected_parameter, selected_location):
                 ))
         else:
             # Single location
+            data = next(iter(location_groups.values()))
             fig.add_trace(go.Scatter(
-                x=dates,
-                y=values,
+                x=data['dates'],
+                y=data['values'],
                 mode='lines+markers',
                 name=selected_location,
                 line=dict(color='#3498db', width=3),
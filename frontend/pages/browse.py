@@ -104,6 +104,23 @@ def create_browse_page():
                             "Exportar a CSV",
                             id='export-csv-btn',
                             className='btn-standard btn-export-csv',
+                            style={
+                                'backgroundColor': '#28a745',
+                                'color': 'white',
+                                'border': 'none',
+                                'padding': '12px 24px',
+                                'borderRadius': '6px',
+                                'cursor': 'pointer',
+                                'fontSize': '1rem',
+                                'marginRight': '20px',
+                                'boxShadow': '0 4px 8px rgba(0,0,0,0.3)',
+                                'transition': 'all 0.2s ease'
+                            }
+                        ),
+                        html.Button(
+                            "Exportar a Excel",
+                            id='export-xlsx-btn',
+                            className='btn-standard btn-export-csv',
                             style={
                                 'backgroundColor': '#28a745',
                                 'color': 'white',
@@ -133,7 +150,6 @@ def create_browse_page():
                 html.Div([
                     html.H3("Llista de mostres", 
                            style={'color': '#2c3e50', 'marginBottom': '1.5rem', 'textAlign': 'center'}),
-                    dcc.Interval(id='interval-browse', interval=30*1000, n_intervals=0),
                     # Hidden stores for table state - using explicit memory storage
                     dcc.Store(id='table-current-page', data=1, storage_type='memory'),
                     dcc.Store(id='table-page-size', data=10, storage_type='memory'),
@@ -141,8 +157,8 @@ def create_browse_page():
                     dcc.Store(id='table-sort-order', data='desc', storage_type='memory'),
                     # Hidden stores for filter state
                     dcc.Store(id='filtered-samples', data=[]),
-                    # Download component for CSV export
-                    dcc.Download(id='download-csv'),
+                    # Last export format requested (the file itself is streamed by the backend)
+                    dcc.Store(id='export-request'),
                     html.Div(id='samples-table', 
                             style={
                                 'minHeight': '200px'
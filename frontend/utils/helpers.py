@@ -2,7 +2,7 @@ import requests
 import os
 from dash import html, dcc
 from datetime import datetime, timedelta
-from collections import Counter
+from collections import Counter, OrderedDict
 from .thresholds import get_threshold, get_percentage_of_range, is_within_safe_range
 try:
     import plotly.graph_objects as go
@@ -11,6 +11,10 @@ try:
 except ImportError:
     HAS_PLOTLY = False
 
+# Last (validators, body) per sample listing URL, reused when the backend answers 304
+_CONDITIONAL_CACHE_SIZE = 32
+_conditional_cache = OrderedDict()
+
 def get_backend_url():
     """Get the backend URL from environment variables"""
     return os.getenv("BACKEND_URL", "http://localhost:8000")
@@ -44,54 +48,16 @@ def format_date_catalan(date_obj, format_type='short'):
     else:
         return date_obj.strftime('%d/%m/%Y')
 
-def filter_samples_by_criteria(samples, date_from=None, date_to=None, location=None):
-    """Filter samples by date range and/or location"""
-    if not samples:
-        return []
-    
-    filtered_samples = samples.copy()
-    
-    # Filter by date range
-    if date_from or date_to:
-        date_filtered = []
-        for sample in filtered_samples:
-            sample_date_str = sample.get('data')
-            if sample_date_str:
-                try:
-                    sample_date = datetime.strptime(sample_date_str, '%Y-%m-%d')
-                    
-                    # Check date_from constraint
-                    if date_from:
-                        filter_date_from = datetime.strptime(date_from, '%Y-%m-%d')
-                        if sample_date < filter_date_from:
-                            continue
-                    
-                    # Check date_to constraint
-                    if date_to:
-                        filter_date_to = datetime.strptime(date_to, '%Y-%m-%d')
-                        if sample_date > filter_date_to:
-                            continue
-                    
-                    date_filtered.append(sample)
-                except ValueError:
-                    # Keep samples with invalid dates
-                    date_filtered.append(sample)
-            else:
-                # Keep samples without dates
-                date_filtered.append(sample)
-        
-        filtered_samples = date_filtered
-    
-    # Filter by location
+def build_sample_filter_params(date_from=None, date_to=None, location=None):
+    """Translate the browse page filters into /api/mostres query parameters"""
+    params = {}
+    if date_from:
+        params['date_from'] = date_from[:10]
+    if date_to:
+        params['date_to'] = date_to[:10]
     if location and location != 'all':
-        location_filtered = []
-        for sample in filtered_samples:
-            sample_location = sample.get('punt_mostreig', '')
-            if sample_location == location:
-                location_filtered.append(sample)
-        filtered_samples = location_filtered
-    
-    return filtered_samples
+        params['location'] = location
+    return params
 
 def get_unique_locations(samples):
     """Get unique sampling locations from samples"""
@@ -115,15 +81,35 @@ def fetch_parameters(backend_url):
         print(f"Error fetching parameters: {e}")
         return []
 
-def fetch_samples(backend_url):
-    """Fetch all samples from the backend API"""
+def fetch_samples(backend_url, params=None):
+    """Fetch samples from the backend API, optionally filtered server-side (see build_sample_filter_params)
+
+    Revalidates with If-None-Match so unchanged listings come back as an
+    empty 304 and the previous body is reused.
+    """
+    url = f"{backend_url}/api/mostres"
+    cache_key = (url, tuple(sorted((params or {}).items())))
+    cached = _conditional_cache.get(cache_key)
+    headers = {}
+    if cached:
+        headers['If-None-Match'] = cached['etag']
     try:
-        print(f"Fetching samples from: {backend_url}/api/mostres")
-        resp = requests.get(f"{backend_url}/api/mostres", timeout=10)
+        print(f"Fetching samples from: {url} {params or ''}")
+        resp = requests.get(url, params=params, headers=headers, timeout=10)
         print(f"Response status: {resp.status_code}")
+        if resp.status_code == 304 and cached:
+            _conditional_cache.move_to_end(cache_key)
+            print(f"Samples unchanged, reusing {_sample_count(cached['data'])} cached samples")
+            return cached['data']
         if resp.status_code == 200:
             data = resp.json()
-            print(f"Retrieved {len(data)} samples")
+            print(f"Retrieved {_sample_count(data)} samples")
+            etag = resp.headers.get('ETag')
+            if etag:
+                _conditional_cache[cache_key] = {'etag': etag, 'data': data}
+                _conditional_cache.move_to_end(cache_key)
+                while len(_conditional_cache) > _CONDITIONAL_CACHE_SIZE:
+                    _conditional_cache.popitem(last=False)
             return data
         else:
             print(f"Error response: {resp.status_code} - {resp.text}")
@@ -134,6 +120,39 @@ def fetch_samples(backend_url):
         traceback.print_exc()
         return []
 
+def _sample_count(data):
+    """Number of samples in a listing body, row (list) or columnar ({columns, data}) layout"""
+    if isinstance(data, dict):
+        columns = data.get('columns') or []
+        return len(data['data'][columns[0]]) if columns else 0
+    return len(data)
+
+def fetch_sample_locations(backend_url):
+    """Sorted sampling points that have validated samples
+
+    Asks for the single punt_mostreig column in columnar form, so the body is
+    one array of names instead of one object per sample.
+    """
+    data = fetch_samples(backend_url, {'fields': 'punt_mostreig', 'format': 'columnar'})
+    if not data:
+        return []
+    return sorted({location for location in data['data']['punt_mostreig'] if location})
+
+def fetch_sample_series(backend_url, parameter, location='all', bucket='day', agg='mean'):
+    """Fetch a parameter's time series per sampling point, aggregated by the backend"""
+    try:
+        params = {'parameter': parameter, 'bucket': bucket, 'agg': agg}
+        if location and location != 'all':
+            params['location'] = location
+        resp = requests.get(f"{backend_url}/api/mostres/series", params=params, timeout=10)
+        if resp.status_code == 200:
+            return resp.json().get('series', [])
+        print(f"Error getting series: {resp.status_code} - {resp.text}")
+        return []
+    except Exception as e:
+        print(f"Error fetching series for {parameter}: {e}")
+        return []
+
 def fetch_pending_samples_count(backend_url):
     """Fetch count of samples pending validation"""
     try:
@@ -151,8 +170,10 @@ def fetch_pending_samples_count(backend_url):
 def fetch_sample_by_id(backend_url, sample_id):
     """Fetch a specific sample by ID from the backend API"""
     try:
-        resp = requests.get(f"{backend_url}/api/mostres/{sample_id}")
-        return resp.json()
+        resp = requests.get(f"{backend_url}/api/mostres/{sample_id}", timeout=10)
+        if resp.status_code == 200:
+            return resp.json()
+        return None
     except Exception as e:
         print(f"Error fetching sample {sample_id}: {e}")
         return None
@@ -164,58 +185,20 @@ def fetch_latest_gualba_sample(backend_url):
 def fetch_latest_sample_by_location(backend_url, location):
     """Fetch the latest sample from a specific location"""
     try:
-        samples = fetch_samples(backend_url)
-        if not samples:
-            return None
-        
-        # Filter samples by location
-        if location:
-            location_samples = [s for s in samples if s.get('punt_mostreig', '').lower() == location.lower()]
-        else:
-            location_samples = samples
-        
-        if not location_samples:
-            return None
-            
-        # Sort by date descending to get the most recent
-        sorted_samples = sorted(location_samples,
-                                key=lambda x: x.get('data', ''), 
-                                reverse=True)
-        return sorted_samples[0] if sorted_samples else None
+        params = {'location': location} if location else None
+        resp = requests.get(f"{backend_url}/api/mostres/latest", params=params, timeout=10)
+        if resp.status_code == 200:
+            return resp.json()
+        if resp.status_code != 404:
+            print(f"Error getting latest sample: {resp.status_code} - {resp.text}")
+        return None
     except Exception as e:
         print(f"Error fetching latest sample for {location}: {e}")
         return None
 
 def fetch_latest_sample_any_location(backend_url):
-    """Fetch the latest sample from any location"""
-    try:
-        samples = fetch_samples(backend_url)
-        if not samples:
-            return None
-            
-        # Sort all samples by date descending to get the most recent
-        sorted_samples = sorted(samples,
-                                key=lambda x: x.get('data', ''), 
-                                reverse=True)
-        
-        # If there is a tie on date, get the one with more parameters reported
-        selected_sample = sorted_samples[0]
-        selected_sample_non_null_parameters = sum(1 for v in selected_sample.values() if v not in [None, ''])
-        for sample in sorted_samples[1:]:
-            if sample == selected_sample:
-                continue
-            
-            if sample.get('data') == selected_sample.get('data'):
-
-                count_next = sum(1 for v in sample.values() if v not in [None, ''])
-                if count_next > selected_sample_non_null_parameters:
-                    selected_sample = sample
-                    selected_sample_non_null_parameters = count_next
-
-        return selected_sample if sorted_samples else None
-    except Exception as e:
-        print(f"Error fetching latest sample from any location: {e}")
-        return None
+    """Fetch the latest sample from any location (ties on date go to the most complete sample)"""
+    return fetch_latest_sample_by_location(backend_url, None)
 
 def calculate_suma_haloacetics(sample):
     """Calculate the sum of the five haloacetic acids"""